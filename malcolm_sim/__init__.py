@@ -3,33 +3,90 @@ malcolm_sim - Simulator for Multi-Agent Learning for Cooperative Load Management
 
 Modules:
 - task: Contains Task that hold metadata of a simulated task
+- task_gen: Contains TaskGen and TaskMix that generate the tasks of one or several task classes
 - schedular: Contains Schedular which is the intra-node schedular of a Malcolm Node
+- slowdown: Contains Slowdown which models time-varying speed of cores and IOs
+- fault: Contains Fault and FaultInjector to inject node crashes and link degradation
+- checkpoint: Contains Checkpoint to snapshot, restore and fork a simulation
+- convergence: Contains ConvergenceMonitor for steady-state detection and early termination
+- rng: Contains RandomStreams, reproducible per-component random number streams
+- profiler: Contains Profiler for per-subsystem wall-clock profiling
+- tracer: Contains TaskTracer for sampled per-task latency breakdowns
+- memory: Contains MemoryMonitor to track the memory footprint of a run per subsystem
+- adaptive_slice: Contains AdaptiveTimeSlice to grow and shrink the time slice during a run
+- arrival: Contains ArrivalProcess and its Poisson, MMPP, on/off and diurnal arrival processes
+- analytic: Contains AnalyticEstimator, a closed-form M/G/c estimate to pre-screen configs
+- histogram: Contains Histogram, a log-binned histogram for latency percentiles
+- capacity: Contains CapacitySearch to find the maximum sustainable task rate
+- telemetry: Contains TelemetryServer, a Prometheus endpoint with live metrics of a run
+- results: Contains ResultStore, an SQLite store of runs for comparisons
+- golden: Contains GoldenTrace to diff the results of an engine against the reference engine
 """
 
 from .iec_int import IEC_Int
-from .malcolm_sim import MalcolmSim
+from .adaptive_slice import AdaptiveTimeSlice
+from .analytic import AnalyticEstimator
+from .arrival import ArrivalProcess, PoissonArrival, MMPPArrival, OnOffArrival, DiurnalArrival
+from .capacity import CapacitySearch
+from .checkpoint import Checkpoint
+from .convergence import ConvergenceMonitor
+from .fault import Fault, FaultInjector
+from .golden import GoldenTrace, Tolerance
+from .histogram import Histogram
+from .malcolm_sim import MalcolmSim, MetricBatch
 from .malcolm_node import MalcolmNode
+from .memory import MemoryMonitor
 from .load_manager import LoadManager
 from .policy_optimizer import PolicyOptimizer
+from .profiler import Profiler
+from .results import ResultStore
+from .rng import RandomStreams
 from .schedular import Schedular
+from .slowdown import Slowdown
 from .network import Network
 from .heartbeat import Heartbeat
 from .task import Task
-from .task_gen import TaskGen
+from .task_gen import TaskGen, TaskMix
+from .telemetry import TelemetryServer
 from .central_loadbalancer import CentralLoadBalancer
 from .thread_safe_list import ThreadSafeList
+from .tracer import TaskTracer
 
 __all__ = [
     "IEC_Int",
+    "AdaptiveTimeSlice",
+    "AnalyticEstimator",
+    "ArrivalProcess",
+    "PoissonArrival",
+    "MMPPArrival",
+    "OnOffArrival",
+    "DiurnalArrival",
+    "CapacitySearch",
+    "Checkpoint",
+    "ConvergenceMonitor",
+    "Fault",
+    "FaultInjector",
+    "GoldenTrace",
+    "Tolerance",
+    "Histogram",
     "MalcolmSim",
+    "MetricBatch",
     "MalcolmNode",
+    "MemoryMonitor",
     "LoadManager",
     "PolicyOptimizer",
+    "Profiler",
+    "ResultStore",
+    "RandomStreams",
     "Schedular",
+    "Slowdown",
     "Network",
     "Heartbeat",
     "Task",
     "TaskGen",
+    "TaskMix",
+    "TelemetryServer",
     "CentralLoadBalancer",
-    "ThreadSafeList"
+    "ThreadSafeList",
+    "TaskTracer"
 ]
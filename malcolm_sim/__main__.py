@@ -0,0 +1,7 @@
+"""Run the malcolm_sim command line interface with python -m malcolm_sim"""
+
+import sys
+
+from .cli import main
+
+sys.exit(main())
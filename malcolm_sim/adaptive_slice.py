@@ -0,0 +1,132 @@
+"""Contains malcolm_sim.AdaptiveTimeSlice to control the time slice during a run"""
+
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING, Dict, List
+
+import numpy as np
+
+from .malcolm_node import MalcolmNode
+
+if TYPE_CHECKING:
+    from .malcolm_sim import MalcolmSim
+
+
+def resample(metrics:Dict[str, Dict[str, List[float]]], times:List[float],
+             step:float, end:float=None) -> Dict[str, Dict[str, List[float]]]:
+    """
+    Resample metrics sampled at (non-uniform) times onto a uniform grid with
+    the given step. Each grid point takes the value of the last sample at or
+    before it (zero-order hold), matching the per-slice metrics of MalcolmSim
+    """
+    times = np.asarray(times, dtype=float)
+    if end is None:
+        end = times[-1]
+    grid = np.arange(times[0], end + step/2, step)
+    index = np.maximum(np.searchsorted(times, grid, side="right") - 1, 0)
+    return {
+        metric_name: {
+            node_name: np.asarray(values)[index].tolist()
+            for node_name,values in metric.items()
+        }
+        for metric_name,metric in metrics.items()
+    }
+
+
+class AdaptiveTimeSlice:
+    """
+    Grows the time slice during idle or steady periods and shrinks it around
+    arrival bursts, queue build-ups and policy changes, within
+    [min_slice, max_slice] milliseconds
+    """
+
+    logger = logging.getLogger("malcolm_sim.AdaptiveTimeSlice")
+
+    def __init__(self,
+                 min_slice:float=0.1,
+                 max_slice:float=10,
+                 grow:float=1.5,
+                 shrink:float=0.5,
+                 queue_delta:int=2,
+                 burst_ratio:float=2.0,
+                 policy_delta:float=0.25,
+                 report_slice:float=None
+    ) -> None:
+        """
+        queue_delta: change in the total number of queued tasks in a slice that
+            counts as a queue build-up
+        burst_ratio: arrivals over the moving average that count as a burst,
+            in addition to queue_delta tasks so single arrivals in short
+            slices do not count
+        policy_delta: change of any LoadManager accept ratio that counts as a
+            policy change
+        report_slice: grid step of the resampled metrics, defaults to the
+            initial time slice of the run
+        """
+        if not 0 < min_slice <= max_slice:
+            raise ValueError("AdaptiveTimeSlice requires 0 < min_slice <= max_slice")
+        self.min_slice:float = min_slice
+        self.max_slice:float = max_slice
+        self.grow:float = grow
+        self.shrink:float = shrink
+        self.queue_delta:int = queue_delta
+        self.burst_ratio:float = burst_ratio
+        self.policy_delta:float = policy_delta
+        self.report_slice:float = report_slice
+        self.reset()
+
+
+    def reset(self) -> None:
+        """Forget the state of the previous run"""
+        self.prev_queue:int = 0
+        self.prev_generated:int = 0
+        self.prev_policy:Dict[str, float] = {}
+        self.arrival_rate:float = None      # moving average of tasks/ms
+        self.changes:Dict[str, int] = {"grow": 0, "shrink": 0}
+
+
+    def clamp(self, time_slice:float) -> float:
+        """Bound time_slice within [min_slice, max_slice]"""
+        return min(max(time_slice, self.min_slice), self.max_slice)
+
+
+    def next_slice(self, time_slice:float, sim:MalcolmSim) -> float:
+        """Choose the length of the next time slice after simulating time_slice"""
+        queue = 0
+        policy = {}
+        for node in MalcolmNode.all_nodes.values():
+            queue += len(node.schedular.queue) + len(node.schedular.io_queue) \
+                + len(node.task_inbox) + len(node.tx_queue)
+            policy[node.name] = node.load_manager.accept
+        arrivals = sim.generated - self.prev_generated
+        rate = arrivals / time_slice
+        burst = self.arrival_rate is not None \
+            and arrivals > self.burst_ratio * self.arrival_rate * time_slice + self.queue_delta
+        build_up = abs(queue - self.prev_queue) > self.queue_delta
+        policy_change = any(
+            abs(accept - self.prev_policy.get(name, accept)) > self.policy_delta
+            for name,accept in policy.items()
+        )
+        if burst or build_up or policy_change:
+            new_slice = time_slice * self.shrink
+            self.changes["shrink"] += 1
+            self.logger.debug(
+                "Shrinking time slice (burst=%s, build_up=%s, policy_change=%s)",
+                burst, build_up, policy_change
+            )
+        elif queue == self.prev_queue:
+            new_slice = time_slice * self.grow
+            self.changes["grow"] += 1
+        else:
+            new_slice = time_slice
+        # Update moving average of the arrival rate (weighted by slice length)
+        if self.arrival_rate is None:
+            self.arrival_rate = rate
+        else:
+            alpha = min(1.0, time_slice / (10*self.max_slice))
+            self.arrival_rate += alpha * (rate - self.arrival_rate)
+        self.prev_queue = queue
+        self.prev_generated = sim.generated
+        self.prev_policy = policy
+        return self.clamp(new_slice)
@@ -0,0 +1,300 @@
+"""
+Contains malcolm_sim.AnalyticEstimator, a closed-form M/G/c estimate of a
+cluster config used to pre-screen configurations before simulating them
+"""
+
+from __future__ import annotations
+
+import copy
+import math
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Tuple
+
+from .arrival import ArrivalProcess
+from .task_gen import class_configs
+
+
+def erlang_c(servers:int, load:float) -> float:
+    """
+    Probability that an arrival has to wait in an M/M/c queue with the given
+    number of servers and offered load (arrival rate * mean service time)
+    """
+    if load <= 0:
+        return 0.0
+    if load >= servers:
+        return 1.0
+    # Erlang B recursion is numerically stable for large server counts
+    b = 1.0
+    for k in range(1, servers+1):
+        b = load*b / (k + load*b)
+    rho = load / servers
+    return b / (1 - rho*(1 - b))
+
+
+def distribution_moments(params:dict) -> Tuple[float, float]:
+    """
+    First and second moment of a TaskGen distribution from its config dict.
+    Negative samples are zeroized by TaskGen, so gaussians are rectified at 0
+    """
+    _type = params["type"]
+    if _type in ["const", "constant"]:
+        value = max(float(params["value"]), 0)
+        return value, value*value
+    if _type in ["gaussian", "normal"]:
+        from statistics import NormalDist   # pylint: disable=import-outside-toplevel
+        mu, sigma = float(params["center"]), float(params["scale"])
+        z = mu / sigma
+        cdf, pdf = NormalDist().cdf(z), NormalDist().pdf(z)
+        return mu*cdf + sigma*pdf, (mu*mu + sigma*sigma)*cdf + mu*sigma*pdf
+    if _type == "lognormal":
+        mu, sigma = float(params["mu"]), float(params["sigma"])
+        return math.exp(mu + sigma*sigma/2), math.exp(2*mu + 2*sigma*sigma)
+    if _type == "pareto":
+        shape, scale = float(params["shape"]), float(params["scale"])
+        m1 = shape*scale / (shape-1) if shape > 1 else math.inf
+        m2 = shape*scale*scale / (shape-2) if shape > 2 else math.inf
+        return m1, m2
+    if _type == "empirical":
+        values = [float(x) for x in params["values"]]
+        weights = params.get("weights") or [1.0]*len(values)
+        total = sum(weights)
+        if len(weights) != len(values) or total <= 0:
+            raise ValueError("empirical requires one weight per value and a positive total weight")
+        m1 = sum(w*max(x, 0) for x,w in zip(values, weights)) / total
+        m2 = sum(w*max(x, 0)**2 for x,w in zip(values, weights)) / total
+        return m1, m2
+    raise ValueError(f"Task parameter type '{_type}' is invalid")
+
+
+@dataclass
+class StationEstimate:
+    """Allen-Cunneen M/G/c estimate of the cores or IO units of a node"""
+    servers:int
+    arrival_rate:float      # visits/ms
+    service_time:float      # mean ms per visit
+    service_scv:float       # squared coefficient of variation of the service time
+    utilization:float
+    queue_length:float      # mean number of waiting visits
+    wait:float              # mean ms waiting per visit
+
+    @property
+    def stable(self) -> bool:
+        """True if the station keeps up with its arrivals"""
+        return self.utilization < 1
+
+
+@dataclass
+class NodeEstimate:
+    """Analytic estimate of a Malcolm Node"""
+    name:str
+    arrival_rate:float      # tasks/ms
+    cpu:StationEstimate
+    io:StationEstimate
+    latency:float           # mean ms from arrival to completion
+
+    @property
+    def stable(self) -> bool:
+        """True if both the cores and the IO units keep up"""
+        return self.cpu.stable and self.io.stable
+
+    @property
+    def latency_us(self) -> float:
+        """Mean latency in microseconds"""
+        return self.latency * 1000
+
+    def as_dict(self) -> Dict[str, any]:
+        """This estimate as a JSON serializable dict"""
+        rval = asdict(self)
+        rval["stable"] = self.stable
+        rval["latency_us"] = self.latency_us
+        return rval
+
+
+@dataclass
+class AnalyticEstimator:
+    """
+    Closed-form estimate of utilization, queue length and latency of every
+    node of a cluster config. Each node is modelled as an M/G/c queue for its
+    cores and one for its IO units, using the Allen-Cunneen approximation.
+    Heterogeneous units are pooled at their mean performance.
+
+    With balance "capacity", arrivals are shared in proportion to the maximum
+    throughput of each node, as the Load Managers forward tasks away from
+    slow nodes. With "even", every node gets the same share (the
+    CentralLoadBalancer round robin alone). weights overrides either by node
+    name. Network transfer and slowdowns are not modelled. Task classes are
+    pooled into one workload weighted by their arrival rates, priorities
+    are not modelled
+    """
+
+    nodes:List[dict]
+    tasks:dict
+    arrival_scv:float = 1.0     # 1 for Poisson arrivals
+    balance:str = "capacity"
+    weights:Dict[str, float] = field(default_factory=dict)
+
+
+    @classmethod
+    def from_config(cls, config:dict, **kwargs) -> AnalyticEstimator:
+        """Create an estimator from a config dict (validated against the config schema)"""
+        from .malcolm_sim import MalcolmSim     # pylint: disable=import-outside-toplevel
+        config = MalcolmSim.get_config_schema().validate(copy.deepcopy(config))
+        return cls(config["MalcolmNodes"], config["Tasks"], **kwargs)
+
+
+    def stages(self) -> List[Tuple[str, float, float]]:
+        """
+        (kind, mean, second moment) of the time of every task stage. The
+        stages of task classes are mixed in proportion to their arrival
+        rates; classes with different stage kinds are first collapsed to one
+        cpu and one io stage of their total times
+        """
+        classes = class_configs(self.tasks)
+        if len(classes) == 1:
+            return self._class_stages(classes[0])
+        stages = [self._class_stages(x) for x in classes]
+        if any([kind for kind,*_ in x] != [kind for kind,*_ in stages[0]] for x in stages):
+            stages = [[self._total(x, "cpu"), self._total(x, "io")] for x in stages]
+        rates = [self._class_rate(x) for x in classes]
+        total = sum(rates)
+        return [
+            (
+                kind,
+                sum(rate * x[i][1] for rate,x in zip(rates, stages)) / total,
+                sum(rate * x[i][2] for rate,x in zip(rates, stages)) / total,
+            )
+            for i,(kind,*_) in enumerate(stages[0])
+        ]
+
+
+    @staticmethod
+    def _class_stages(tasks:dict) -> List[Tuple[str, float, float]]:
+        """(kind, mean, second moment) of every stage of one task class"""
+        if "stages" in tasks:
+            return [
+                (stage["kind"], *distribution_moments(stage["time"]))
+                for stage in tasks["stages"]
+            ]
+        return [
+            ("cpu", *distribution_moments(tasks["runtime"])),
+            ("io", *distribution_moments(tasks["io_time"])),
+        ]
+
+
+    @staticmethod
+    def _total(stages:List[Tuple[str, float, float]], kind:str) -> Tuple[str, float, float]:
+        """Moments of the total time of the independent stages of a kind"""
+        m1 = sum(x for k,x,_ in stages if k == kind)
+        m2 = sum(x2 - x*x for k,x,x2 in stages if k == kind) + m1*m1
+        return kind, m1, m2
+
+
+    @staticmethod
+    def _class_rate(tasks:dict) -> float:
+        """Mean arrival rate of one task class in tasks/ms"""
+        if "arrival" in tasks:
+            return ArrivalProcess.from_config(tasks["arrival"]).mean_rate() * 1000
+        return distribution_moments(tasks["rate"])[0] * 1000
+
+
+    def arrival_rate(self) -> float:
+        """Mean task arrival rate of the whole cluster in tasks/ms"""
+        return sum(self._class_rate(x) for x in class_configs(self.tasks))
+
+
+    def node_weights(self) -> Dict[str, float]:
+        """Relative share of the arrivals of every node"""
+        if self.balance not in ("capacity", "even"):
+            raise ValueError(f"Unknown balance '{self.balance}', expected capacity or even")
+        stages = self.stages()
+        rval = {}
+        for node in self.nodes:
+            if self.balance == "even":
+                rval[node["name"]] = 1.0
+                continue
+            # Tasks/ms at which the busiest station of the node saturates
+            demand_cpu = sum(m1/self._mean_perf(node.get("core_perf", 1)) + node["overhead"]
+                             for kind,m1,_ in stages if kind == "cpu")
+            demand_io = sum(m1/self._mean_perf(node.get("io_perf", 1))
+                            for kind,m1,_ in stages if kind == "io")
+            rval[node["name"]] = min(
+                int(node["core_count"])/demand_cpu if demand_cpu > 0 else math.inf,
+                int(node["io_count"])/demand_io if demand_io > 0 else math.inf,
+            )
+        if any(math.isinf(x) for x in rval.values()):
+            rval = {name: 1.0 for name in rval}
+        rval.update(self.weights)
+        return rval
+
+
+    def estimate(self) -> Dict[str, NodeEstimate]:
+        """Estimate every node, keyed by node name"""
+        weights = self.node_weights()
+        total_weight = sum(weights.values())
+        rate = self.arrival_rate()
+        stages = self.stages()
+        rval = {}
+        for node in self.nodes:
+            node_rate = rate * weights[node["name"]] / total_weight
+            cpu = self.station(
+                node_rate, int(node["core_count"]), self._mean_perf(node.get("core_perf", 1)),
+                [(m1, m2) for kind,m1,m2 in stages if kind == "cpu"], node["overhead"]
+            )
+            io = self.station(
+                node_rate, int(node["io_count"]), self._mean_perf(node.get("io_perf", 1)),
+                [(m1, m2) for kind,m1,m2 in stages if kind == "io"], 0
+            )
+            visits = [sum(1 for kind,*_ in stages if kind == x) for x in ("cpu", "io")]
+            latency = visits[0]*(cpu.wait + cpu.service_time) + visits[1]*(io.wait + io.service_time)
+            rval[node["name"]] = NodeEstimate(node["name"], node_rate, cpu, io, latency)
+        return rval
+
+
+    def station(self, task_rate:float, servers:int, perf:float,
+                stages:List[Tuple[float, float]], overhead:float) -> StationEstimate:
+        """
+        M/G/c estimate of servers units of the given mean performance that
+        every task visits once per stage. Stage moments are in unscaled ms,
+        overhead is added to every visit at speed 1
+        """
+        if not stages or task_rate <= 0:
+            return StationEstimate(servers, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        visit_rate = task_rate * len(stages)
+        # Moments of the mixture of all visits
+        m1 = sum(x/perf + overhead for x,_ in stages) / len(stages)
+        m2 = sum(x2/perf**2 + 2*overhead*x/perf + overhead**2 for x,x2 in stages) / len(stages)
+        if math.isinf(m1):
+            scv = math.inf
+        else:
+            scv = (m2 - m1*m1) / (m1*m1) if m1 > 0 else 0.0
+        load = visit_rate * m1
+        utilization = load / servers
+        if utilization >= 1:
+            wait = math.inf
+        else:
+            wait = erlang_c(servers, load) / (servers/m1 - visit_rate) \
+                * (self.arrival_scv + scv) / 2
+        return StationEstimate(
+            servers, visit_rate, m1, scv, utilization, visit_rate*wait, wait
+        )
+
+
+    @staticmethod
+    def _mean_perf(perf:(float|List[float])) -> float:
+        """Mean performance multiplier of a node's units"""
+        if isinstance(perf, (list, tuple)):
+            return sum(perf) / len(perf)
+        return float(perf)
+
+
+    def summary(self) -> Dict[str, any]:
+        """JSON serializable estimate of the cluster and every node"""
+        nodes = self.estimate()
+        return {
+            "arrival_rate": self.arrival_rate(),
+            "stable": all(node.stable for node in nodes.values()),
+            "max_utilization": max(
+                max(node.cpu.utilization, node.io.utilization) for node in nodes.values()
+            ),
+            "nodes": {name: node.as_dict() for name,node in nodes.items()},
+        }
@@ -0,0 +1,210 @@
+"""
+Contains malcolm_sim.ArrivalProcess and its Poisson, Markov-modulated
+Poisson (MMPP), on/off and diurnal implementations. Arrival times are
+generated vectorized for a block of time at once and consumed per time slice
+"""
+
+from __future__ import annotations
+
+import math
+from typing import List, Tuple
+
+import numpy as np
+from numpy.random import Generator, default_rng
+
+
+def scale_arrival_config(params:dict, factor:float) -> dict:
+    """Copy of an arrival config dict with all its rates multiplied by factor"""
+    params = dict(params)
+    if "rate" in params:
+        params["rate"] = float(params["rate"]) * factor
+    if "rates" in params:
+        params["rates"] = [float(x) * factor for x in params["rates"]]
+    return params
+
+
+class ArrivalProcess:
+    """
+    Base class of arrival processes. Subclasses describe the arrival rate as
+    piecewise constant segments; arrivals within a segment are Poisson. Rates
+    are in tasks/us like the Tasks rate of the config, times in ms
+    """
+
+    def __init__(self, block:float=1000, rng:Generator=None) -> None:
+        """
+        block: ms of arrivals generated at once
+        rng: random stream of this process, a fresh unseeded one if None
+        """
+        self.block:float = block
+        self.rng:Generator = rng if rng is not None else default_rng()
+        self.reset()
+
+
+    @classmethod
+    def from_config(cls, config:dict, rng:Generator=None) -> ArrivalProcess:
+        """Create an arrival process from config dict. Assumes schema is validated"""
+        params = dict(config)
+        _type = params.pop("type")
+        if _type == "poisson":
+            return PoissonArrival(**params, rng=rng)
+        if _type == "mmpp":
+            return MMPPArrival(**params, rng=rng)
+        if _type == "onoff":
+            return OnOffArrival(**params, rng=rng)
+        if _type == "diurnal":
+            return DiurnalArrival(**params, rng=rng)
+        raise ValueError(f"Arrival process type '{_type}' is invalid")
+
+
+    def reset(self) -> None:
+        """Restart the process at time 0"""
+        self.time:float = 0.0                   # end of the generated arrivals
+        self.pending:np.ndarray = np.empty(0)   # sorted arrival times not yet consumed
+
+
+    def mean_rate(self) -> float:
+        """Long-run mean arrival rate in tasks/us"""
+        raise NotImplementedError
+
+
+    def segments(self, start:float, length:float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Start times, lengths and rates (tasks/us) of the segments covering [start, start+length)"""
+        raise NotImplementedError
+
+
+    def count(self, end:float) -> int:
+        """Consume and return the number of arrivals before end"""
+        while self.time < end:
+            starts, lengths, rates = self.segments(self.time, self.block)
+            self.pending = np.concatenate((self.pending, self._arrival_times(starts, lengths, rates)))
+            self.time += self.block
+        num = int(np.searchsorted(self.pending, end, side="left"))
+        self.pending = self.pending[num:]
+        return num
+
+
+    def _arrival_times(self, starts:np.ndarray, lengths:np.ndarray, rates:np.ndarray) -> np.ndarray:
+        """Sorted Poisson arrival times within every segment"""
+        counts = self.rng.poisson(np.maximum(rates, 0) * 1000 * lengths)
+        times = np.repeat(starts, counts) + self.rng.random(counts.sum()) * np.repeat(lengths, counts)
+        times.sort()
+        return times
+
+
+class PoissonArrival(ArrivalProcess):
+    """Homogeneous Poisson arrivals"""
+
+    def __init__(self, rate:float, block:float=1000, rng:Generator=None) -> None:
+        self.rate:float = rate
+        super().__init__(block, rng)
+
+    def mean_rate(self) -> float:
+        return self.rate
+
+    def segments(self, start:float, length:float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return np.array([start]), np.array([length]), np.array([self.rate])
+
+
+class MMPPArrival(ArrivalProcess):
+    """
+    Markov-modulated Poisson arrivals. The process stays in state i for an
+    exponential time with mean durations[i] ms, arriving at rates[i], then
+    moves to state j with probability transitions[i][j] (default: uniformly
+    to any other state)
+    """
+
+    def __init__(self,
+                 rates:List[float],
+                 durations:List[float],
+                 transitions:List[List[float]]=None,
+                 block:float=1000,
+                 rng:Generator=None
+    ) -> None:
+        if len(rates) != len(durations) or len(rates) < 2:
+            raise ValueError("MMPP requires at least 2 states with one rate and duration each")
+        n = len(rates)
+        if transitions is None:
+            transitions = [[0 if i == j else 1/(n-1) for j in range(n)] for i in range(n)]
+        transitions = np.asarray(transitions, dtype=float)
+        if transitions.shape != (n, n):
+            raise ValueError(f"MMPP transitions must be a {n}x{n} matrix")
+        self.rates:np.ndarray = np.asarray(rates, dtype=float)
+        self.durations:np.ndarray = np.asarray(durations, dtype=float)
+        self.transitions:np.ndarray = transitions / transitions.sum(axis=1, keepdims=True)
+        super().__init__(block, rng)
+
+    def reset(self) -> None:
+        super().reset()
+        self.state:int = 0
+        self.state_end:float = self.rng.exponential(self.durations[0])
+
+    def mean_rate(self) -> float:
+        # Stationary distribution of the embedded chain weighted by mean sojourn
+        values, vectors = np.linalg.eig(self.transitions.T)
+        pi = np.real(vectors[:, np.argmin(np.abs(values - 1))])
+        share = pi / pi.sum() * self.durations
+        return float((share * self.rates).sum() / share.sum())
+
+    def segments(self, start:float, length:float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        end = start + length
+        starts, lengths, rates = [], [], []
+        t = start
+        while t < end:
+            seg_end = min(self.state_end, end)
+            starts.append(t)
+            lengths.append(seg_end - t)
+            rates.append(self.rates[self.state])
+            if self.state_end <= end:
+                self.state = self.rng.choice(len(self.rates), p=self.transitions[self.state])
+                self.state_end += self.rng.exponential(self.durations[self.state])
+            t = seg_end
+        return np.array(starts), np.array(lengths), np.array(rates)
+
+
+class OnOffArrival(MMPPArrival):
+    """
+    Bursts of Poisson arrivals at rate lasting on_time ms on average, separated
+    by off_time ms of silence on average
+    """
+
+    def __init__(self, rate:float, on_time:float, off_time:float,
+                 block:float=1000, rng:Generator=None) -> None:
+        super().__init__([rate, 0.0], [on_time, off_time], block=block, rng=rng)
+
+
+class DiurnalArrival(ArrivalProcess):
+    """
+    Poisson arrivals at rate * (1 + amplitude*sin(2*pi*(t+phase)/period)),
+    times a factor (1 + noise*N(0,1)) drawn every resolution ms
+    """
+
+    def __init__(self,
+                 rate:float,
+                 period:float,
+                 amplitude:float=0.5,
+                 phase:float=0,
+                 noise:float=0,
+                 resolution:float=1,
+                 block:float=1000,
+                 rng:Generator=None
+    ) -> None:
+        self.rate:float = rate
+        self.period:float = period
+        self.amplitude:float = amplitude
+        self.phase:float = phase
+        self.noise:float = noise
+        self.resolution:float = resolution
+        super().__init__(block, rng)
+
+    def mean_rate(self) -> float:
+        return self.rate
+
+    def segments(self, start:float, length:float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        starts = start + np.arange(0, length, self.resolution)
+        lengths = np.minimum(self.resolution, start + length - starts)
+        rates = self.rate * (1 + self.amplitude*np.sin(
+            2*math.pi * (starts + lengths/2 + self.phase) / self.period
+        ))
+        if self.noise:
+            rates *= np.maximum(1 + self.noise*self.rng.standard_normal(len(starts)), 0)
+        return starts, lengths, rates
@@ -0,0 +1,354 @@
+"""
+Benchmark suite for the hot paths of the simulator and end-to-end scaling.
+
+Results are written as JSON and appended to a JSON Lines history file so that
+each run can be compared against the previous run of the same engine.
+
+With --golden FILE, the suite also replays a golden trace (recorded on first
+use) through the engine and fails if the results differ (see golden.py).
+
+Usage: python -m malcolm_sim.benchmark [--quick] [--output FILE] [--history FILE] [--golden FILE]
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List
+
+from .golden import GoldenTrace, Tolerance, diff
+from .malcolm_node import MalcolmNode
+from .malcolm_sim import MalcolmSim
+from .schedular import Schedular
+from .task import Task
+from .task_gen import TaskGen
+
+
+DEFAULT_HISTORY = "bench_history.jsonl"
+REGRESSION_THRESHOLD = 1.2     # flag results more than 20% slower than last run
+
+# Budget for "import malcolm_sim" in a fresh interpreter, excluding numpy which
+# the simulation core requires, and modules that must only load when used
+IMPORT_BUDGET = 0.050
+LAZY_MODULES = ("matplotlib", "yaml", "schema", "concurrent.futures", "sqlite3", "tracemalloc")
+
+
+def cluster_config(num_nodes:int, rate:float=0.001) -> dict:
+    """Config of a cluster of num_nodes identical nodes with rate tasks/us per node"""
+    return {
+        "MalcolmNodes": [
+            {
+                "name": f"Node{i}",
+                "core_count": 8,
+                "io_count": 32,
+                "overhead": 0,
+                "bandwidth": "1G",
+            }
+            for i in range(num_nodes)
+        ],
+        "Tasks": {
+            "rate": {"type": "constant", "value": rate*num_nodes},
+            "runtime": {"type": "gaussian", "center": 7, "scale": 3},
+            "io_time": {"type": "constant", "value": 1},
+            "payload": {"type": "constant", "value": 128},
+        }
+    }
+
+
+class Benchmark:
+    """Runs the benchmark suite and keeps the results"""
+
+    logger = logging.getLogger("malcolm_sim.Benchmark")
+
+    def __init__(self, quick:bool=False, repeat:int=5, engine:str="reference",
+                 golden:str=None, tolerance:Tolerance=None) -> None:
+        self.quick:bool = quick
+        self.repeat:int = repeat if not quick else 2
+        self.engine:str = engine
+        self.golden:str = golden
+        self.tolerance:Tolerance = tolerance
+        self.results:List[Dict[str, any]] = []
+
+
+    def measure(self, name:str, params:Dict[str, any], func:Callable,
+                setup:Callable=None, repeat:int=None) -> Dict[str, any]:
+        """Time func repeat times, calling setup (untimed) before each call"""
+        times = []
+        for _ in range(repeat or self.repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        result = {
+            "name": name,
+            "params": params,
+            "median": statistics.median(times),
+            "min": min(times),
+            "repeat": len(times),
+        }
+        self.results.append(result)
+        self.logger.info("%s %s: %.6f s", name, params, result["median"])
+        return result
+
+
+    def bench_import(self) -> None:
+        """Import time of the package in a fresh interpreter, checked against IMPORT_BUDGET"""
+        code = "import sys, time, numpy, numpy.random\n" \
+            + "start = time.perf_counter()\n" \
+            + "import malcolm_sim\n" \
+            + "print(time.perf_counter() - start)\n" \
+            + f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+        times = []
+        loaded = ""
+        for _ in range(self.repeat):
+            proc = subprocess.run(
+                [sys.executable, "-c", code],
+                capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            )
+            elapsed, loaded = (proc.stdout.splitlines() + [""])[:2]
+            times.append(float(elapsed))
+        result = {
+            "name": "import malcolm_sim",
+            "params": {"preloaded": "numpy"},
+            "median": statistics.median(times),
+            "min": min(times),
+            "repeat": len(times),
+            "budget": IMPORT_BUDGET,
+            "lazy_modules_loaded": loaded.split(",") if loaded else [],
+        }
+        result["over_budget"] = result["median"] > IMPORT_BUDGET or bool(loaded)
+        if result["over_budget"]:
+            self.logger.warning(
+                "import malcolm_sim took %.3f s (budget %.3f s), eagerly loaded: %s",
+                result["median"], IMPORT_BUDGET, loaded or "-"
+            )
+        self.results.append(result)
+
+
+    def bench_schedular(self) -> None:
+        """Schedular.sim_time_slice at several CPU queue depths"""
+        depths = [10, 100, 1000] if self.quick else [10, 100, 1000, 10000]
+        for depth in depths:
+            schedular = Schedular("bench", 8, 1, 32, 1, 0)
+            count = [0]
+            def refill(schedular=schedular, depth=depth, count=count):
+                tasks = []
+                while len(schedular.queue) + len(tasks) < depth:
+                    tasks.append(Task(f"#{count[0]}", 7, 1, 128))
+                    count[0] += 1
+                schedular.add_tasks(tasks)
+            self.measure(
+                "Schedular.sim_time_slice", {"queue_depth": depth},
+                lambda schedular=schedular: schedular.sim_time_slice(1), setup=refill
+            )
+
+
+    def bench_task_gen(self) -> None:
+        """TaskGen.gen_time_slice at several rates (tasks/us)"""
+        for rate in [0.001, 0.01, 0.1]:
+            task_gen = TaskGen.from_config(cluster_config(1, rate)["Tasks"])
+            self.measure(
+                "TaskGen.gen_time_slice", {"rate": rate},
+                lambda task_gen=task_gen: task_gen.gen_time_slice(1, 0)
+            )
+
+
+    def bench_route_packets(self) -> None:
+        """MalcolmNode.route_packets of one slice of all-to-all heartbeats"""
+        sizes = [2, 8, 32, 128] if self.quick else [2, 8, 32, 128, 512]
+        for num_nodes in sizes:
+            MalcolmSim.reset()
+            MalcolmSim.from_config(cluster_config(num_nodes))
+            nodes = list(MalcolmNode.all_nodes.values())
+            packets = [
+                src.get_heartbeat_packet(f"MalcolmNode:{dest.name}")
+                for src in nodes for dest in nodes if src is not dest
+            ]
+            self.measure(
+                "MalcolmNode.route_packets", {"nodes": num_nodes},
+                lambda packets=packets: MalcolmNode.route_packets(packets)
+            )
+        MalcolmSim.reset()
+
+
+    def bench_run(self) -> None:
+        """End-to-end MalcolmSim.run scaling with node count and simulated time"""
+        sizes = [2, 8] if self.quick else [2, 4, 8, 16]
+        sim_times = [100] if self.quick else [250, 1000]
+        for num_nodes in sizes:
+            for sim_time in sim_times:
+                sims = []
+                def setup(num_nodes=num_nodes, sims=sims):
+                    MalcolmSim.reset()
+                    sims[:] = [MalcolmSim.from_config(cluster_config(num_nodes))]
+                self.measure(
+                    "MalcolmSim.run", {"nodes": num_nodes, "sim_time": sim_time},
+                    lambda sims=sims, sim_time=sim_time: sims[0].run(1, sim_time),
+                    setup=setup, repeat=min(self.repeat, 3)
+                )
+        MalcolmSim.reset()
+
+
+    def bench_golden(self) -> None:
+        """
+        Replay the golden trace through the engine and diff it against the
+        trace. The trace is recorded with the reference engine if the file
+        does not exist yet
+        """
+        if not self.golden:
+            return
+        engine = self.engine if self.engine in MalcolmSim.ENGINES else "reference"
+        if os.path.exists(self.golden):
+            reference = GoldenTrace.load(self.golden)
+        else:
+            reference = GoldenTrace.record(cluster_config(4), 1, 500)
+            reference.save(self.golden)
+            self.logger.warning("Recorded golden trace %s", self.golden)
+        traces = []
+        result = self.measure(
+            "golden trace replay", {"engine": engine},
+            lambda: traces.append(reference.replay(engine)), repeat=1
+        )
+        report = diff(reference, traces[-1], self.tolerance)
+        result["golden"] = self.golden
+        result["passed"] = report["passed"]
+        result["diff"] = {
+            key: value for key,value in report.items() if key != "metrics"
+        }
+        result["diff"]["failed_metrics"] = [
+            name for name,metric in report["metrics"].items() if not metric["passed"]
+        ]
+        if not report["passed"]:
+            self.logger.warning("Golden trace mismatch: %s", result["diff"])
+        MalcolmSim.reset()
+
+
+    def run(self) -> List[Dict[str, any]]:
+        """Run all benchmarks"""
+        level = MalcolmSim.logger.level
+        MalcolmSim.logger.setLevel(logging.WARNING)
+        try:
+            self.results = []
+            self.bench_import()
+            self.bench_schedular()
+            self.bench_task_gen()
+            self.bench_route_packets()
+            self.bench_run()
+            self.bench_golden()
+        finally:
+            MalcolmSim.logger.setLevel(level)
+        return self.results
+
+
+    def report(self) -> Dict[str, any]:
+        """Machine-readable report of the last run"""
+        return {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "engine": self.engine,
+            "quick": self.quick,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": self.results,
+        }
+
+
+def load_history(filename:str, engine:str=None) -> List[Dict[str, any]]:
+    """Load previous reports from a JSON Lines history file"""
+    if not os.path.exists(filename):
+        return []
+    with open(filename, "r", encoding="utf-8") as f:
+        history = [json.loads(line) for line in f if line.strip()]
+    return [x for x in history if engine is None or x["engine"] == engine]
+
+
+def append_history(filename:str, report:Dict[str, any]) -> None:
+    """Append a report to a JSON Lines history file"""
+    with open(filename, "a", encoding="utf-8") as f:
+        f.write(json.dumps(report) + "\n")
+
+
+def compare(report:Dict[str, any], baseline:Dict[str, any],
+            threshold:float=REGRESSION_THRESHOLD) -> List[Dict[str, any]]:
+    """
+    Compare the results of report against baseline. Returns one entry per
+    benchmark with the ratio of median times and a regression flag
+    """
+    def key(result):
+        return (result["name"], json.dumps(result["params"], sort_keys=True))
+    previous = {key(result): result for result in baseline["results"]}
+    rval = []
+    for result in report["results"]:
+        if (old := previous.get(key(result))) is None:
+            continue
+        ratio = result["median"] / old["median"] if old["median"] else float("inf")
+        rval.append({
+            "name": result["name"],
+            "params": result["params"],
+            "median": result["median"],
+            "baseline": old["median"],
+            "ratio": ratio,
+            "regression": ratio > threshold,
+        })
+    return rval
+
+
+def format_results(report:Dict[str, any], comparison:List[Dict[str, any]]=None) -> str:
+    """Format results (and optional comparison) as a text table"""
+    ratios = {}
+    for x in comparison or []:
+        ratios[(x["name"], json.dumps(x["params"], sort_keys=True))] = x
+    rval = f"{'Benchmark':<28} {'Params':<28} {'Median (s)':>12} {'vs last':>9}"
+    for result in report["results"]:
+        params = ",".join(f"{k}={v}" for k,v in result["params"].items())
+        rval += f"\n{result['name']:<28} {params:<28} {result['median']:>12.6f}"
+        if x := ratios.get((result["name"], json.dumps(result["params"], sort_keys=True))):
+            rval += f" {x['ratio']:>8.2f}x" + (" REGRESSION" if x["regression"] else "")
+        if result.get("over_budget"):
+            rval += f" OVER BUDGET ({result['budget']:g} s)"
+        if result.get("passed") is False:
+            rval += " MISMATCH"
+    return rval
+
+
+def main(argv:List[str]=None) -> int:
+    """Command line entry point of the benchmark suite"""
+    parser = argparse.ArgumentParser(description="malcolm_sim benchmark suite")
+    parser.add_argument("--quick", action="store_true", help="smaller parameter grid")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions per benchmark")
+    parser.add_argument("--engine", default="reference", help="engine label for history")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON Lines history file")
+    parser.add_argument("--no-history", action="store_true", help="do not append to history")
+    parser.add_argument("--golden", help="golden trace to replay (recorded if missing)")
+    args = parser.parse_args(argv)
+
+    bench = Benchmark(args.quick, args.repeat, args.engine, args.golden)
+    bench.run()
+    report = bench.report()
+    history = load_history(args.history, args.engine)
+    comparison = compare(report, history[-1]) if history else []
+    report["comparison"] = comparison
+    print(format_results(report, comparison))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if not args.no_history:
+        append_history(args.history, report)
+    failed = any(x["regression"] for x in comparison) \
+        or any(x.get("over_budget") for x in report["results"]) \
+        or any(x.get("passed") is False for x in report["results"])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
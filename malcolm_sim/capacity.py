@@ -0,0 +1,244 @@
+"""
+Contains malcolm_sim.CapacitySearch to find the maximum task rate a cluster
+config sustains under a latency SLO
+"""
+
+from __future__ import annotations
+
+import copy
+import logging
+import os
+from dataclasses import dataclass, asdict
+from typing import Dict, List
+
+import numpy as np
+
+from .analytic import AnalyticEstimator
+from .arrival import scale_arrival_config
+from .malcolm_node import MalcolmNode
+from .malcolm_sim import MalcolmSim
+from .rng import RandomStreams
+
+
+def with_rate(config:dict, rate:float) -> dict:
+    """
+    Copy of config with the mean task rate (tasks/us) set to rate. The scale
+    of a gaussian rate is scaled along so its coefficient of variation stays
+    the same, and all rates of an arrival process are scaled by the same factor.
+    With task classes, the rates of all classes are scaled by the same factor
+    """
+    config = copy.deepcopy(config)
+    if "classes" in config["Tasks"]:
+        factor = rate / (AnalyticEstimator.from_config(config).arrival_rate() / 1000)
+        for tasks in [config["Tasks"]] + config["Tasks"]["classes"]:
+            if "arrival" in tasks:
+                tasks["arrival"] = scale_arrival_config(tasks["arrival"], factor)
+            if "rate" in tasks:
+                params = tasks["rate"]
+                for key in ("value", "center", "scale"):
+                    if key in params:
+                        params[key] = float(params[key]) * factor
+        return config
+    if "arrival" in config["Tasks"]:
+        current = AnalyticEstimator.from_config(config).arrival_rate() / 1000
+        config["Tasks"]["arrival"] = scale_arrival_config(config["Tasks"]["arrival"], rate/current)
+        return config
+    params = config["Tasks"]["rate"]
+    if params["type"] in ["const", "constant"]:
+        params["value"] = rate
+    else:
+        center = float(params["center"])
+        params["scale"] = float(params["scale"]) * rate / center
+        params["center"] = rate
+    return config
+
+
+@dataclass
+class RatePoint:
+    """Measured behaviour of the cluster at one task rate"""
+    rate:float              # tasks/us as in the config
+    stable:bool
+    throughput:float        # completed tasks/ms in the measurement window
+    queue_slope:float       # growth of the queued tasks in tasks/ms
+    mean_latency:float      # ms
+    p99_latency:float       # ms
+    within_slo:bool
+
+
+def evaluate_rate(config:dict, rate:float, time_slice:float, sim_time:float,
+                  engine:str="reference", slo_p99:float=None,
+                  max_queue_growth:float=0.01) -> RatePoint:
+    """
+    Simulate config at the given rate and judge whether it is sustainable. The
+    first half of sim_time is warm-up, the second half the measurement window.
+    The rate is stable if the queued tasks grow by less than max_queue_growth
+    of the tasks arriving in the window and p99 latency is within slo_p99 ms.
+    Resets the registered Malcolm Nodes, so it is used in worker processes.
+    sim_time must leave at least one time slice to each half
+    """
+    if sim_time < 2*time_slice:
+        raise ValueError("Capacity search requires sim_time >= 2*time_slice")
+    MalcolmSim.reset()
+    sim = MalcolmSim.from_config(with_rate(config, rate))
+    sim.run_engine(engine, time_slice, sim_time/2)
+    for node in MalcolmNode.all_nodes.values():
+        node.clear_latencies()
+    start = len(sim.times)
+    generated = sim.generated
+    sim.run_engine(engine, time_slice, sim_time, resume=True)
+    times = np.asarray(sim.times[start:])
+    queued = np.sum([
+        np.asarray(values[start:]) + np.asarray(sim.metrics["IO Queue"][name][start:])
+        for name,values in sim.metrics["CPU Queue"].items()
+    ], axis=0)
+    completed = np.sum([
+        values[-1] - (values[start-1] if start > 0 else 0) for values in sim.metrics["Completed"].values()
+    ])
+    window = sim.curr_time - times[0]
+    queue_slope = float(np.polyfit(times, queued, 1)[0]) if len(times) > 1 else 0.0
+    hist = sim.latency_histogram()
+    p99 = hist.quantile(0.99)
+    within_slo = slo_p99 is None or p99 <= slo_p99
+    growth_limit = max_queue_growth * (sim.generated - generated)
+    return RatePoint(
+        rate=rate,
+        stable=bool(queue_slope*window <= max(growth_limit, 1)) and within_slo,
+        throughput=float(completed / window),
+        queue_slope=queue_slope,
+        mean_latency=hist.mean(),
+        p99_latency=p99,
+        within_slo=within_slo,
+    )
+
+
+def _evaluate_kwargs(kwargs:Dict[str, any]) -> RatePoint:
+    """Process pool entry point"""
+    return evaluate_rate(**kwargs)
+
+
+def find_knee(points:List[RatePoint]) -> (RatePoint|None):
+    """
+    Knee of the latency curve: the point farthest below the chord from the
+    lowest to the highest rate, with both axes normalized (Kneedle)
+    """
+    points = sorted(points, key=lambda x: x.rate)
+    if len(points) < 3:
+        return None
+    rates = np.array([x.rate for x in points])
+    latency = np.array([x.p99_latency for x in points])
+    if latency.max() == latency.min():
+        return None
+    x = (rates - rates[0]) / (rates[-1] - rates[0])
+    y = (latency - latency.min()) / (latency.max() - latency.min())
+    return points[int(np.argmax(x - y))]
+
+
+class CapacitySearch:
+    """
+    Parallel bisection of the task rate of a config for the highest rate that
+    is stable (see evaluate_rate). Each round simulates jobs rates evenly
+    spaced inside the bracket [highest stable, lowest unstable] and shrinks it
+    by a factor of jobs+1. The initial bracket comes from the AnalyticEstimator
+    """
+
+    logger = logging.getLogger("malcolm_sim.CapacitySearch")
+
+    def __init__(self,
+                 config:dict,
+                 slo_p99:float=None,
+                 time_slice:float=1,
+                 sim_time:float=5000,
+                 engine:str="reference",
+                 jobs:int=None,
+                 tolerance:float=0.02,
+                 max_rounds:int=8,
+                 max_queue_growth:float=0.01
+    ) -> None:
+        """
+        slo_p99: p99 latency SLO in ms, None for throughput only
+        tolerance: stop once the bracket is within tolerance of the stable rate
+        """
+        if sim_time < 2*time_slice:
+            raise ValueError("Capacity search requires sim_time >= 2*time_slice")
+        # All rates share the random streams (common random numbers)
+        self.config:dict = dict(config)
+        self.config.setdefault("seed", RandomStreams().entropy)
+        self.slo_p99:float = slo_p99
+        self.time_slice:float = time_slice
+        self.sim_time:float = sim_time
+        self.engine:str = engine
+        self.jobs:int = jobs or os.cpu_count() or 1
+        self.tolerance:float = tolerance
+        self.max_rounds:int = max_rounds
+        self.max_queue_growth:float = max_queue_growth
+        self.points:List[RatePoint] = []
+
+
+    def evaluate(self, rates:List[float]) -> List[RatePoint]:
+        """Simulate rates in parallel (in this process if jobs is 1)"""
+        jobs = [
+            {
+                "config": self.config,
+                "rate": rate,
+                "time_slice": self.time_slice,
+                "sim_time": self.sim_time,
+                "engine": self.engine,
+                "slo_p99": self.slo_p99,
+                "max_queue_growth": self.max_queue_growth,
+            }
+            for rate in rates
+        ]
+        if self.jobs == 1 or len(jobs) == 1:
+            rval = [evaluate_rate(**kwargs) for kwargs in jobs]
+        else:
+            from concurrent.futures import ProcessPoolExecutor     # pylint: disable=import-outside-toplevel
+            with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+                rval = list(pool.map(_evaluate_kwargs, jobs))
+        for point in rval:
+            self.logger.info(
+                "rate %g: %s (throughput %.4g tasks/ms, queue slope %.3g, p99 %.4g ms)",
+                point.rate, "stable" if point.stable else "unstable",
+                point.throughput, point.queue_slope, point.p99_latency
+            )
+        self.points.extend(rval)
+        return rval
+
+
+    def run(self) -> Dict[str, any]:
+        """Search for the maximum sustainable rate and return the report"""
+        self.points = []
+        analytic = AnalyticEstimator.from_config(self.config)
+        estimate = analytic.summary()
+        current = analytic.arrival_rate() / 1000
+        # Rate at which the analytic estimate saturates the busiest station
+        predicted = current / estimate["max_utilization"] if estimate["max_utilization"] else current
+        lo, hi = 0.0, 2*predicted
+        # Grow the bracket until its upper end is unstable
+        for _ in range(self.max_rounds):
+            if not self.evaluate([hi])[0].stable:
+                break
+            lo, hi = hi, 2*hi
+        else:
+            self.logger.warning("No unstable rate found up to %g", hi)
+        rounds = 0
+        while rounds < self.max_rounds and (hi - lo) > self.tolerance * max(lo, hi/2):
+            rates = [float(x) for x in np.linspace(lo, hi, self.jobs + 2)[1:-1]]
+            for point in sorted(self.evaluate(rates), key=lambda x: x.rate):
+                if point.stable:
+                    lo = max(lo, point.rate)
+                else:
+                    hi = min(hi, point.rate)
+                    break
+            rounds += 1
+        best = max((x for x in self.points if x.stable and x.rate <= lo), key=lambda x: x.rate, default=None)
+        knee = find_knee(self.points)
+        return {
+            "max_rate": lo,
+            "max_rate_tasks_per_ms": lo * 1000,
+            "bracket": [lo, hi],
+            "slo_p99": self.slo_p99,
+            "analytic_max_rate": predicted,
+            "best": asdict(best) if best else None,
+            "knee": asdict(knee) if knee else None,
+            "points": [asdict(x) for x in sorted(self.points, key=lambda x: x.rate)],
+        }
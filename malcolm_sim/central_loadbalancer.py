@@ -18,14 +18,28 @@ class CentralLoadBalancer:
     round_robin:int = 0
 
     @classmethod
-    def distribute(cls, tasks:List[Task]) -> List[Network.Packet]:
-        """Distribute tasks among Malcolm Nodes"""
-        num_nodes = len(MalcolmNode.all_nodes)
+    def distribute(cls, tasks:List[Task], curr_time:float=None) -> List[Network.Packet]:
+        """
+        Distribute tasks among Malcolm Nodes round robin, skipping the nodes
+        whose last heartbeat advertised backpressure or, if curr_time is
+        given, is stale (see Heartbeat.timeout) unless all of them do
+        """
+        node_names = list(MalcolmNode.all_nodes.keys())
+        heartbeats = MalcolmNode.central_heartbeats
+        if heartbeats:
+            node_names = [
+                name for name in node_names
+                if name not in heartbeats or not (
+                    heartbeats[name].backpressure
+                    or (curr_time is not None and heartbeats[name].is_stale(curr_time))
+                )
+            ] or node_names
+        num_nodes = len(node_names)
         if cls.round_robin >= num_nodes:
             cls.round_robin = 0
         rval:List[Network.Packet] = []
         for task in tasks:
-            node_name = list(MalcolmNode.all_nodes.keys())[cls.round_robin]
+            node_name = node_names[cls.round_robin]
             rval.append(Network.Packet(
                 data=task,
                 size=task.payload,
@@ -0,0 +1,103 @@
+"""Contains malcolm_sim.Checkpoint to snapshot, restore and fork a simulation"""
+
+from __future__ import annotations
+
+import gzip
+import io
+import logging
+import pickle
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, Tuple
+
+from .central_loadbalancer import CentralLoadBalancer
+from .malcolm_node import MalcolmNode
+
+if TYPE_CHECKING:
+    from .malcolm_sim import MalcolmSim
+
+
+CHECKPOINT_VERSION = 3
+
+
+class Checkpoint:
+    """
+    Snapshot of the full state of a MalcolmSim: all Malcolm Nodes (schedular
+    queues, in-flight tasks, tx_queue backlogs, heartbeats and LoadManager
+    policies), the CentralLoadBalancer, the random streams of every component
+    and the metrics collected so far.
+
+    Malcolm Nodes are registered globally in MalcolmNode.all_nodes, so only one
+    restored simulation can be active at a time. Restoring replaces the
+    currently registered nodes.
+    """
+
+    logger = logging.getLogger("malcolm_sim.Checkpoint")
+
+
+    @classmethod
+    def capture(cls, sim:MalcolmSim) -> Checkpoint:
+        """Snapshot the current state of sim and all Malcolm Nodes"""
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "sim": sim,
+            "nodes": MalcolmNode.all_nodes,
+            "round_robin": CentralLoadBalancer.round_robin,
+            "central_heartbeats": MalcolmNode.central_heartbeats,
+        }
+        buffer = io.BytesIO()
+        pickle.dump(state, buffer, protocol=pickle.HIGHEST_PROTOCOL)
+        cls.logger.info("Captured checkpoint at %g ms", sim.curr_time)
+        return cls(buffer.getvalue())
+
+
+    @classmethod
+    def load(cls, filename:str) -> Checkpoint:
+        """Load a checkpoint from a file written by Checkpoint.save"""
+        with gzip.open(filename, "rb") as f:
+            return cls(f.read())
+
+
+    def __init__(self, data:bytes) -> None:
+        self.data:bytes = data
+
+
+    def save(self, filename:str) -> None:
+        """Write this checkpoint to a compressed file"""
+        with gzip.open(filename, "wb", compresslevel=6) as f:
+            f.write(self.data)
+
+
+    def restore(self) -> MalcolmSim:
+        """
+        Restore a new copy of the simulation and make its Malcolm Nodes the
+        active nodes. Continue the simulation with run(..., resume=True)
+        """
+        state = pickle.loads(self.data)
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version '{state.get('version')}'")
+        MalcolmNode.all_nodes.clear()
+        MalcolmNode.all_nodes.update(state["nodes"])
+        CentralLoadBalancer.round_robin = state["round_robin"]
+        MalcolmNode.central_heartbeats.clear()
+        MalcolmNode.central_heartbeats.update(state["central_heartbeats"])
+        sim = state["sim"]
+        self.logger.info("Restored checkpoint at %g ms", sim.curr_time)
+        return sim
+
+
+    def fork(self, variants:Dict[str, Callable[[MalcolmSim], None]]) \
+        -> Iterator[Tuple[str, MalcolmSim]]:
+        """
+        Yield a freshly restored simulation for each what-if branch after
+        applying its variant function (e.g. to change policies or rates).
+        Each branch is only active until the next one is yielded
+        """
+        for name,variant in variants.items():
+            sim = self.restore()
+            if variant is not None:
+                variant(sim)
+            self.logger.info("Forked branch '%s'", name)
+            yield name, sim
+
+
+    def __len__(self) -> int:
+        return len(self.data)
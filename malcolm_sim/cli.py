@@ -0,0 +1,443 @@
+"""
+Command line interface of malcolm_sim with run, sweep, results, capacity,
+bench, golden and profile subcommands. Every subcommand prints a machine-readable JSON result.
+
+Usage: malcolm-sim {run,sweep,results,capacity,bench,golden,profile} ...
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from .analytic import AnalyticEstimator
+from .malcolm_node import MalcolmNode
+from .malcolm_sim import MalcolmSim
+from .memory import MemoryMonitor
+from .profiler import Profiler
+from .rng import RandomStreams
+from .telemetry import TelemetryServer
+from .tracer import TaskTracer
+from . import report
+
+
+def parse_value(text:str) -> any:
+    """Parse an override value as JSON, falling back to a plain string"""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+def parse_override(text:str) -> Tuple[str, List[any]]:
+    """Parse 'Dotted.Key=v1,v2,...' into the key and the list of values"""
+    if "=" not in text:
+        raise argparse.ArgumentTypeError(f"Override '{text}' is not of the form KEY=VALUE[,VALUE...]")
+    key,values = text.split("=", 1)
+    return key, [parse_value(x) for x in values.split(",")]
+
+
+def apply_override(config:dict, key:str, value:any) -> None:
+    """
+    Set a value in a config dict by dotted key. Integer parts index lists,
+    e.g. 'MalcolmNodes.0.core_count' or 'Tasks.rate.center'
+    """
+    parts = key.split(".")
+    node = config
+    for part in parts[:-1]:
+        node = node[int(part)] if isinstance(node, list) else node.setdefault(part, {})
+    if isinstance(node, list):
+        node[int(parts[-1])] = value
+    else:
+        node[parts[-1]] = value
+
+
+def simulate(config:dict, engine:str, time_slice:float, sim_time:float,
+             out_dir:str=None, plot:bool=False, converge:bool=False,
+             profile:bool=False, overrides:Dict[str, any]=None,
+             telemetry:int=None, store:str=None, trace_tasks:int=None,
+             memory:float=None) -> Dict[str, any]:
+    """
+    Run one simulation from a config dict and return its summary, including
+    the AnalyticEstimator prediction as a sanity check. This resets the
+    registered Malcolm Nodes, so it is used as the worker of sweeps. If
+    telemetry is a port, live metrics are served on it during the run. If
+    store is a file, the run and its series are added to that ResultStore.
+    If trace_tasks is N, the latency breakdown of 1 in N tasks is reported.
+    If memory is an interval in ms, the memory footprint is sampled and reported
+    """
+    config = copy.deepcopy(config)
+    for key,value in (overrides or {}).items():
+        apply_override(config, key, value)
+    MalcolmSim.reset()
+    if profile:
+        Profiler.reset()
+        Profiler.enable()
+    if trace_tasks:
+        TaskTracer.reset()
+        TaskTracer.enable(trace_tasks)
+    sim = MalcolmSim.from_config(config)
+    options = {}
+    if converge:
+        from .convergence import ConvergenceMonitor   # pylint: disable=import-outside-toplevel
+        options["convergence"] = ConvergenceMonitor()
+    if telemetry is not None:
+        options["telemetry"] = TelemetryServer(telemetry).start()
+    if memory is not None:
+        options["memory"] = MemoryMonitor(memory)
+    start = time.perf_counter()
+    try:
+        sim.run_engine(engine, time_slice, sim_time, **options)
+    finally:
+        Profiler.disable()
+        TaskTracer.disable()
+        if telemetry is not None:
+            options["telemetry"].stop()
+    wall_time = time.perf_counter() - start
+    summary = {
+        "engine": engine,
+        "time_slice": time_slice,
+        "sim_time": sim_time,
+        "simulated_time": sim.curr_time,
+        "wall_time": wall_time,
+        "generated": sim.generated,
+        "rejected": sum(node.rejected for node in MalcolmNode.all_nodes.values()),
+        "dropped": sum(node.dropped for node in MalcolmNode.all_nodes.values()),
+        "redirected": sum(node.redirected for node in MalcolmNode.all_nodes.values()),
+        "lost": sum(node.lost for node in MalcolmNode.all_nodes.values()),
+        "requeued": sum(node.requeued for node in MalcolmNode.all_nodes.values()),
+        "seed": sim.seed,
+        "overrides": overrides or {},
+        "stats": report.compute_stats(sim.report_metrics()),
+        "latency": sim.latency_histogram().summary(),
+        "analytic": AnalyticEstimator.from_config(config).summary(),
+    }
+    if converge:
+        summary["convergence"] = {
+            "converged": options["convergence"].converged,
+            "warmup": options["convergence"].warmup,
+            "intervals": options["convergence"].report,
+        }
+    if profile:
+        summary["profile"] = Profiler.stats()
+    if trace_tasks:
+        summary["breakdown"] = TaskTracer.summary()
+    if memory is not None:
+        summary["memory"] = options["memory"].summary()
+    if sim.faults is not None:
+        summary["faults"] = sim.faults.report(sim)
+    if sim.task_classes():
+        summary["classes"] = sim.class_summary()
+    if store:
+        from .results import ResultStore     # pylint: disable=import-outside-toplevel
+        with ResultStore(store) as results:
+            summary["run_id"] = results.add_run(config, summary, sim.metrics, sim.times)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+        with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        if plot:
+            sim.plot_all(os.path.join(out_dir, ""), jobs=1)
+    return summary
+
+
+def _simulate_kwargs(kwargs:Dict[str, any]) -> Dict[str, any]:
+    """Process pool entry point"""
+    return simulate(**kwargs)
+
+
+def load_config(args:argparse.Namespace) -> dict:
+    """Load the config of a simulation subcommand, applying --seed"""
+    config = MalcolmSim.load_config(args.config)
+    if args.seed is not None:
+        config["seed"] = args.seed
+    return config
+
+
+def cmd_run(args:argparse.Namespace) -> int:
+    """run subcommand"""
+    config = load_config(args)
+    overrides = {key: values[-1] for key,values in args.set}
+    summary = simulate(
+        config, args.engine, args.slice, args.duration, args.out,
+        plot=args.plot, converge=args.converge, overrides=overrides, telemetry=args.telemetry,
+        store=args.store, trace_tasks=args.trace_tasks, memory=args.memory
+    )
+    summary["config"] = args.config
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+def cmd_sweep(args:argparse.Namespace) -> int:
+    """sweep subcommand"""
+    config = load_config(args)
+    # All points share the random streams unless the seed is swept
+    config.setdefault("seed", RandomStreams().entropy)
+    keys = [key for key,_ in args.grid]
+    points = [dict(zip(keys, values)) for values in itertools.product(*[v for _,v in args.grid])]
+    skipped = []
+    if args.prescreen:
+        points,skipped = prescreen(config, points, args.min_util, args.max_util)
+    jobs = []
+    for i,overrides in enumerate(points):
+        jobs.append({
+            "config": config,
+            "engine": args.engine,
+            "time_slice": args.slice,
+            "sim_time": args.duration,
+            "out_dir": os.path.join(args.out, f"run{i:04d}") if args.out else None,
+            "plot": args.plot,
+            "converge": args.converge,
+            "overrides": overrides,
+            "store": args.store,
+        })
+    if args.jobs == 1:
+        results = [simulate(**kwargs) for kwargs in jobs]
+    else:
+        from concurrent.futures import ProcessPoolExecutor     # pylint: disable=import-outside-toplevel
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(pool.map(_simulate_kwargs, jobs))
+    output = {"config": args.config, "grid": dict(args.grid), "runs": results, "skipped": skipped}
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        with open(os.path.join(args.out, "sweep.json"), "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2)
+    print(json.dumps(output, indent=2))
+    return 0
+
+
+def cmd_results(args:argparse.Namespace) -> int:
+    """results subcommand"""
+    from .results import ResultStore     # pylint: disable=import-outside-toplevel
+    where = {key: values[-1] for key,values in args.where}
+    with ResultStore(args.store) as results:
+        if args.series:
+            rval = {}
+            for run_id in results.run_ids(where):
+                times, values = results.series(run_id, args.series)
+                rval[run_id] = {"times": times.tolist(), **{k: v.tolist() for k,v in values.items()}}
+        else:
+            rval = results.compare(args.metric, args.param, where)
+    print(json.dumps(rval, indent=2))
+    return 0
+
+
+def prescreen(config:dict, points:List[Dict[str, any]], min_util:float, max_util:float) \
+    -> Tuple[List[Dict[str, any]], List[Dict[str, any]]]:
+    """
+    Split sweep points by their AnalyticEstimator prediction. Points whose
+    busiest station is below min_util (idle) or at or above max_util
+    (saturated) are skipped. Returns the points to run, busiest first, and
+    the skipped points with their prediction
+    """
+    selected = []
+    skipped = []
+    for overrides in points:
+        point_config = copy.deepcopy(config)
+        for key,value in overrides.items():
+            apply_override(point_config, key, value)
+        analytic = AnalyticEstimator.from_config(point_config).summary()
+        if min_util <= analytic["max_utilization"] < max_util:
+            selected.append((analytic["max_utilization"], overrides))
+        else:
+            skipped.append({"overrides": overrides, "analytic": analytic})
+    selected.sort(key=lambda x: -x[0])
+    return [overrides for _,overrides in selected], skipped
+
+
+def cmd_capacity(args:argparse.Namespace) -> int:
+    """capacity subcommand"""
+    from .capacity import CapacitySearch     # pylint: disable=import-outside-toplevel
+    config = load_config(args)
+    for key,values in args.set:
+        apply_override(config, key, values[-1])
+    search = CapacitySearch(
+        config, slo_p99=args.slo, time_slice=args.slice, sim_time=args.duration,
+        engine=args.engine, jobs=args.jobs, tolerance=args.tolerance, max_rounds=args.rounds
+    )
+    result = search.run()
+    result["config"] = args.config
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+def cmd_bench(args:argparse.Namespace) -> int:
+    """bench subcommand"""
+    from . import benchmark     # pylint: disable=import-outside-toplevel
+    argv = ["--repeat", str(args.repeat), "--engine", args.engine, "--history", args.history]
+    if args.quick:
+        argv.append("--quick")
+    if args.output:
+        argv += ["--output", args.output]
+    if args.no_history:
+        argv.append("--no-history")
+    if args.golden:
+        argv += ["--golden", args.golden]
+    return benchmark.main(argv)
+
+
+def cmd_golden(args:argparse.Namespace) -> int:
+    """golden subcommand"""
+    from . import golden     # pylint: disable=import-outside-toplevel
+    if args.action == "record":
+        config = MalcolmSim.load_config(args.config)
+        trace = golden.GoldenTrace.record(config, args.slice, args.duration, seed=args.seed)
+        trace.save(args.trace)
+        print(json.dumps({
+            "trace": args.trace,
+            "seed": trace.config["seed"],
+            "tasks": len(trace.workload),
+            "completed": len(trace.completions),
+        }, indent=2))
+        return 0
+    reference = golden.GoldenTrace.load(args.trace)
+    tolerance = golden.Tolerance(
+        latency_atol=args.latency_atol, metric_atol=args.metric_atol, metric_rtol=args.metric_rtol,
+        mean_rtol=args.mean_rtol, max_missing=args.max_missing, max_node_mismatch=args.max_node_mismatch
+    )
+    result = golden.diff(reference, reference.replay(args.engine), tolerance)
+    print(json.dumps(result, indent=2))
+    return 0 if result["passed"] else 1
+
+
+def cmd_profile(args:argparse.Namespace) -> int:
+    """profile subcommand"""
+    config = load_config(args)
+    overrides = {key: values[-1] for key,values in args.set}
+    summary = simulate(
+        config, args.engine, args.slice, args.duration, profile=True, overrides=overrides
+    )
+    print(Profiler.summary(per_scope=args.per_node), file=sys.stderr)
+    print(json.dumps({
+        "config": args.config,
+        "wall_time": summary["wall_time"],
+        "simulated_time": summary["simulated_time"],
+        "totals": Profiler.totals(),
+        "profile": summary["profile"],
+    }, indent=2))
+    return 0
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Build the argument parser"""
+    parser = argparse.ArgumentParser(prog="malcolm-sim", description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="log INFO (-v) or DEBUG (-vv) messages")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_sim_args(sub:argparse.ArgumentParser) -> None:
+        sub.add_argument("config", help="JSON or YAML config file")
+        sub.add_argument("--slice", type=float, default=1, help="time slice in ms (default 1)")
+        sub.add_argument("--duration", type=float, default=5000,
+                         help="simulated time in ms (default 5000)")
+        sub.add_argument("--engine", choices=MalcolmSim.ENGINES, default="reference",
+                         help="simulation engine (default reference)")
+        sub.add_argument("--seed", type=int, default=None,
+                         help="root seed of the random streams (overrides the config)")
+        sub.add_argument("--set", type=parse_override, action="append", default=[],
+                         metavar="KEY=VALUE", help="override a config value by dotted key")
+
+    sub = subparsers.add_parser("run", help="run a single simulation")
+    add_sim_args(sub)
+    sub.add_argument("--out", help="output directory for summary.json and plots")
+    sub.add_argument("--plot", action="store_true", help="write plots and stats to --out")
+    sub.add_argument("--converge", action="store_true", help="stop early at steady state")
+    sub.add_argument("--telemetry", type=int, metavar="PORT",
+                     help="serve live Prometheus metrics on localhost:PORT/metrics")
+    sub.add_argument("--store", help="SQLite result store to add the run to")
+    sub.add_argument("--trace-tasks", type=int, metavar="N",
+                     help="report the latency breakdown of 1 in N tasks")
+    sub.add_argument("--memory", type=float, metavar="MS",
+                     help="sample the memory footprint every MS simulated ms (slow)")
+    sub.set_defaults(func=cmd_run)
+
+    sub = subparsers.add_parser("sweep", help="run a grid of config overrides in parallel")
+    add_sim_args(sub)
+    sub.add_argument("--grid", type=parse_override, action="append", required=True,
+                     metavar="KEY=V1,V2,...", help="values of a config key to sweep")
+    sub.add_argument("--jobs", type=int, default=None, help="worker processes (default CPU count)")
+    sub.add_argument("--out", help="output directory for sweep.json and one directory per run")
+    sub.add_argument("--plot", action="store_true", help="write plots and stats of every run")
+    sub.add_argument("--converge", action="store_true", help="stop each run early at steady state")
+    sub.add_argument("--prescreen", action="store_true",
+                     help="skip points the analytic estimate predicts idle or saturated")
+    sub.add_argument("--min-util", type=float, default=0.0,
+                     help="prescreen: skip points below this utilization (default 0)")
+    sub.add_argument("--max-util", type=float, default=1.0,
+                     help="prescreen: skip points at or above this utilization (default 1)")
+    sub.add_argument("--store", help="SQLite result store to add every run to")
+    sub.set_defaults(func=cmd_sweep)
+
+    sub = subparsers.add_parser("results", help="query a result store")
+    sub.add_argument("store", help="SQLite result store written with --store")
+    sub.add_argument("--where", type=parse_override, action="append", default=[], metavar="KEY=VALUE",
+                     help="only runs whose config has this value")
+    sub.add_argument("--param", action="append", default=[], help="config key to list per run")
+    sub.add_argument("--metric", action="append", default=[],
+                     help="summary key to list per run (e.g. latency.p99)")
+    sub.add_argument("--series", metavar="METRIC", help="print the series of METRIC of every run instead")
+    sub.set_defaults(func=cmd_results)
+
+    sub = subparsers.add_parser("capacity", help="search for the maximum sustainable task rate")
+    add_sim_args(sub)
+    sub.add_argument("--slo", type=float, default=None, help="p99 latency SLO in ms")
+    sub.add_argument("--jobs", type=int, default=None,
+                     help="rates simulated in parallel per round (default CPU count)")
+    sub.add_argument("--tolerance", type=float, default=0.02,
+                     help="relative width of the final rate bracket (default 0.02)")
+    sub.add_argument("--rounds", type=int, default=8, help="maximum bisection rounds (default 8)")
+    sub.set_defaults(func=cmd_capacity)
+
+    sub = subparsers.add_parser("bench", help="run the benchmark suite")
+    sub.add_argument("--quick", action="store_true", help="smaller parameter grid")
+    sub.add_argument("--repeat", type=int, default=5, help="repetitions per benchmark")
+    sub.add_argument("--engine", default="reference", help="engine label for history")
+    sub.add_argument("--output", help="write the JSON report to this file")
+    sub.add_argument("--history", default="bench_history.jsonl", help="JSON Lines history file")
+    sub.add_argument("--no-history", action="store_true", help="do not append to history")
+    sub.add_argument("--golden", help="golden trace to replay (recorded if missing)")
+    sub.set_defaults(func=cmd_bench)
+
+    sub = subparsers.add_parser("golden", help="record or check a golden trace")
+    actions = sub.add_subparsers(dest="action", required=True)
+    record = actions.add_parser("record", help="record a trace with the reference engine")
+    record.add_argument("config", help="JSON or YAML config file")
+    record.add_argument("trace", help="trace file to write (gzipped JSON)")
+    record.add_argument("--slice", type=float, default=1, help="time slice in ms (default 1)")
+    record.add_argument("--duration", type=float, default=1000,
+                        help="simulated time in ms (default 1000)")
+    record.add_argument("--seed", type=int, default=0, help="seed unless the config has one (default 0)")
+    check = actions.add_parser("check", help="replay a trace through an engine and diff")
+    check.add_argument("trace", help="trace file written by golden record")
+    check.add_argument("--engine", choices=MalcolmSim.ENGINES, default="reference",
+                       help="engine to check (default reference)")
+    check.add_argument("--latency-atol", type=float, default=0.0, help="per-task latency tolerance in ms")
+    check.add_argument("--metric-atol", type=float, default=1e-9, help="absolute metric tolerance")
+    check.add_argument("--metric-rtol", type=float, default=1e-9, help="relative metric tolerance")
+    check.add_argument("--mean-rtol", type=float, default=None,
+                       help="compare metric means within this relative tolerance instead of samples")
+    check.add_argument("--max-missing", type=int, default=0, help="tasks completed in one trace only")
+    check.add_argument("--max-node-mismatch", type=int, default=0,
+                       help="tasks completed on a different node")
+    sub.set_defaults(func=cmd_golden)
+
+    sub = subparsers.add_parser("profile", help="report per-subsystem timing of a simulation")
+    add_sim_args(sub)
+    sub.add_argument("--per-node", action="store_true", help="one row per node and subsystem")
+    sub.set_defaults(func=cmd_profile)
+    return parser
+
+
+def main(argv:List[str]=None) -> int:
+    """Entry point of the malcolm-sim command"""
+    args = make_parser().parse_args(argv)
+    level = [logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)]
+    logging.getLogger("malcolm_sim").setLevel(level)
+    return args.func(args)
@@ -0,0 +1,162 @@
+"""
+Schema of the MalcolmSim config file. Imported on first use by
+MalcolmSim.get_config_schema so that importing malcolm_sim does not load schema
+"""
+
+from schema import Schema, And, Or, Use, Optional
+
+from .iec_int import IEC_Int
+
+
+task_schema = Or(
+    {
+        "type": Or("const", "constant"),
+        "value": And(Use(float), lambda n: n > 0)
+    },
+    {
+        "type": Or("gaussian", "normal"),
+        "center": And(Use(float), lambda n: n > 0),
+        "scale": And(Use(float), lambda n: n > 0)
+    },
+    {
+        "type": "lognormal",
+        "mu": Use(float),
+        "sigma": And(Use(float), lambda n: n > 0)
+    },
+    {
+        "type": "pareto",
+        "shape": And(Use(float), lambda n: n > 0),
+        "scale": And(Use(float), lambda n: n > 0)
+    },
+    And(
+        {
+            "type": "empirical",
+            "values": And([Use(float)], lambda x: len(x) > 0),
+            Optional("weights"): [And(Use(float), lambda n: n >= 0)]
+        },
+        # One weight per value, not all zero
+        lambda d: "weights" not in d or (len(d["weights"]) == len(d["values"]) and sum(d["weights"]) > 0)
+    )
+)
+
+arrival_schema = Or(
+    {
+        "type": "poisson",
+        "rate": And(Use(float), lambda n: n > 0),
+        Optional("block"): And(Use(float), lambda n: n > 0)
+    },
+    {
+        "type": "mmpp",
+        "rates": [And(Use(float), lambda n: n >= 0)],
+        "durations": [And(Use(float), lambda n: n > 0)],
+        Optional("transitions"): [[And(Use(float), lambda n: n >= 0)]],
+        Optional("block"): And(Use(float), lambda n: n > 0)
+    },
+    {
+        "type": "onoff",
+        "rate": And(Use(float), lambda n: n > 0),
+        "on_time": And(Use(float), lambda n: n > 0),
+        "off_time": And(Use(float), lambda n: n > 0),
+        Optional("block"): And(Use(float), lambda n: n > 0)
+    },
+    {
+        "type": "diurnal",
+        "rate": And(Use(float), lambda n: n > 0),
+        "period": And(Use(float), lambda n: n > 0),
+        Optional("amplitude"): And(Use(float), lambda n: 0 <= n <= 1),
+        Optional("phase"): Use(float),
+        Optional("noise"): And(Use(float), lambda n: n >= 0),
+        Optional("resolution"): And(Use(float), lambda n: n > 0),
+        Optional("block"): And(Use(float), lambda n: n > 0)
+    }
+)
+
+perf_schema = Or(
+    [And(Use(float), lambda n: n > 0)],
+    And(Use(float), lambda n: n > 0)
+)
+
+slowdown_schema = {
+    "factor": And(Use(float), lambda n: n > 0),
+    Optional("start"): And(Use(float), lambda n: n >= 0),
+    Optional("end"): And(Use(float), lambda n: n > 0),
+    Optional("period"): And(Use(float), lambda n: n > 0),
+    Optional("unit"): Or("cpu", "io"),
+    Optional("units"): [And(Use(int), lambda n: n >= 0)]
+}
+
+fault_keys = {
+    "node": Use(str),
+    Optional("start"): And(Use(float), lambda n: n >= 0),
+    Optional("end"): And(Use(float), lambda n: n > 0),
+    Optional("unit"): Or("cpu", "io"),
+    Optional("units"): [And(Use(int), lambda n: n >= 0)],
+    Optional("tasks"): Or("lose", "requeue"),
+    Optional("probability"): And(Use(float), lambda n: 0 <= n <= 1)
+}
+
+# A link factor of 0 cuts the link, units cannot run at speed 0 (see core_loss)
+fault_schema = Or(
+    {
+        "type": "link",
+        Optional("factor"): And(Use(float), lambda n: n >= 0),
+        **fault_keys
+    },
+    {
+        "type": Or("crash", "core_loss", "slowdown", "heartbeat_loss"),
+        Optional("factor"): And(Use(float), lambda n: n > 0),
+        **fault_keys
+    }
+)
+
+# Keys of the Tasks config, also the keys of every task class
+workload_schema = {
+    Optional("rate"): task_schema,
+    Optional("arrival"): arrival_schema,
+    Optional("runtime"): task_schema,
+    Optional("io_time"): task_schema,
+    Optional("payload"): task_schema,
+    Optional("stages"): [{
+        "kind": Or("cpu", "io"),
+        "time": task_schema
+    }]
+}
+
+
+config_schema:Schema = Schema({
+    Optional("seed"): And(Use(int), lambda n: n >= 0),
+    Optional("heartbeat_timeout"): And(Use(float), lambda n: n > 0),
+    "MalcolmNodes": [{
+        "name": Use(str),
+        "core_count": And(Use(IEC_Int), lambda n: n > 0),
+        Optional("core_perf"): perf_schema,
+        "io_count": And(Use(IEC_Int), lambda n: n > 0),
+        Optional("io_perf"): perf_schema,
+        "overhead": And(Use(float), lambda n: n >= 0),
+        "bandwidth": And(Use(IEC_Int), lambda n: n > 0),
+        Optional("slowdowns"): [slowdown_schema],
+        Optional("queue_capacity"): And(Use(int), lambda n: n > 0),
+        Optional("inbox_capacity"): And(Use(int), lambda n: n > 0),
+        Optional("tx_capacity"): And(Use(int), lambda n: n > 0),
+        Optional("admission"): Or("reject", "drop-oldest", "redirect"),
+        Optional("backpressure"): And(Use(float), lambda n: 0 < n <= 1),
+        Optional("packet_header"): And(Use(IEC_Int), lambda n: n >= 0),
+        Optional("batch_size"): And(Use(int), lambda n: n >= 1)
+    }],
+    "Tasks": {
+        **workload_schema,
+        Optional("classes"): [{
+            "name": Use(str),
+            Optional("priority"): Use(int),
+            Optional("slo"): And(Use(float), lambda n: n > 0),
+            **workload_schema
+        }]
+    },
+    Optional("Faults"): [fault_schema],
+    Optional("PolicyOptimizer"): {
+        Optional("epoch"): And(Use(float), lambda n: n > 0),
+        Optional("imbalance_threshold"): And(Use(float), lambda n: n >= 0),
+        Optional("heartbeat_delta"): And(Use(float), lambda n: n >= 0),
+        Optional("smoothing"): And(Use(float), lambda n: 0 < n <= 1)
+    }
+})
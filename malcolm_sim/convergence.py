@@ -0,0 +1,121 @@
+"""Contains malcolm_sim.ConvergenceMonitor for steady-state detection"""
+
+from __future__ import annotations
+
+import logging
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+
+MSER_BATCH = 5
+
+
+def mser_truncation(values:np.ndarray, batch:int=MSER_BATCH) -> (int|None):
+    """
+    Find the end of the warm-up period with MSER-5. Returns the number of
+    samples to discard, or None if the series has not left its warm-up yet
+    (the optimal truncation point is in the second half of the series)
+    """
+    k = len(values) // batch
+    if k < 4:
+        return None
+    z = values[:k*batch].reshape(k, batch).mean(axis=1)
+    # Suffix sums give the MSER statistic for every truncation point at once
+    s1 = np.cumsum(z[::-1])[::-1]
+    s2 = np.cumsum((z*z)[::-1])[::-1]
+    m = np.arange(k, 0, -1, dtype=float)
+    sse = np.maximum(s2 - s1*s1/m, 0)
+    mser = sse / (m*m)
+    d = int(np.argmin(mser[:k//2 + 1]))
+    if d >= k//2:
+        return None
+    return d * batch
+
+
+def t_quantile(p:float, df:int) -> float:
+    """Approximate quantile of Student's t distribution (Cornish-Fisher expansion)"""
+    from statistics import NormalDist   # pylint: disable=import-outside-toplevel
+    z = NormalDist().inv_cdf(p)
+    return z + (z**3 + z)/(4*df) + (5*z**5 + 16*z**3 + 3*z)/(96*df**2)
+
+
+class ConvergenceMonitor:
+    """
+    Detects the end of the warm-up period with MSER-5 and tracks batch means
+    confidence intervals of the mean of each metric (averaged over all nodes).
+    The simulation has converged once all confidence intervals are within
+    rel_precision of their mean.
+    """
+
+    logger = logging.getLogger("malcolm_sim.ConvergenceMonitor")
+
+    def __init__(self,
+                 metrics:Iterable[str]=("CPU Util", "CPU Queue", "Latency"),
+                 rel_precision:float=0.05,
+                 confidence:float=0.95,
+                 batches:int=20,
+                 min_samples:int=1000,
+                 check_interval:int=100
+    ) -> None:
+        self.metrics:List[str] = list(metrics)
+        self.rel_precision:float = rel_precision
+        self.confidence:float = confidence
+        self.batches:int = batches
+        self.min_samples:int = min_samples
+        self.check_interval:int = check_interval
+        self.converged:bool = False
+        self.warmup:(int|None) = None           # samples discarded as warm-up
+        self.report:Dict[str, Dict[str, float]] = {}
+
+
+    def check(self, metrics:Dict[str, Dict[str, List[float]]]) -> bool:
+        """
+        Update the report from the metrics collected by MalcolmSim and return
+        True if the simulation has converged. Only evaluates every check_interval
+        samples
+        """
+        num_samples = len(next(iter(metrics[self.metrics[0]].values())))
+        if num_samples < self.min_samples or num_samples % self.check_interval:
+            return False
+        series = {
+            name: np.mean([np.asarray(x, dtype=float) for x in metrics[name].values()], axis=0)
+            for name in self.metrics
+        }
+        # Warm-up ends when every metric has left its transient
+        warmup = 0
+        for values in series.values():
+            d = mser_truncation(values)
+            if d is None:
+                self.logger.debug("Warm-up not complete after %d samples", num_samples)
+                return False
+            warmup = max(warmup, d)
+        self.warmup = warmup
+        if (num_samples - warmup) < 2*self.batches:
+            return False
+        t = t_quantile(0.5 + self.confidence/2, self.batches-1)
+        self.converged = True
+        for name,values in series.items():
+            values = values[warmup:]
+            size = len(values) // self.batches
+            means = values[len(values) - size*self.batches:].reshape(self.batches, size).mean(axis=1)
+            mean = float(means.mean())
+            half_width = t * float(means.std(ddof=1)) / np.sqrt(self.batches)
+            self.report[name] = {
+                "mean": mean,
+                "half_width": half_width,
+                "rel_width": half_width/abs(mean) if mean else 0.0,
+            }
+            if half_width > self.rel_precision*abs(mean):
+                self.converged = False
+        self.logger.debug("Convergence check at %d samples:\n%s", num_samples, self.summary())
+        return self.converged
+
+
+    def summary(self) -> str:
+        """Table of the confidence intervals of each metric"""
+        rval = f"Warm-up: {self.warmup} samples; {self.confidence:.0%} confidence intervals:"
+        for name,ci in self.report.items():
+            rval += f"\n    {name:<12} {ci['mean']:10.4g} +/- {ci['half_width']:<10.4g}" \
+                + f" ({ci['rel_width']:.2%})"
+        return rval
@@ -0,0 +1,252 @@
+"""
+Contains malcolm_sim.Fault and malcolm_sim.FaultInjector to inject scheduled
+node crashes, core loss, slowdowns, link degradation and heartbeat loss
+"""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List
+
+import numpy as np
+from numpy.random import Generator, default_rng
+
+from .malcolm_node import MalcolmNode
+from .network import Network
+from .slowdown import Slowdown
+
+if TYPE_CHECKING:
+    from .malcolm_sim import MalcolmSim
+
+
+FAULT_TYPES = ("crash", "core_loss", "slowdown", "link", "heartbeat_loss")
+
+
+@dataclass
+class Fault:
+    """
+    A fault of one Malcolm Node, active from start (inclusive) to end
+    (exclusive) in ms, or until the end of the simulation if end is None
+    - crash: the node is down; in-flight tasks are lost or requeued (tasks)
+    - core_loss: the cpu or io units (all if None) take no tasks
+    - slowdown: the units run factor times as fast (see Slowdown)
+    - link: the bandwidth of the node is multiplied by factor (0 cuts the link)
+    - heartbeat_loss: heartbeats of the node are lost with probability
+    """
+    type:str
+    node:str
+    start:float = 0
+    end:float = None
+    factor:float = 1.0
+    unit:str = "cpu"
+    units:List[int] = None
+    tasks:str = "lose"
+    probability:float = 1.0
+
+    @classmethod
+    def from_config(cls, config:dict) -> Fault:
+        """Create a Fault from config dict. Assumes schema is validated"""
+        return cls(**config)
+
+    def is_active(self, curr_time:float) -> bool:
+        """Returns True if this fault applies at curr_time"""
+        return self.start <= curr_time and (self.end is None or curr_time < self.end)
+
+
+class FaultInjector:
+    """
+    Applies a schedule of Faults at the start of every time slice and
+    reports how long the cluster took to detect and absorb each of them
+    """
+
+    logger = logging.getLogger("malcolm_sim.FaultInjector")
+
+    def __init__(self, faults:List[Fault], rng:Generator=None) -> None:
+        """rng: random stream of heartbeat loss, a fresh unseeded one if None"""
+        for fault in faults:
+            if fault.type not in FAULT_TYPES:
+                raise ValueError(f"Fault type '{fault.type}' is invalid")
+            if fault.node not in MalcolmNode.all_nodes:
+                raise ValueError(f"Fault of unknown Malcolm Node '{fault.node}'")
+            if fault.type == "slowdown" and fault.factor <= 0:
+                raise ValueError("Slowdown faults require factor > 0, use core_loss to stop units")
+        self.faults:List[Fault] = faults
+        self.rng:Generator = rng if rng is not None else default_rng()
+        # Slowdowns of the Schedulars, added while their fault is active
+        self.slowdowns:Dict[int, Slowdown] = {
+            i: Slowdown(fault.factor, unit=fault.unit, units=fault.units)
+            for i,fault in enumerate(faults) if fault.type == "slowdown"
+        }
+        self.bandwidth:Dict[str, int] = {
+            fault.node: MalcolmNode.all_nodes[fault.node].network.bandwidth
+            for fault in faults if fault.type == "link"
+        }
+        self.reset()
+
+
+    @classmethod
+    def from_config(cls, config:List[dict], rng:Generator=None) -> FaultInjector:
+        """Create a FaultInjector from the Faults config list. Nodes must exist"""
+        return cls([Fault.from_config(x) for x in config], rng)
+
+
+    def reset(self) -> None:
+        """Restart the schedule at time 0 and undo the faults of all nodes"""
+        self.active:List[bool] = [False] * len(self.faults)
+        self.heartbeat_loss:Dict[str, float] = {}
+        self.detected:Dict[int, float] = {}     # fault index -> time the node was presumed dead
+        for name in {fault.node for fault in self.faults}:
+            self._apply_node(name, 0.0)
+
+
+    def apply(self, curr_time:float) -> None:
+        """Start and stop faults at curr_time (NOT thread-safe)"""
+        changed = set()
+        for i,fault in enumerate(self.faults):
+            active = fault.is_active(curr_time)
+            if active != self.active[i]:
+                self.active[i] = active
+                changed.add(fault.node)
+                self.logger.info(
+                    "%s fault of %s %s at %g ms", fault.type, fault.node,
+                    "started" if active else "ended", curr_time
+                )
+        for name in changed:
+            self._apply_node(name, curr_time)
+        # Detection of crashes and lost heartbeats by the Central Loadbalancer
+        for i,fault in enumerate(self.faults):
+            if self.active[i] and i not in self.detected and fault.type in ("crash", "heartbeat_loss"):
+                heartbeat = MalcolmNode.central_heartbeats.get(fault.node)
+                if heartbeat is not None and heartbeat.is_stale(curr_time):
+                    self.detected[i] = curr_time
+
+
+    def _apply_node(self, name:str, curr_time:float) -> None:
+        """Set the state of a node from all its active faults at curr_time"""
+        node = MalcolmNode.all_nodes[name]
+        active = [fault for i,fault in enumerate(self.faults) if self.active[i] and fault.node == name]
+        # Swap the fault slowdowns of the node, by identity as configured ones may compare equal
+        faulted = {id(x): i for i,x in self.slowdowns.items() if self.faults[i].node == name}
+        node.schedular.slowdowns = [x for x in node.schedular.slowdowns if id(x) not in faulted] \
+            + [self.slowdowns[i] for i in faulted.values() if self.active[i]]
+        # Also resets the speed of the units once no slowdowns are left
+        node.schedular.apply_slowdowns(curr_time)
+        crashes = [fault for fault in active if fault.type == "crash"]
+        if crashes and node.up:
+            node.crash(crashes[0].tasks)
+        elif not crashes and not node.up:
+            node.recover()
+        for unit in ("cpu", "io"):
+            failed = set()
+            for fault in active:
+                if fault.type == "core_loss" and fault.unit == unit:
+                    count = len(node.schedular.cores if unit == "cpu" else node.schedular.ios)
+                    failed.update(range(count) if fault.units is None else fault.units)
+            node.schedular.set_failed(unit, failed)
+        if name in self.bandwidth:
+            factor = np.prod([fault.factor for fault in active if fault.type == "link"])
+            node.network.bandwidth = self.bandwidth[name] * factor
+        loss = [fault.probability for fault in active if fault.type == "heartbeat_loss"]
+        if loss:
+            self.heartbeat_loss[name] = max(loss)
+        else:
+            self.heartbeat_loss.pop(name, None)
+
+
+    def filter_packets(self, packets:List[Network.Packet]) -> List[Network.Packet]:
+        """Drop the heartbeats lost to active heartbeat_loss faults, also from batches"""
+        if not self.heartbeat_loss:
+            return packets
+        rval = []
+        for packet in packets:
+            if packet.type == "Batch":
+                kept = self.filter_packets(packet.data)
+                if len(kept) != len(packet.data):
+                    if not kept:
+                        continue
+                    packet = Network.Packet(
+                        kept, sum(x.size for x in kept), packet.src, packet.dest, "Batch", None
+                    )
+            elif packet.type == "Heartbeat":
+                loss = self.heartbeat_loss.get(packet.src.split(":", 1)[1])
+                if loss is not None and self.rng.random() < loss:
+                    continue
+            rval.append(packet)
+        return rval
+
+
+    def report(self, sim:MalcolmSim, tolerance:float=0.1, settle:float=100,
+               baseline_window:float=1000, atol:float=None) -> List[Dict[str, any]]:
+        """
+        Impact of every fault on the cluster latency of sim. The baseline is
+        the mean latency of the baseline_window ms before the fault. The
+        fault is absorbed once the mean latency of every following settle ms
+        window stays within tolerance of the baseline plus atol ms (time to
+        rebalance, until the next fault starts, None if it was not absorbed);
+        a window without completions or with lost tasks is not absorbed. atol
+        defaults to one time slice, the resolution of the latencies. Also reports the time until the
+        Central Loadbalancer presumed the node dead (detection) and the
+        latencies and tasks completed, lost or requeued from the start of the
+        fault until it ended and was absorbed (until the next fault if never)
+        """
+        times = np.asarray(sim.times, dtype=float)
+        if not len(times):
+            return []
+        ends = np.append(times[1:], sim.curr_time)
+        names = list(sim.metrics["Completed"].keys())
+        def total(metric:str) -> np.ndarray:
+            return np.array([sim.metrics[metric][name] for name in names], dtype=float).sum(axis=0)
+        done = np.diff([sim.metrics["Completed"][name] for name in names], axis=1, prepend=0)
+        latency = np.array([sim.metrics["Latency"][name] for name in names], dtype=float)
+        # Cumulative completions and latency sums to average any range of slices
+        cum_done = np.concatenate(([0], np.cumsum(done.sum(axis=0))))
+        cum_latency = np.concatenate(([0], np.cumsum((latency * done).sum(axis=0))))
+        def mean(i:int, j:int) -> (float|None):
+            count = cum_done[j] - cum_done[i]
+            return float((cum_latency[j] - cum_latency[i]) / count) if count else None
+        lost, requeued = total("Lost"), total("Requeued")
+        starts = sorted(fault.start for fault in self.faults)
+        rval = []
+        for i,fault in enumerate(self.faults):
+            first = int(np.searchsorted(times, fault.start))
+            baseline = mean(int(np.searchsorted(times, fault.start - baseline_window)), first)
+            horizon = next((start for start in starts if start > fault.start), sim.curr_time)
+            last = int(np.searchsorted(times, horizon - settle, side="right"))    # full windows only
+            recovered = first
+            if baseline is not None:
+                limit = baseline * (1 + tolerance) + (sim.time_slice if atol is None else atol)
+                window = np.searchsorted(times, times + settle)
+                for k in range(first, last):
+                    value = mean(k, window[k])
+                    if value is None or value > limit or _delta(lost, k, window[k]) > 0:
+                        recovered = k + 1
+            rebalanced = float(ends[recovered-1]) if recovered > first else fault.start
+            absorbed = baseline is not None and rebalanced + settle <= horizon
+            # Impact of the fault: while it is active and until it is absorbed
+            end = len(times) if fault.end is None else int(np.searchsorted(times, fault.end))
+            stop = max(end, recovered) if absorbed else int(np.searchsorted(times, horizon))
+            rval.append({
+                "type": fault.type,
+                "node": fault.node,
+                "start": fault.start,
+                "end": fault.end,
+                "detection_time": self.detected[i] - fault.start if i in self.detected else None,
+                "time_to_rebalance": rebalanced - fault.start if absorbed else None,
+                "recovered": absorbed,
+                "baseline_latency": baseline,
+                "mean_latency": mean(first, stop),
+                "max_latency": float(latency[:, first:stop].max()) if stop > first else None,
+                "excess_latency": float(cum_latency[stop] - cum_latency[first]
+                                        - baseline * (cum_done[stop] - cum_done[first]))
+                                  if baseline is not None else None,
+                "completed": int(cum_done[stop] - cum_done[first]),
+                "lost": int(_delta(lost, first, stop)),
+                "requeued": int(_delta(requeued, first, stop)),
+            })
+        return rval
+
+
+def _delta(values:np.ndarray, first:int, last:int) -> float:
+    """Increase of a cumulative series over the slices first to last (exclusive)"""
+    return (values[last-1] if last > 0 else 0) - (values[first-1] if first > 0 else 0)
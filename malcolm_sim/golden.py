@@ -0,0 +1,259 @@
+"""
+Differential golden-trace harness. Records the per-task completions and
+per-slice metrics of the reference engine under a fixed seed, replays the
+same workload through another engine and diffs the two within tolerances
+"""
+
+from __future__ import annotations
+
+import copy
+import gzip
+import json
+import logging
+from dataclasses import dataclass, asdict, field
+from typing import Callable, Dict, List, Tuple, Union
+
+import numpy as np
+
+from .adaptive_slice import resample
+from .malcolm_node import MalcolmNode
+from .malcolm_sim import MalcolmSim
+from .task import Task
+from .task_gen import TaskGen
+
+
+TRACE_VERSION = 2
+
+logger = logging.getLogger("malcolm_sim.golden")
+
+# An engine is a name of MalcolmSim.ENGINES or a function(sim, time_slice, sim_time)
+Engine = Union[str, Callable[[MalcolmSim, float, float], None]]
+
+# A generated task: (gen_time, name, [(kind, time), ...], payload, priority, class attrs)
+WorkloadTask = Tuple[float, str, List[Tuple[int, float]], float, int, Dict[str, any]]
+
+# Task attrs of a task class (see TaskGen) that are recorded with the workload
+CLASS_ATTRS = ("class", "slo")
+
+
+class RecordingTaskGen:
+    """
+    Wraps a TaskGen and records every generated task as
+    (gen_time, name, stages, payload, priority, class attrs)
+    """
+
+    def __init__(self, task_gen:TaskGen) -> None:
+        self.task_gen = task_gen
+        self.tasks:List[WorkloadTask] = []
+
+    @property
+    def classes(self) -> List[TaskGen]:
+        """The task classes of the wrapped TaskGen, for the per-class metrics"""
+        return getattr(self.task_gen, "classes", [])
+
+    def reset(self) -> None:
+        """Restart task generation at time 0"""
+        self.task_gen.reset()
+        self.tasks = []
+
+    def gen_time_slice(self, time_slice:float, curr_time:float) -> List[Task]:
+        """Generate all tasks for a time slice"""
+        tasks = self.task_gen.gen_time_slice(time_slice, curr_time)
+        for task in tasks:
+            self.tasks.append((
+                curr_time, task.name,
+                list(zip(task.stage_kinds, task.stage_times)), task.payload,
+                task.priority, {key: task.attrs[key] for key in CLASS_ATTRS if key in task.attrs}
+            ))
+        return tasks
+
+
+class ReplayTaskGen:
+    """
+    Releases a recorded workload: every task is generated in the time slice
+    that contains its recorded generation time, whatever the time slices
+    """
+
+    def __init__(self, tasks:List[WorkloadTask], classes:List[TaskGen]=None) -> None:
+        """classes: the task classes of the recording, for the per-class metrics"""
+        self.tasks = sorted(tasks, key=lambda x: x[0])
+        self.classes:List[TaskGen] = classes if classes is not None else []
+        self.index:int = 0
+
+    def reset(self) -> None:
+        """Restart the replay at time 0"""
+        self.index = 0
+
+    def gen_time_slice(self, time_slice:float, curr_time:float) -> List[Task]:
+        """Generate the recorded tasks of a time slice"""
+        end = curr_time + time_slice - 1e-9
+        rval = []
+        while self.index < len(self.tasks) and self.tasks[self.index][0] < end:
+            _, name, stages, payload, priority, attrs = self.tasks[self.index]
+            task = Task.from_stages(name, stages, payload, attrs={"gen_time": curr_time, **attrs})
+            task.priority = priority
+            rval.append(task)
+            self.index += 1
+        return rval
+
+
+@dataclass
+class GoldenTrace:
+    """Canonical trace of one simulation run"""
+    config:dict
+    time_slice:float
+    sim_time:float
+    engine:str
+    # Generated workload, see WorkloadTask
+    workload:List[WorkloadTask] = field(default_factory=list)
+    # Completed tasks by name: (node, completion time, latency)
+    completions:Dict[str, Tuple[str, float, float]] = field(default_factory=dict)
+    # Per-slice metrics and their sample times as collected by MalcolmSim
+    metrics:Dict[str, Dict[str, List[float]]] = field(default_factory=dict)
+    times:List[float] = field(default_factory=list)
+    version:int = TRACE_VERSION
+
+
+    @classmethod
+    def record(cls, config:dict, time_slice:float, sim_time:float,
+               engine:Engine="reference", seed:int=0,
+               workload:List[WorkloadTask]=None) -> GoldenTrace:
+        """
+        Run config under seed (unless the config has one) and record its
+        trace. If workload is given, it is replayed instead of generating tasks
+        """
+        config = copy.deepcopy(config)
+        config.setdefault("seed", seed)
+        MalcolmSim.reset()
+        sim = MalcolmSim.from_config(config)
+        if workload is None:
+            sim.task_gen = RecordingTaskGen(sim.task_gen)
+        else:
+            sim.task_gen = ReplayTaskGen(workload, sim.task_classes())
+        completions = {}
+        def hook(node:MalcolmNode, completed:List[Task], curr_time:float) -> None:
+            for task in completed:
+                completions[task.name] = (node.name, curr_time, task.attrs["latency"])
+        MalcolmNode.completion_hooks.append(hook)
+        try:
+            if callable(engine):
+                engine(sim, time_slice, sim_time)
+                engine = getattr(engine, "__name__", "custom")
+            else:
+                sim.run_engine(engine, time_slice, sim_time)
+        finally:
+            MalcolmNode.completion_hooks.remove(hook)
+        return cls(
+            config=config,
+            time_slice=time_slice,
+            sim_time=sim_time,
+            engine=engine,
+            workload=sim.task_gen.tasks if workload is None else workload,
+            completions=completions,
+            metrics={
+                metric_name: {name: [float(x) for x in values] for name,values in metric.items()}
+                for metric_name,metric in sim.metrics.items()
+            },
+            times=list(sim.times),
+        )
+
+
+    def replay(self, engine:Engine) -> GoldenTrace:
+        """Run the workload of this trace through engine and record its trace"""
+        return self.record(self.config, self.time_slice, self.sim_time, engine, workload=self.workload)
+
+
+    @classmethod
+    def load(cls, filename:str) -> GoldenTrace:
+        """Load a trace written by GoldenTrace.save"""
+        with gzip.open(filename, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != TRACE_VERSION:
+            raise ValueError(f"Unsupported trace version '{data.get('version')}'")
+        data["workload"] = [(t, name, [tuple(x) for x in stages], payload, priority, attrs)
+                            for t,name,stages,payload,priority,attrs in data["workload"]]
+        data["completions"] = {name: tuple(x) for name,x in data["completions"].items()}
+        return cls(**data)
+
+
+    def save(self, filename:str) -> None:
+        """Write this trace as compressed JSON"""
+        with gzip.open(filename, "wt", encoding="utf-8") as f:
+            json.dump(asdict(self), f)
+
+
+@dataclass
+class Tolerance:
+    """
+    Allowed differences between a candidate and a reference trace. Latencies
+    and completion times are in ms. mean_rtol compares the mean of each
+    metric series instead of every sample, for engines that only match
+    statistically (e.g. different time slices); None compares samples
+    """
+    latency_atol:float = 0.0
+    metric_atol:float = 1e-9
+    metric_rtol:float = 1e-9
+    mean_rtol:float = None
+    max_missing:int = 0             # completed in one trace only
+    max_node_mismatch:int = 0       # completed on a different node
+
+
+def diff(reference:GoldenTrace, candidate:GoldenTrace, tolerance:Tolerance=None) -> Dict[str, any]:
+    """Compare candidate against reference. Returns a JSON serializable report"""
+    if tolerance is None:
+        tolerance = Tolerance()
+    ref, cand = reference.completions, candidate.completions
+    missing = sorted(set(ref) - set(cand), key=_task_number)
+    extra = sorted(set(cand) - set(ref), key=_task_number)
+    common = [name for name in ref if name in cand]
+    node_mismatch = [name for name in common if ref[name][0] != cand[name][0]]
+    latency_diff = np.array([abs(ref[name][2] - cand[name][2]) for name in common])
+    worst_latency = float(latency_diff.max()) if len(latency_diff) else 0.0
+    late = int((latency_diff > tolerance.latency_atol).sum())
+    # Per-slice metrics, resampled onto the reference grid if the slices differ
+    cand_metrics = candidate.metrics
+    if candidate.times != reference.times and candidate.times:
+        cand_metrics = resample(candidate.metrics, candidate.times, reference.time_slice,
+                                reference.times[-1] if reference.times else None)
+    metrics = {}
+    for metric_name,metric in reference.metrics.items():
+        for node_name,values in metric.items():
+            a = np.asarray(values, dtype=float)
+            b = np.asarray(cand_metrics.get(metric_name, {}).get(node_name, []), dtype=float)
+            n = min(len(a), len(b))
+            if tolerance.mean_rtol is not None:
+                mean_a, mean_b = (float(a.mean()) if len(a) else 0.0), (float(b.mean()) if len(b) else 0.0)
+                error = abs(mean_a - mean_b)
+                ok = error <= tolerance.mean_rtol*abs(mean_a) + tolerance.metric_atol
+            else:
+                error = float(np.abs(a[:n] - b[:n]).max()) if n else 0.0
+                ok = len(a) == len(b) \
+                    and bool(np.allclose(a, b, rtol=tolerance.metric_rtol, atol=tolerance.metric_atol))
+            metrics[f"{metric_name}:{node_name}"] = {"max_error": error, "passed": ok}
+    rval = {
+        "reference_engine": reference.engine,
+        "candidate_engine": candidate.engine,
+        "completed": len(ref),
+        "missing": len(missing),
+        "extra": len(extra),
+        "node_mismatch": len(node_mismatch),
+        "latency_exceeded": late,
+        "worst_latency_error": worst_latency,
+        "metrics": metrics,
+        "first_missing": missing[:10],
+        "first_extra": extra[:10],
+    }
+    rval["passed"] = len(missing) + len(extra) <= tolerance.max_missing \
+        and len(node_mismatch) <= tolerance.max_node_mismatch \
+        and late == 0 \
+        and all(x["passed"] for x in metrics.values())
+    logger.info(
+        "Trace diff %s vs %s: %s", reference.engine, candidate.engine,
+        "passed" if rval["passed"] else "FAILED"
+    )
+    return rval
+
+
+def _task_number(name:str) -> Tuple[int, (int|str)]:
+    """Sort key of task names, numerically for TaskGen names ('#123')"""
+    return (0, int(name[1:])) if name[1:].isdigit() else (1, name)
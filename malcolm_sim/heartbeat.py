@@ -3,10 +3,12 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from typing import ClassVar
 
 from .network import Network
 
 HEARTBEAT_SIZE:int = 256
+HEARTBEAT_TIMEOUT:float = 5.0     # ms without a heartbeat until a node is presumed dead
 
 
 @dataclass
@@ -14,9 +16,21 @@ class Heartbeat:
     """Malcolm Node status packet"""
     expected_performance:float
     queue_size:int
+    # The node is (nearly) full and asks senders to route tasks elsewhere
+    backpressure:bool = False
+    # Simulation time the heartbeat was sent at in ms
+    time:float = 0
+
+    # Nodes whose last heartbeat is older than this many ms are presumed dead
+    timeout:ClassVar[float] = HEARTBEAT_TIMEOUT
+
+    def is_stale(self, curr_time:float) -> bool:
+        """True if the sender is presumed dead at curr_time"""
+        return self.time < curr_time - self.timeout
 
     @classmethod
-    def make_packet(cls, src:str, dest:str, expected_performance:float, queue_size:int) -> Network.Packet:
+    def make_packet(cls, src:str, dest:str, expected_performance:float, queue_size:int,
+                    backpressure:bool=False, time:float=0) -> Network.Packet:
         """Create a Heartbeat and embed it in a network packet"""
-        data = cls(expected_performance, queue_size)
+        data = cls(expected_performance, queue_size, backpressure, time)
         return Network.Packet(data, HEARTBEAT_SIZE, src, dest, "Heartbeat", None)
@@ -0,0 +1,99 @@
+"""Contains malcolm_sim.Histogram, a log-binned histogram for latency quantiles"""
+
+from __future__ import annotations
+
+import math
+from typing import Dict, Iterable
+
+import numpy as np
+
+
+class Histogram:
+    """
+    Histogram with logarithmically spaced bins covering [min_value, max_value],
+    so quantiles have a bounded relative error of about 1/bins_per_decade
+    decades regardless of magnitude. Values below min_value (including 0) are
+    counted in an underflow bin, values above max_value in the last bin
+    """
+
+    def __init__(self, min_value:float=1e-3, max_value:float=1e7, bins_per_decade:int=100) -> None:
+        if not 0 < min_value < max_value:
+            raise ValueError("Histogram requires 0 < min_value < max_value")
+        self.min_value:float = min_value
+        self.max_value:float = max_value
+        self.bins_per_decade:int = bins_per_decade
+        num_bins = math.ceil(math.log10(max_value/min_value) * bins_per_decade)
+        self.counts:np.ndarray = np.zeros(num_bins + 1, dtype=np.int64)   # [0] is underflow
+        self.total:float = 0.0
+        self.max:float = 0.0
+
+
+    def __len__(self) -> int:
+        return int(self.counts.sum())
+
+
+    def add(self, values:Iterable[float]) -> None:
+        """Add a batch of values"""
+        values = np.asarray(values, dtype=float)
+        if not values.size:
+            return
+        index = np.zeros(values.shape, dtype=np.int64)
+        above = values >= self.min_value
+        index[above] = np.minimum(
+            np.log10(values[above] / self.min_value) * self.bins_per_decade,
+            len(self.counts) - 2
+        ).astype(np.int64) + 1
+        self.counts += np.bincount(index, minlength=len(self.counts))
+        self.total += float(values.sum())
+        self.max = max(self.max, float(values.max()))
+
+
+    def merge(self, other:Histogram) -> None:
+        """Add the counts of a histogram with the same bins"""
+        if (other.min_value, other.max_value, other.bins_per_decade) \
+                != (self.min_value, self.max_value, self.bins_per_decade):
+            raise ValueError("Cannot merge histograms with different bins")
+        self.counts += other.counts
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+
+    def clear(self) -> None:
+        """Remove all values"""
+        self.counts[:] = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def mean(self) -> float:
+        """Exact mean of all values"""
+        count = len(self)
+        return self.total / count if count else 0.0
+
+
+    def quantile(self, q:float) -> float:
+        """
+        Approximate q-quantile (0 <= q <= 1), the geometric center of the bin
+        that holds it. Returns 0 for the underflow bin or an empty histogram
+        """
+        count = len(self)
+        if not count:
+            return 0.0
+        i = int(np.searchsorted(np.cumsum(self.counts), q*count, side="left"))
+        if i == 0:
+            return 0.0
+        value = self.min_value * 10**((i - 0.5) / self.bins_per_decade)
+        return min(value, self.max)
+
+
+    def summary(self) -> Dict[str, float]:
+        """Count, mean, max and the usual percentiles"""
+        return {
+            "count": len(self),
+            "mean": self.mean(),
+            "p50": self.quantile(0.50),
+            "p90": self.quantile(0.90),
+            "p99": self.quantile(0.99),
+            "p999": self.quantile(0.999),
+            "max": self.max,
+        }
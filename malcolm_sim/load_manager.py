@@ -3,8 +3,9 @@
 from __future__ import annotations
 
 import logging
-import numpy as np
-from typing import List, Tuple
+from typing import List, Set, Tuple
+
+from numpy.random import Generator, default_rng
 
 from .network import Network
 
@@ -14,12 +15,16 @@ from .task import Task
 class LoadManager:
     """Contains the DLB game to distribute tasks to other nodes"""
 
-    def __init__(self, name:(str|int)) -> None:
+    def __init__(self, name:(str|int), rng:Generator=None) -> None:
+        """rng: random stream for choosing forward destinations, a fresh unseeded one if None"""
         self.name = str(name)
+        self.rng:Generator = rng if rng is not None else default_rng()
         self.accept:float = 1.0
         self.forward:float = 0.0
         self.src:str = None
         self.possible_destinations:List[str] = []
+        # Destinations advertising backpressure, avoided unless all are blocked
+        self.blocked:Set[str] = set()
         self.logger = logging.getLogger(f"malcolm_sim.MalcolmNode.LoadManager:{self.name}")
     
     def sim_time_slice(self, time_slice:float, incoming_tasks:List[Task]) -> Tuple[List[Task],List[Network.Packet]]:
@@ -44,6 +49,9 @@ class LoadManager:
         num_accept = int(total_tasks * self.accept)
         num_forward = total_tasks - num_accept
 
+        if num_forward and any(task.priority != incoming_tasks[0].priority for task in incoming_tasks):
+            # Keep the highest priorities, forward the rest (stable within a priority)
+            incoming_tasks = sorted(incoming_tasks, key=lambda task: -task.priority)
         accepted = incoming_tasks[:num_accept]
         forwarded = incoming_tasks[num_accept:]
 
@@ -52,7 +60,16 @@ class LoadManager:
         for task in forwarded:
             self.logger.debug(f"Forwarded task: {task}")
         forwarded_packets = []
+        destinations = self.possible_destinations
+        if forwarded and self.blocked:
+            destinations = [x for x in destinations if x not in self.blocked]
+        if forwarded and not destinations:
+            # Every peer is blocked or dead, keep the tasks
+            self.logger.debug("No destination to forward to, accepting %d task(s)", len(forwarded))
+            accepted = accepted + forwarded
+            forwarded = []
         for task in forwarded:
-            forwarded_packets.append(task.make_packet(self.src, np.random.choice(self.possible_destinations)))
+            dest = destinations[self.rng.integers(len(destinations))]
+            forwarded_packets.append(task.make_packet(self.src, dest))
         return accepted, forwarded_packets
                     
\ No newline at end of file
@@ -2,10 +2,21 @@
 import logging
 
 
+# Names of loggers already set up by get_main_logger
+_configured = set()
+
+
 def get_main_logger(name:str, filename:str = None) -> logging.Logger:
-    """Set up and return the main logger. Only run once"""
+    """
+    Set up and return the main logger. Handlers are only installed on the first
+    call, and a level set before that call is kept
+    """
     main_logger = logging.getLogger(name)
-    main_logger.setLevel(logging.INFO)
+    if name in _configured:
+        return main_logger
+    _configured.add(name)
+    if logging.NOTSET == main_logger.level:
+        main_logger.setLevel(logging.INFO)
 
     # Console handler
     console_handler = logging.StreamHandler()
@@ -16,14 +27,11 @@ def get_main_logger(name:str, filename:str = None) -> logging.Logger:
 
     # File handler
     if filename:
-        file_handler = logging.FileHandler(filename)
+        file_handler = logging.FileHandler(filename, delay=True)
         file_handler.setFormatter(logging.Formatter(
             "%(asctime)s %(levelname)s [%(name)s] %(message)s"
         ))
-        main_logger.addHandler(console_handler)
-
-    # Create log level TRACE
-    add_logging_level("TRACE", logging.DEBUG - 5)
+        main_logger.addHandler(file_handler)
 
     return main_logger
 
@@ -79,3 +87,8 @@ def add_logging_level(level_name, level_num, method_name=None):
     setattr(logging, level_name, level_num)
     setattr(logging.getLoggerClass(), method_name, log_for_level)
     setattr(logging, method_name, log_to_root)
+
+
+# Create log level TRACE (used by the Schedular)
+if not hasattr(logging, "TRACE"):
+    add_logging_level("TRACE", logging.DEBUG - 5)
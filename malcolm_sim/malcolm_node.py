@@ -3,22 +3,37 @@
 from __future__ import annotations
 
 import logging
-import re
 import threading
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Tuple
+
+from numpy.random import Generator
 
 from .load_manager import LoadManager
 from .policy_optimizer import PolicyOptimizer
 from .network import Network
+from .profiler import Profiler
+from .rng import RandomStreams
 from .heartbeat import Heartbeat
+from .histogram import Histogram
 from .schedular import Schedular
+from .slowdown import Slowdown
 from .task import Task
 from .thread_safe_list import ThreadSafeList
+from .tracer import TaskTracer
 
 
 TIMEOUT = 20
 TIMEOUT_MSG = "Dead-lock detected"
 
+# What a full node does with tasks beyond its queue capacity
+ADMISSION_POLICIES = ("reject", "drop-oldest", "redirect")
+
+# Destination of the heartbeats to the Central Loadbalancer
+CENTRAL_DEST = "CentralLoadBalancer"
+
+# Prefix of the source and destination addresses of Malcolm Nodes
+NODE_PREFIX = "MalcolmNode:"
+
 
 class MalcolmNode:
     """
@@ -34,11 +49,18 @@ class MalcolmNode:
     # List of all instantiated nodes
     all_nodes:Dict[str,MalcolmNode] = {}
 
+    # Last heartbeat each node sent to the Central Loadbalancer
+    central_heartbeats:Dict[str,Heartbeat] = {}
+
     # Multi-thread locks and callback
     start_time_slice:threading.Event = threading.Event()
     barrier:threading.Barrier = None
     async_callback:Callable = None
 
+    # Called with (node, completed tasks, curr_time) after every time slice
+    # that completed tasks, e.g. to record traces
+    completion_hooks:List[Callable[[MalcolmNode, List[Task], float], None]] = []
+
 
     @classmethod
     def _async_callback(cls) -> None:
@@ -53,8 +75,11 @@ class MalcolmNode:
 
 
     @classmethod
-    def from_config(cls, node_config:dict) -> MalcolmNode:
-        """Create a Malcolm Node from config dict. Assumes schema is validated"""
+    def from_config(cls, node_config:dict, streams:RandomStreams=None) -> MalcolmNode:
+        """
+        Create a Malcolm Node from config dict. Assumes schema is validated.
+        Random streams of the node are keyed by its name
+        """
         defaults = {
             "core_perf": 1,
             "io_perf": 1,
@@ -62,30 +87,61 @@ class MalcolmNode:
         for k,v in defaults.items():
             if k not in node_config:
                 node_config[k] = v
+        if "slowdowns" in node_config:
+            node_config["slowdowns"] = [
+                Slowdown.from_config(x) for x in node_config["slowdowns"]
+            ]
+        if streams is not None:
+            node_config["rng"] = streams.generator("MalcolmNode", node_config["name"], "LoadManager")
         return cls(**node_config)
 
 
     def __init__(self,
                  name:(str|int),
                  core_count:int,
-                 core_perf:float,
+                 core_perf:(float|List[float]),
                  io_count:int,
-                 io_perf:float,
+                 io_perf:(float|List[float]),
                  overhead:float,
-                 bandwidth:int
+                 bandwidth:int,
+                 slowdowns:List[Slowdown]=None,
+                 rng:Generator=None,
+                 queue_capacity:int=None,
+                 inbox_capacity:int=None,
+                 tx_capacity:int=None,
+                 admission:str="reject",
+                 backpressure:float=0.9,
+                 packet_header:int=0,
+                 batch_size:int=1
     ) -> None:
         """
         This init method is not thread-safe. Init all Malcolm Nodes in same
-        thread before starting
+        thread before starting. rng is the random stream of the Load Manager.
+
+        queue_capacity: max tasks waiting in the Schedular queues
+        inbox_capacity: max tasks received per time slice
+        tx_capacity: max packets waiting to be sent
+        None means unbounded. Tasks beyond the capacity are handled by the
+        admission policy (see ADMISSION_POLICIES). The node advertises
+        backpressure in its heartbeats once its queues are filled to the
+        backpressure fraction of queue_capacity
+
+        packet_header: bytes of overhead of every sent packet
+        batch_size: max packets per batch packet, 1 sends every task and
+        heartbeat in its own packet (see Network)
         """
         self.name:str = str(name)
         if self.name in self.all_nodes:
             msg = f"Malcolm Node with name '{self.name}' already exists"
             self.logger.critical(msg)
             raise ValueError(msg)
+        if admission not in ADMISSION_POLICIES:
+            raise ValueError(
+                f"Admission policy '{admission}' is invalid, expected one of {', '.join(ADMISSION_POLICIES)}"
+            )
         self.src = f"MalcolmNode:{self.name}"
         #Init Load Manager
-        self.load_manager = LoadManager(self.name)
+        self.load_manager = LoadManager(self.name, rng)
         # Init Policy Optimizer
         self.policy_optimizer = PolicyOptimizer(self.name, self)
         # Init Schedular
@@ -95,15 +151,40 @@ class MalcolmNode:
             core_perf,
             io_count,
             io_perf,
-            overhead
+            overhead,
+            slowdowns
         )
         # Init Network
-        self.network = Network(bandwidth)
+        self.network = Network(bandwidth, packet_header, batch_size)
         # Init internal lists
         self.task_inbox:ThreadSafeList[Task] = ThreadSafeList()
         self.tx_queue:List[Network.Packet] = []
         self.other_heartbeats:Dict[Heartbeat] = {}
         self.latency:float = 0
+        # Admission control
+        self.queue_capacity:int = queue_capacity
+        self.inbox_capacity:int = inbox_capacity
+        self.tx_capacity:int = tx_capacity
+        self.admission:str = admission
+        self.backpressure_level:float = backpressure
+        self.rejected:int = 0       # tasks refused on arrival
+        self.dropped:int = 0        # tasks discarded after they were accepted
+        self.redirected:int = 0     # tasks sent to a peer because this node is full
+        # Faults (see FaultInjector)
+        self.up:bool = True
+        self.crash_policy:str = "lose"          # in-flight tasks of a crash: lose or requeue
+        self.lost:int = 0                       # tasks lost to crashes
+        self.requeued:int = 0                   # tasks handed back to the Central Loadbalancer
+        self.requeue_tasks:List[Task] = []      # not yet picked up by the Central Loadbalancer
+        # Latency of every completed task for percentiles
+        self.latency_hist:Histogram = Histogram()
+        # Per task class (see TaskMix): completed tasks, tasks over their
+        # latency SLO, latencies and the latencies of the last time slice
+        self.class_completed:Dict[str, int] = {}
+        self.class_violations:Dict[str, int] = {}
+        self.class_hist:Dict[str, Histogram] = {}
+        self.class_latencies:Dict[str, List[float]] = {}
+        self.slo_violations:int = 0
         # Add self to list of nodes
         self.all_nodes[self.name] = self
         self.barrier = threading.Barrier(
@@ -113,10 +194,144 @@ class MalcolmNode:
         )
 
 
+    def __getstate__(self) -> dict:
+        """Locks cannot be pickled, only keep the barrier size"""
+        state = self.__dict__.copy()
+        state["barrier"] = self.barrier.parties if self.barrier else None
+        return state
+
+
+    def __setstate__(self, state:dict) -> None:
+        parties = state.pop("barrier")
+        self.__dict__.update(state)
+        self.barrier = None
+        if parties:
+            self.barrier = threading.Barrier(parties, action=self._async_callback, timeout=TIMEOUT)
+
+
     def get_heartbeat_packet(self, dest:str) -> Network.Packet:
         """Get a heartbeat from this node and wrap it in a network packet (thread-safe)"""
-        queue_size = len(self.schedular.queue) + len(self.schedular.io_queue)
-        return Heartbeat.make_packet(self.src, dest, self.schedular.expected_performance(), queue_size)
+        queue_size = self.schedular.queued()
+        return Heartbeat.make_packet(
+            self.src, dest, self.schedular.expected_performance(), queue_size, self.backpressure(),
+            self.schedular.time
+        )
+
+
+    def backpressure(self) -> bool:
+        """True if the queues are filled beyond the backpressure level (thread-safe)"""
+        return self.queue_capacity is not None \
+            and self.schedular.queued() >= self.backpressure_level * self.queue_capacity
+
+
+    def crash(self, policy:str="lose") -> None:
+        """
+        Take this node down. Its queued, running, received and unsent tasks
+        are lost, or handed back to the Central Loadbalancer with the requeue
+        policy, and so are tasks arriving while it is down (NOT thread-safe)
+        """
+        self.up = False
+        self.crash_policy = policy
+        tasks = self.schedular.evict() + self.task_inbox.as_list()
+        tasks += [packet.data for packet in self.tx_queue if packet.type == "Task"]
+        self.task_inbox.clear()
+        self.tx_queue = []
+        self._discard(tasks)
+        self.logger.info("MalcolmNode:%s : Crashed with %d task(s) in flight", self.name, len(tasks))
+
+
+    def recover(self) -> None:
+        """Bring this node back up with empty queues (NOT thread-safe)"""
+        self.up = True
+        self.logger.info("MalcolmNode:%s : Recovered", self.name)
+
+
+    def _discard(self, tasks:List[Task]) -> None:
+        """Lose or requeue tasks of a crashed node according to its crash policy"""
+        if self.crash_policy == "requeue":
+            for task in tasks:
+                if task.trace is not None:
+                    task.trace.append(("balancer", self.schedular.time))
+            self.requeue_tasks.extend(tasks)
+            self.requeued += len(tasks)
+        else:
+            self.lost += len(tasks)
+
+
+    def admit(self, tasks:List[Task]) -> Tuple[List[Task], List[Network.Packet]]:
+        """
+        Apply the admission policy to tasks accepted by the Load Manager.
+        Returns the tasks to queue and the packets of redirected tasks
+        (NOT thread-safe)
+        """
+        if self.queue_capacity is None:
+            return tasks, []
+        excess = self.schedular.queued() + len(tasks) - self.queue_capacity
+        if excess <= 0:
+            return tasks, []
+        if self.admission == "drop-oldest":
+            dropped = self.schedular.drop_oldest(excess)
+            excess -= len(dropped)
+            # More new tasks than the capacity, the oldest of them go as well
+            dropped.extend(tasks[:excess])
+            self.dropped += len(dropped)
+            self.logger.debug("MalcolmNode:%s : Dropped %d task(s)", self.name, len(dropped))
+            return tasks[max(excess, 0):], []
+        admitted, overflow = tasks[:len(tasks)-excess], tasks[len(tasks)-excess:]
+        packets = []
+        if self.admission == "redirect":
+            overflow, packets = self._redirect(overflow)
+        self.rejected += len(overflow)
+        if overflow:
+            self.logger.debug("MalcolmNode:%s : Rejected %d task(s)", self.name, len(overflow))
+        return admitted, packets
+
+
+    def _redirect(self, tasks:List[Task]) -> Tuple[List[Task], List[Network.Packet]]:
+        """
+        Send tasks to the least loaded peers without backpressure according
+        to their last heartbeats. Tasks that were already redirected by every
+        other node are not redirected again. Returns the tasks that could not
+        be redirected and the packets of the redirected ones
+        """
+        loads = {
+            name: [heartbeat.queue_size, heartbeat.expected_performance]
+            for name,heartbeat in self.other_heartbeats.items()
+            if not heartbeat.backpressure and heartbeat.expected_performance > 0
+        }
+        if not loads:
+            return tasks, []
+        remaining, packets = [], []
+        for task in tasks:
+            redirects = task.attrs.get("redirects", 0)
+            if redirects >= len(self.all_nodes) - 1:
+                remaining.append(task)
+                continue
+            name = min(loads, key=lambda x: loads[x][0] / loads[x][1])
+            loads[name][0] += 1
+            task.attrs["redirects"] = redirects + 1
+            packets.append(task.make_packet(self.src, f"MalcolmNode:{name}"))
+        self.redirected += len(packets)
+        return remaining, packets
+
+
+    def _trim_tx_queue(self) -> None:
+        """
+        Bound the packets waiting to be sent to tx_capacity. Stale heartbeats
+        go first, then task packets according to the admission policy
+        (NOT thread-safe)
+        """
+        excess = len(self.tx_queue) - self.tx_capacity
+        if excess <= 0:
+            return
+        heartbeats = [x for x in self.tx_queue if x.type == "Heartbeat"]
+        tasks = [x for x in self.tx_queue if x.type != "Heartbeat"]
+        heartbeats = heartbeats[min(excess, len(heartbeats)):]
+        excess = len(heartbeats) + len(tasks) - self.tx_capacity
+        if excess > 0:
+            tasks = tasks[excess:] if self.admission == "drop-oldest" else tasks[:-excess]
+            self.dropped += excess
+        self.tx_queue = heartbeats + tasks
 
 
     def recv_packets(self, packets:List[Network.Packet]) -> None:
@@ -124,8 +339,8 @@ class MalcolmNode:
         new_tasks:List[Task] = []
         for packet in packets:
             if "Heartbeat" == packet.type:
-                src = packet.src.split(":")[1]
-                if not src in list(self.all_nodes.keys()):
+                src = packet.src[len(NODE_PREFIX):]
+                if src not in self.all_nodes:
                     self.logger.error(
                         "MalcolmNode:%s : Received heartbeat from unknown source '%s'",
                         self.name, src
@@ -134,75 +349,166 @@ class MalcolmNode:
                     self.other_heartbeats[src] = packet.data
             elif "Task" == packet.type:
                 new_tasks.append(packet.data)
+                if packet.data.trace is not None:
+                    packet.data.trace.append(("inbox", self.schedular.time))
             else:
                 self.logger.error(
                     "MalcolmNode:%s : Unknown packet type '%s' (src=%s,attrs=%s)",
-                    self.name, packet.type, src, str(packet.attrs)
+                    self.name, packet.type, packet.src, str(packet.attrs)
                 )
         if new_tasks:
+            if self.inbox_capacity is not None:
+                new_tasks = self._limit_inbox(new_tasks)
             self.task_inbox.extend(new_tasks)
 
 
+    def _limit_inbox(self, new_tasks:List[Task]) -> List[Task]:
+        """
+        Bound the inbox to inbox_capacity tasks. With drop-oldest the oldest
+        waiting tasks are dropped, otherwise the new tasks are rejected
+        """
+        excess = len(self.task_inbox) + len(new_tasks) - self.inbox_capacity
+        if excess <= 0:
+            return new_tasks
+        if self.admission != "drop-oldest":
+            self.rejected += min(excess, len(new_tasks))
+            return new_tasks[:max(len(new_tasks) - excess, 0)]
+        for _ in range(min(excess, len(self.task_inbox))):
+            self.task_inbox.pop()
+            self.dropped += 1
+            excess -= 1
+        self.dropped += max(excess, 0)
+        return new_tasks[max(excess, 0):]
+
+
     @classmethod
     def route_packets(cls, packets:List[Network.Packet]) -> None:
         """Route network packets to the destination MalcolmNode (thread-safe)"""
         if not packets:
             return
-        routed_packets = {}
-        for node_name in cls.all_nodes:
-            routed_packets[node_name] = []
+        routed_packets:Dict[str, List[Network.Packet]] = {node_name: [] for node_name in cls.all_nodes}
         for packet in packets:
-            if match := re.match(r"^MalcolmNode:(.*)", packet.dest):
-                dest_node = match.group(1)
-                if dest_node in cls.all_nodes:
-                    routed_packets[dest_node].append(packet)
-                else:
+            dest = packet.dest
+            if dest.startswith(NODE_PREFIX):
+                node_packets = routed_packets.get(dest[len(NODE_PREFIX):])
+                if node_packets is None:
                     cls.logger.error(
                         "MalcolmNode.route_packets : Invalid packet destination '%s'. Node does not exist",
-                        packet.dest
+                        dest
                     )
+                elif packet.type == "Batch":
+                    node_packets.extend(packet.data)
+                else:
+                    node_packets.append(packet)
+            elif dest == CENTRAL_DEST:
+                for heartbeat in (packet.data if packet.type == "Batch" else [packet]):
+                    cls.central_heartbeats[heartbeat.src[len(NODE_PREFIX):]] = heartbeat.data
             else:
                 cls.logger.error(
                     "MalcolmNode.route_packets : Invalid packet destination '%s'. Should start with 'MalcolmNode:'",
-                    packet.dest
+                    dest
                 )
         for node_name,node_packets in routed_packets.items():
             cls.all_nodes[node_name].recv_packets(node_packets)
 
 
+    def _account_classes(self, completed:List[Task]) -> None:
+        """Record the latencies and SLO violations of completed tasks per task class"""
+        for task in completed:
+            name = task.attrs["class"]
+            latency = task.attrs["latency"]
+            self.class_latencies.setdefault(name, []).append(latency)
+            slo = task.attrs["slo"]
+            if slo is not None and latency > slo:
+                self.class_violations[name] = self.class_violations.get(name, 0) + 1
+                self.slo_violations += 1
+        for name,values in self.class_latencies.items():
+            self.class_completed[name] = self.class_completed.get(name, 0) + len(values)
+            self.class_hist.setdefault(name, Histogram()).add(values)
+
+
+    def clear_latencies(self) -> None:
+        """Forget the latencies of completed tasks, e.g. after a warm-up"""
+        self.latency_hist.clear()
+        self.class_hist = {}
+
+
     def sim_time_slice(self, time_slice:float, curr_time:float) -> List[Network.Packet]:
         """"
         Simulate time slice on this Malcolm Node (NOT thread-safe)
         """
+        if not self.up:
+            # Crashed: tasks sent here are lost or requeued, nothing is sent
+            self._discard(self.task_inbox.as_list())
+            self.task_inbox.clear()
+            self.schedular.time = curr_time + time_slice
+            self.schedular.core_utilization = 0
+            self.schedular.io_utilization = 0
+            self.latency = 0
+            self.class_latencies = {}
+            return []
+
         # Run Policy Optimizer
-        self.policy_optimizer.sim_time_slice(time_slice, self.load_manager)
+        with Profiler.section(self.name, "PolicyOptimizer"):
+            self.policy_optimizer.sim_time_slice(time_slice, self.load_manager, curr_time)
 
         # Run Load Manager (returns accepted and forwarded tasks)
         accepted:List[Task]
         forwarded:List[Network.Packet] = []
-        accepted,forwarded = self.load_manager.sim_time_slice(time_slice, self.task_inbox.as_list())
-        self.task_inbox.clear()
+        with Profiler.section(self.name, "LoadManager"):
+            # Peers under backpressure, presumed dead or without working units
+            self.load_manager.blocked = {
+                f"MalcolmNode:{name}" for name,heartbeat in self.other_heartbeats.items()
+                if heartbeat.backpressure or heartbeat.is_stale(curr_time)
+                or heartbeat.expected_performance <= 0
+            }
+            accepted,forwarded = self.load_manager.sim_time_slice(time_slice, self.task_inbox.as_list())
+            self.task_inbox.clear()
+            accepted,redirected = self.admit(accepted)
+            forwarded.extend(redirected)
+            if TaskTracer.enabled:
+                for packet in forwarded:
+                    if packet.data.trace is not None:
+                        packet.data.trace.append(("tx_queue", curr_time))
 
         # Send accepted tasks to Schedular and simulate
-        self.schedular.add_tasks(accepted)
-        completed = self.schedular.sim_time_slice(time_slice)
-        self.latency = 0
-        if completed:
-            for task in completed:
-                x = curr_time - task.attrs["gen_time"]
-                task.attrs["latency"] = x
-                self.latency += x
-            self.latency /= len(completed)
-
-        # Prepare outgoing packets
-        for node_name in self.all_nodes:    # heartbeat packets sent first
-            if node_name != self.name:
-                dest = f"MalcolmNode:{node_name}"
-                self.tx_queue.append(self.get_heartbeat_packet(dest))
-        self.tx_queue.extend(forwarded)
-
-        # Throttle outgoing packets via Network subsystem
-        rval,self.tx_queue = self.network.sim_time_slice(time_slice, self.tx_queue)
+        with Profiler.section(self.name, "Schedular"):
+            self.schedular.add_tasks(accepted)
+            completed = self.schedular.sim_time_slice(time_slice, curr_time)
+            self.latency = 0
+            self.class_latencies = {}
+            if completed:
+                latencies = []
+                for task in completed:
+                    x = curr_time - task.attrs["gen_time"]
+                    task.attrs["latency"] = x
+                    latencies.append(x)
+                self.latency = sum(latencies) / len(completed)
+                self.latency_hist.add(latencies)
+                if "class" in completed[0].attrs:
+                    self._account_classes(completed)
+                if TaskTracer.enabled:
+                    TaskTracer.record(completed)
+                for hook in self.completion_hooks:
+                    hook(self, completed, curr_time)
+
+        with Profiler.section(self.name, "Network"):
+            # Prepare outgoing packets
+            for node_name in self.all_nodes:    # heartbeat packets sent first
+                if node_name != self.name:
+                    dest = f"MalcolmNode:{node_name}"
+                    self.tx_queue.append(self.get_heartbeat_packet(dest))
+            self.tx_queue.append(self.get_heartbeat_packet(CENTRAL_DEST))
+            self.tx_queue.extend(forwarded)
+            if self.tx_capacity is not None:
+                self._trim_tx_queue()
+
+            # Throttle outgoing packets via Network subsystem
+            rval,self.tx_queue = self.network.sim_time_slice(time_slice, self.tx_queue)
+            if TaskTracer.enabled:
+                for packet in Network.unpack(rval):
+                    if packet.type == "Task" and packet.data.trace is not None:
+                        packet.data.trace.append(("network", curr_time))
         return rval
 
 
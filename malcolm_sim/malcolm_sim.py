@@ -2,98 +2,167 @@
 
 from __future__ import annotations
 
+import copy
 import json
 import logging
 import re
 import threading
-from typing import Dict, List
+from dataclasses import dataclass
+from typing import Dict, Iterator, List
 
-import yaml
-import matplotlib.pyplot as plt
-from schema import Schema, And, Or, Use, Optional
-
-from .iec_int import IEC_Int
+from . import report
+from .adaptive_slice import AdaptiveTimeSlice, resample
 from .central_loadbalancer import CentralLoadBalancer
+from .checkpoint import Checkpoint
+from .convergence import ConvergenceMonitor
+from .fault import FaultInjector
+from .heartbeat import HEARTBEAT_TIMEOUT, Heartbeat
+from .histogram import Histogram
 from .malcolm_node import MalcolmNode
+from .memory import MemoryMonitor
+from .policy_optimizer import PolicyOptimizer
+from .profiler import Profiler
+from .rng import RandomStreams
 from .schedular import Schedular
 from .task import Task
 from .task_gen import TaskGen
+from .telemetry import TelemetryServer
+from .tracer import TaskTracer
 from .log import get_main_logger
 
 
 TIMEOUT = 20
 
-task_schema = Or(
-    {
-        "type": Or("const", "constant"),
-        "value": And(Use(float), lambda n: n > 0)
-    },
-    {
-        "type": Or("gaussian", "normal"),
-        "center": And(Use(float), lambda n: n > 0),
-        "scale": And(Use(float), lambda n: n > 0)
-    }
-)
+
+@dataclass
+class MetricBatch:
+    """Metrics of consecutive time slices, as yielded by MalcolmSim.iter_run"""
+    start:float                                 # start time of the first slice in ms
+    end:float                                   # end time of the last slice in ms
+    times:List[float]                           # start time of each slice
+    metrics:Dict[str, Dict[str, List[any]]]     # metric -> node (or class) -> value per slice
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def last(self) -> Dict[str, Dict[str, any]]:
+        """Value of every metric in the last time slice"""
+        return {
+            name: {key: values[-1] for key,values in metric.items() if values}
+            for name,metric in self.metrics.items()
+        }
+
+    def mean(self) -> Dict[str, Dict[str, float]]:
+        """Mean of every metric over the time slices"""
+        return {
+            name: {key: sum(values) / len(values) for key,values in metric.items() if values}
+            for name,metric in self.metrics.items()
+        }
 
 
 class MalcolmSim:
     """Primary class of the malcolm_sim module. Allows simulating a Malcolm Cluster"""
 
-    logger:logging.Logger = get_main_logger("malcolm_sim", "malcolm_sim.log")
-
-    config_schema:Schema = Schema({
-        "MalcolmNodes": [{
-            "name": Use(str),
-            "core_count": And(Use(IEC_Int), lambda n: n > 0),
-            Optional("core_perf"): And(Use(float), lambda n: n > 0),
-            "io_count": And(Use(IEC_Int), lambda n: n > 0),
-            Optional("io_perf"): And(Use(float), lambda n: n > 0),
-            "overhead": And(Use(float), lambda n: n >= 0),
-            "bandwidth": And(Use(IEC_Int), lambda n: n > 0)
-        }],
-        "Tasks": {
-            "rate": task_schema,
-            "runtime": task_schema,
-            "io_time": task_schema,
-            "payload": task_schema
-        }
-    })
+    logger:logging.Logger = logging.getLogger("malcolm_sim")
+
+    # Built on first use to avoid importing schema with the package
+    _config_schema = None
+
+    ENGINES = ("reference", "adaptive")
+
+
+    @classmethod
+    def get_config_schema(cls):
+        """Return the schema of the config file"""
+        if cls._config_schema is None:
+            from .config_schema import config_schema    # pylint: disable=import-outside-toplevel
+            cls._config_schema = config_schema
+        return cls._config_schema
 
 
     @classmethod
     def from_json_yaml(cls, filename:str) -> MalcolmSim:
         """Configures the instance from a JSON or YAML file"""
-        # Parse file
+        return cls.from_config(cls.load_config(filename))
+
+
+    @classmethod
+    def load_config(cls, filename:str) -> dict:
+        """Parse a JSON or YAML config file without validating it"""
         ext = filename.split(".")[-1].lower()
         with open(filename, "r", encoding="utf-8") as f:
             if ext == "json":
-                config = json.load(f)
+                return json.load(f)
             elif ext in ["yaml", "yml"]:
-                config = yaml.safe_load(f)
+                import yaml     # pylint: disable=import-outside-toplevel
+                return yaml.safe_load(f)
             else:
                 raise ValueError(f"The file '{filename}' is not a valid JSON or YAML file.")
+
+
+    @classmethod
+    def from_config(cls, config:dict) -> MalcolmSim:
+        """
+        Configures the instance from a config dict. Malcolm Nodes are added to
+        the currently registered nodes (see MalcolmSim.reset). All random
+        streams derive from the seed key, or fresh entropy if it is missing
+        """
         # Validate schema
-        config = cls.config_schema.validate(config)
+        config = cls.get_config_schema().validate(copy.deepcopy(config))
+        streams = RandomStreams(config.get("seed"))
         # Parse config
         task_gen = None
+        nodes = []
+        faults = None
+        optimizer = None
         for key,value in config.items():
             key = key.lower()
             if "malcolmnodes" == key:
-                for node_config in value:
-                    MalcolmNode.from_config(node_config)
+                nodes = [MalcolmNode.from_config(node_config, streams) for node_config in value]
             elif "tasks" == key:
-                task_gen = TaskGen.from_config(value)
+                task_gen = TaskGen.from_config(value, streams)
+            elif "faults" == key:
+                faults = value
+            elif "policyoptimizer" == key:
+                optimizer = value
             # else not required because schema is validated
-        return cls(task_gen)
+        if optimizer is not None:
+            for node in nodes:
+                node.policy_optimizer = PolicyOptimizer.from_config(node.name, node, optimizer)
+        Heartbeat.timeout = config.get("heartbeat_timeout", HEARTBEAT_TIMEOUT)
+        sim = cls(task_gen)
+        sim.seed = streams.entropy
+        if faults is not None:
+            # After the nodes, the faults refer to them
+            sim.faults = FaultInjector.from_config(faults, streams.generator("Faults"))
+        return sim
+
+
+    @classmethod
+    def reset(cls) -> None:
+        """Remove all registered Malcolm Nodes and reset the Central Loadbalancer"""
+        MalcolmNode.all_nodes.clear()
+        MalcolmNode.central_heartbeats.clear()
+        CentralLoadBalancer.round_robin = 0
 
 
     def __init__(self, task_gen:TaskGen) -> None:
+        get_main_logger("malcolm_sim", "malcolm_sim.log")
         self.task_gen = task_gen
+        self.seed:int = None                # root seed of the random streams, if known
         self.metrics:Dict[str, Dict[str, List[any]]] = {}
+        self.times:List[float] = []         # start time of each metrics sample
+        self.curr_time:float = 0.0
+        self.time_slice:float = None        # length of the last simulated time slice
+        self.generated:int = 0              # number of tasks generated so far
+        self.report_slice:float = None      # grid step of report_metrics() if non-uniform
+        self.faults:FaultInjector = None
 
-    def cli(self, argv) -> None:
-        """Command line interface to MalcolmSim"""
-        raise NotImplementedError
+    @classmethod
+    def cli(cls, argv:List[str]=None) -> int:
+        """Command line interface to MalcolmSim (see malcolm_sim.cli)"""
+        from .cli import main   # pylint: disable=import-outside-toplevel
+        return main(argv)
 
     def get_metrics(self) -> Dict[str, Dict[str, (float|int)]]:
         """Collect metrics from all nodes"""
@@ -104,6 +173,13 @@ class MalcolmSim:
             "IO Queue": {},
             "Completed": {},
             "Latency": {},
+            "Rejected": {},
+            "Dropped": {},
+            "Redirected": {},
+            "Lost": {},
+            "Requeued": {},
+            "Optimizer Cost": {},
+            "Policy Changes": {},
         }
         for node in MalcolmNode.all_nodes.values():
             name = node.name
@@ -113,48 +189,314 @@ class MalcolmSim:
             rval["IO Queue"][name]  = len(node.schedular.io_queue)
             rval["Completed"][name] = node.schedular.completed
             rval["Latency"][name]   = node.latency
+            rval["Rejected"][name]  = node.rejected
+            rval["Dropped"][name]   = node.dropped
+            rval["Redirected"][name] = node.redirected
+            rval["Lost"][name]      = node.lost
+            rval["Requeued"][name]  = node.requeued
+            rval["Optimizer Cost"][name] = node.policy_optimizer.cost
+            rval["Policy Changes"][name] = node.policy_optimizer.changes
+        classes = [task_gen.task_class for task_gen in self.task_classes()]
+        if classes:
+            rval["SLO Violations"] = {
+                node.name: node.slo_violations for node in MalcolmNode.all_nodes.values()
+            }
+            rval["Class Completed"] = {}
+            rval["Class Latency"] = {}
+            rval["Class SLO Violations"] = {}
+            for name in classes:
+                latencies = [x for node in MalcolmNode.all_nodes.values()
+                             for x in node.class_latencies.get(name, ())]
+                rval["Class Completed"][name] = sum(
+                    node.class_completed.get(name, 0) for node in MalcolmNode.all_nodes.values()
+                )
+                rval["Class Latency"][name] = sum(latencies) / len(latencies) if latencies else 0
+                rval["Class SLO Violations"][name] = sum(
+                    node.class_violations.get(name, 0) for node in MalcolmNode.all_nodes.values()
+                )
         return rval
 
-    def run(self, time_slice:float, sim_time:float) -> None:
-        """Run single-threaded simulation of this MalcolmSim instance"""
-        curr_time:float = 0.0
+
+    def task_classes(self) -> List[TaskGen]:
+        """The Task Generators of the task classes, empty without classes"""
+        return getattr(self.task_gen, "classes", [])
+
+
+    def class_summary(self) -> Dict[str, Dict[str, any]]:
+        """
+        Priority, latency SLO, completed tasks, SLO violations and latency
+        summary (see Histogram.summary) of every task class since the start
+        of the run
+        """
+        rval = {}
+        for task_gen in self.task_classes():
+            name = task_gen.task_class
+            hist = Histogram()
+            completed = violations = 0
+            for node in MalcolmNode.all_nodes.values():
+                if name in node.class_hist:
+                    hist.merge(node.class_hist[name])
+                completed += node.class_completed.get(name, 0)
+                violations += node.class_violations.get(name, 0)
+            rval[name] = {
+                "priority": task_gen.priority,
+                "slo": task_gen.slo,
+                "completed": completed,
+                "slo_violations": violations,
+                "violation_rate": violations / completed if completed else None,
+                "latency": hist.summary(),
+            }
+        return rval
+
+    def run(self,
+            time_slice:float,
+            sim_time:float,
+            resume:bool=False,
+            convergence:ConvergenceMonitor=None,
+            adaptive:AdaptiveTimeSlice=None,
+            telemetry:TelemetryServer=None,
+            memory:MemoryMonitor=None
+    ) -> None:
+        """
+        Run single-threaded simulation of this MalcolmSim instance. If resume is
+        True, continue from the current time (e.g. after restoring a Checkpoint)
+        instead of starting over at time 0. If a ConvergenceMonitor is given,
+        stop early once the monitored metrics have reached steady state. If an
+        AdaptiveTimeSlice is given, time_slice is only the initial time slice.
+        If a TelemetryServer is given, it publishes live snapshots of the run.
+        If a MemoryMonitor is given, memory footprint metrics are recorded
+        """
+        for _ in self._run_slices(time_slice, sim_time, resume, convergence, adaptive, telemetry, memory):
+            pass
+
+
+    def iter_run(self,
+                 time_slice:float,
+                 sim_time:float,
+                 window:float=None,
+                 history:bool=True,
+                 resume:bool=False,
+                 convergence:ConvergenceMonitor=None,
+                 adaptive:AdaptiveTimeSlice=None,
+                 telemetry:TelemetryServer=None,
+                 memory:MemoryMonitor=None
+    ) -> Iterator[MetricBatch]:
+        """
+        Run like run, but yield the metrics of every window simulated ms (of
+        every time slice if None) as the simulation advances. The consumer
+        may stop early or change the cluster between batches. With history
+        False, the metrics are dropped once yielded (see clear_history), so
+        memory stays bounded but reports of the whole run are not available
+        and convergence cannot be detected
+        """
+        if not history and convergence is not None:
+            raise ValueError("Convergence detection requires the metrics history")
+        start = 0 if not resume else len(self.times)
+        next_batch = None
+        for _ in self._run_slices(time_slice, sim_time, resume, convergence, adaptive, telemetry, memory):
+            if next_batch is None:
+                next_batch = self.times[start] + (window or 0)
+            if self.curr_time < next_batch:
+                continue
+            batch = self._batch(start)
+            if history:
+                start = len(self.times)
+            else:
+                self.clear_history()
+                start = 0
+            next_batch = self.curr_time + (window or 0)
+            yield batch
+        if start < len(self.times):
+            batch = self._batch(start)
+            if not history:
+                self.clear_history()
+            yield batch
+
+
+    def step(self, n_slices:int=1, time_slice:float=None) -> MetricBatch:
+        """
+        Simulate n_slices more time slices of time_slice ms (the last time
+        slice if None) from the current time and return their metrics
+        """
+        if time_slice is None:
+            time_slice = self.time_slice
+            if time_slice is None:
+                raise ValueError("step requires a time_slice before the first time slice")
+        start = len(self.times)
+        for _ in range(n_slices):
+            self.sim_time_slice(time_slice)
+        return self._batch(start)
+
+
+    def clear_history(self) -> None:
+        """
+        Forget the metrics collected so far, not the state of the simulation,
+        e.g. once a MetricBatch was consumed
+        """
+        for metric in self.metrics.values():
+            for values in metric.values():
+                values.clear()
+        self.times.clear()
+
+
+    def _batch(self, start:int) -> MetricBatch:
+        """Metrics of the time slices from index start on"""
+        return MetricBatch(
+            self.times[start] if start < len(self.times) else self.curr_time,
+            self.curr_time,
+            self.times[start:],
+            {
+                metric_name: {key: values[start:] for key,values in metric.items()}
+                for metric_name,metric in self.metrics.items()
+            },
+        )
+
+
+    def _run_slices(self,
+                    time_slice:float,
+                    sim_time:float,
+                    resume:bool,
+                    convergence:ConvergenceMonitor,
+                    adaptive:AdaptiveTimeSlice,
+                    telemetry:TelemetryServer,
+                    memory:MemoryMonitor
+    ) -> Iterator[None]:
+        """Simulation loop of run and iter_run, yields after every time slice"""
+        if not resume:
+            self.curr_time = 0.0
+            self.metrics = {}
+            self.times = []
+            self.generated = 0
+            self.report_slice = None
+            self.task_gen.reset()
+            if self.faults is not None:
+                self.faults.reset()
+            for node in MalcolmNode.all_nodes.values():
+                node.clear_latencies()
+        if adaptive is not None:
+            if not resume:
+                adaptive.reset()
+            self.report_slice = adaptive.report_slice or time_slice
+            time_slice = adaptive.clamp(time_slice)
+        if memory is not None:
+            if not resume:
+                memory.reset()
+            memory.start()
         self.logger.info("Running simulation in single-threaded mode")
-        self.metrics = {}
-        while curr_time <= sim_time:
-            self.logger.info("Simulating time slice %g ms", curr_time)
-            # Generate and distribute new tasks
+        try:
+            while self.curr_time <= sim_time:
+                self.sim_time_slice(time_slice)
+                if memory is not None:
+                    memory.update(self)
+                if adaptive is not None:
+                    time_slice = adaptive.next_slice(time_slice, self)
+                if telemetry is not None:
+                    telemetry.update(self)
+                if convergence is not None and convergence.check(self.metrics):
+                    self.logger.info(
+                        "Simulation converged at %g ms\n%s", self.curr_time, convergence.summary()
+                    )
+                    break
+                yield
+        finally:
+            if memory is not None:
+                memory.stop()
+        self.logger.info("Simulation completed")
+        if telemetry is not None:
+            telemetry.update(self, force=True)
+        if Profiler.enabled:
+            self.logger.info("Profile summary\n%s", Profiler.summary())
+
+
+    def run_engine(self, engine:str, time_slice:float, sim_time:float, **kwargs) -> None:
+        """
+        Run the simulation with one of the ENGINES: "reference" uses a fixed
+        time slice, "adaptive" an AdaptiveTimeSlice starting at time_slice.
+        Other keyword arguments are passed to run
+        """
+        if engine == "adaptive":
+            kwargs.setdefault("adaptive", AdaptiveTimeSlice(report_slice=time_slice))
+        elif engine != "reference":
+            raise ValueError(f"Unknown engine '{engine}', expected one of {', '.join(self.ENGINES)}")
+        self.run(time_slice, sim_time, **kwargs)
+
+
+    def sim_time_slice(self, time_slice:float) -> None:
+        """Simulate a single time slice of the whole cluster starting at curr_time"""
+        curr_time = self.curr_time
+        self.logger.info("Simulating time slice %g ms", curr_time)
+        if self.faults is not None:
+            self.faults.apply(curr_time)
+        # Generate and distribute new tasks
+        with Profiler.section("MalcolmSim", "TaskGen"):
             new_tasks = self.task_gen.gen_time_slice(time_slice, curr_time)
-            if new_tasks:
+        self.generated += len(new_tasks)
+        if TaskTracer.enabled:
+            TaskTracer.sample(new_tasks, curr_time)
+        if new_tasks:
+            if self.logger.isEnabledFor(logging.DEBUG):
                 msg = f"Generated {len(new_tasks)} new task(s)"
                 for task in new_tasks:
                     msg += f"\n{task}"
                 self.logger.debug(msg)
-            else:
-                self.logger.info("No new tasks generated this time slice")
-            MalcolmNode.route_packets(
-                CentralLoadBalancer.distribute(new_tasks)
+        else:
+            self.logger.info("No new tasks generated this time slice")
+        # Tasks requeued by crashed nodes are distributed again
+        for node in MalcolmNode.all_nodes.values():
+            if node.requeue_tasks:
+                new_tasks.extend(node.requeue_tasks)
+                node.requeue_tasks = []
+        with Profiler.section("MalcolmSim", "CentralLoadBalancer"):
+            packets = CentralLoadBalancer.distribute(new_tasks, curr_time)
+        with Profiler.section("MalcolmSim", "route_packets"):
+            MalcolmNode.route_packets(packets)
+        # Simulate time slice for all nodes
+        forwarded_task_packets = []
+        for node in MalcolmNode.all_nodes.values():
+            forwarded_task_packets.extend(
+                node.sim_time_slice(time_slice, curr_time)
             )
-            # Simulate time slice for all nodes
-            forwarded_task_packets = []
-            for node in MalcolmNode.all_nodes.values():
-                forwarded_task_packets.extend(
-                    node.sim_time_slice(time_slice, curr_time)
-                )
-            # Route heartbeat and forwarded task packets
+        # Route heartbeat and forwarded task packets
+        if self.faults is not None:
+            forwarded_task_packets = self.faults.filter_packets(forwarded_task_packets)
+        with Profiler.section("MalcolmSim", "route_packets"):
             MalcolmNode.route_packets(forwarded_task_packets)
-            # Collect metrics
+        # Collect metrics
+        with Profiler.section("MalcolmSim", "metrics"):
             metrics = self.get_metrics()
             if not self.metrics:
-                for metric_name in metrics:
-                    self.metrics[metric_name] = {}
-                    for node_name in MalcolmNode.all_nodes:
-                        self.metrics[metric_name][node_name] = []
+                for metric_name,values in metrics.items():
+                    self.metrics[metric_name] = {key: [] for key in values}
             for metric_name,values in metrics.items():
                 for node_name,value in values.items():
                     self.metrics[metric_name][node_name].append(value)
-            curr_time += time_slice
-            self.logger.info("End of time slice\n\n")
-        self.logger.info("Simulation completed")
+            self.times.append(curr_time)
+        self.curr_time += time_slice
+        self.time_slice = time_slice
+        self.logger.info("End of time slice\n\n")
+
+
+    def latency_histogram(self) -> Histogram:
+        """Latency of every task completed in the cluster since the start of the run"""
+        rval = Histogram()
+        for node in MalcolmNode.all_nodes.values():
+            rval.merge(node.latency_hist)
+        return rval
+
+
+    def report_metrics(self) -> Dict[str, Dict[str, List[any]]]:
+        """
+        Metrics on a uniform time grid for reporting. Metrics of runs with an
+        AdaptiveTimeSlice are resampled onto a grid of report_slice ms
+        """
+        if self.report_slice is None or not self.times:
+            return self.metrics
+        return resample(self.metrics, self.times, self.report_slice)
+
+
+    def checkpoint(self) -> Checkpoint:
+        """Snapshot the full state of this simulation (see Checkpoint)"""
+        return Checkpoint.capture(self)
 
 
     def run_async(self, time_slice:float, sim_time:float) -> None:
@@ -178,6 +520,8 @@ class MalcolmSim:
         # Main simulation loop
         while curr_time <= sim_time:
             self.logger.info("Simulating time slice %g ms", curr_time)
+            if self.faults is not None:
+                self.faults.apply(curr_time)
             # Generate and distribute new tasks
             new_tasks = self.task_gen(time_slice)
             MalcolmNode.route_packets(
@@ -202,34 +546,15 @@ class MalcolmSim:
         self.logger.info("Simulation completed")
 
 
-    def plot_all(self, file_prefix:str="") -> None:
-        """Plot the metrics collected by the simulation"""
+    def plot_all(self, file_prefix:str="", jobs:int=None, max_points:int=report.MAX_POINTS) -> None:
+        """
+        Plot the metrics collected by the simulation and write their stats.
+        Series longer than max_points are decimated with min/max envelopes and
+        figures are rendered by jobs processes (see report.write_report)
+        """
         if file_prefix and not re.match(r"^[-_]", file_prefix):
             file_prefix += "_"
-        stats = ""
-        for metric_name, metric in self.metrics.items():
-            safe_metric_name = re.sub(r"\s+", "_", metric_name)
-            # Plot
-            plt.figure(figsize=(10, 5))
-            for node_name, values in metric.items():
-                safe_node_name = re.sub(r"\s+", "_", node_name)
-                plt.plot(values, label=node_name)
-                # Stats
-                name = f"{safe_metric_name}:{safe_node_name}"
-                stats += f"{name}:min = {min(values):.3f}\n"
-                stats += f"{name}:max = {max(values):.3f}\n"
-                stats += f"{name}:avg = {sum(values)/len(values):.3f}\n"
-            plt.title(metric_name)
-            plt.xlabel("Time")
-            plt.ylabel(metric_name)
-            plt.legend()
-            plt.grid(True)
-            filename = f"{file_prefix}{safe_metric_name}.png"
-            plt.savefig(filename)
-            plt.close()
-            # Save Stats
-            with open(f"{file_prefix}stats.txt", "w", encoding="utf-8") as f:
-                f.write(stats)
+        report.write_report(self.report_metrics(), file_prefix, jobs, max_points)
 
 
     @classmethod
@@ -0,0 +1,164 @@
+"""Contains malcolm_sim.MemoryMonitor to track the memory footprint of a run"""
+
+from __future__ import annotations
+
+import gc
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List
+
+from .malcolm_node import MalcolmNode
+
+if TYPE_CHECKING:
+    from .malcolm_sim import MalcolmSim
+
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Per-node container sizes recorded every time slice
+CONTAINER_METRICS = ("Inbox Size", "TX Queue Size", "Destinations", "Resident Tasks", "Metric Samples")
+
+
+@dataclass
+class MemorySample:
+    """tracemalloc and object counts at one point in simulated time"""
+    time:float
+    current:int = 0                     # traced bytes
+    peak:int = 0
+    subsystems:Dict[str, int] = field(default_factory=dict)     # module -> traced bytes
+    objects:Dict[str, int] = field(default_factory=dict)        # class name -> live instances
+
+
+class MemoryMonitor:
+    """
+    Opt-in memory report of a run. Every time slice, the sizes of the main
+    containers of each node (CONTAINER_METRICS) are added to the metrics of
+    the simulation. Every interval simulated ms, the traced memory per module
+    of the package (allocations elsewhere count as "other") and the live
+    instances of its classes are sampled, and also added to the metrics
+    ("Memory" in bytes and "Objects", held between samples) so memory growth
+    plots next to the performance metrics. tracemalloc slows the simulation
+    down severalfold, trace=False only counts containers and objects
+    """
+
+    logger = logging.getLogger("malcolm_sim.MemoryMonitor")
+
+    def __init__(self, interval:float=100.0, trace:bool=True, objects:bool=True) -> None:
+        if interval <= 0:
+            raise ValueError("MemoryMonitor requires interval > 0")
+        self.interval:float = interval
+        self.trace:bool = trace
+        self.objects:bool = objects
+        self.samples:List[MemorySample] = []
+        self.next_sample:float = 0.0
+        self._started:bool = False     # tracemalloc was started by this monitor
+
+
+    def start(self) -> None:
+        """Start tracing allocations if trace is set"""
+        if not self.trace:
+            return
+        # tracemalloc is only loaded when memory is traced
+        import tracemalloc      # pylint: disable=import-outside-toplevel
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+
+
+    def stop(self) -> None:
+        """Stop tracing allocations if start started it"""
+        if self._started:
+            import tracemalloc      # pylint: disable=import-outside-toplevel
+            tracemalloc.stop()
+            self._started = False
+
+
+    def reset(self) -> None:
+        """Forget all samples, e.g. before a new run"""
+        self.samples = []
+        self.next_sample = 0.0
+
+
+    def update(self, sim:MalcolmSim) -> None:
+        """
+        Record the container sizes of the slice sim just simulated and take a
+        sample if it is due (NOT thread-safe, called by the simulation loop)
+        """
+        stored:Dict[str, int] = {}
+        for metric in sim.metrics.values():
+            for name,values in metric.items():
+                stored[name] = stored.get(name, 0) + len(values)
+        for name,node in MalcolmNode.all_nodes.items():
+            tx_tasks = sum(1 for packet in node.tx_queue if packet.type == "Task")
+            running = sum(1 for unit in node.schedular.cores + node.schedular.ios if unit.is_busy())
+            self._append(sim, "Inbox Size", name, len(node.task_inbox))
+            self._append(sim, "TX Queue Size", name, len(node.tx_queue))
+            self._append(sim, "Destinations", name, len(node.load_manager.possible_destinations))
+            self._append(sim, "Resident Tasks", name,
+                         node.schedular.queued() + running + len(node.task_inbox) + tx_tasks)
+            self._append(sim, "Metric Samples", name, stored.get(name, 0))
+        if sim.times[-1] >= self.next_sample:
+            self.samples.append(self.sample(sim.times[-1]))
+            self.next_sample = sim.times[-1] + self.interval
+        if self.samples:
+            last = self.samples[-1]
+            for metric_name,values in (("Memory", last.subsystems), ("Objects", last.objects)):
+                for key in set(values).union(sim.metrics.get(metric_name, ())):
+                    self._append(sim, metric_name, key, values.get(key, 0))
+
+
+    @staticmethod
+    def _append(sim:MalcolmSim, metric_name:str, key:str, value:float) -> None:
+        """Append to a metric of sim, padding series that start late with nan"""
+        values = sim.metrics.setdefault(metric_name, {}).get(key)
+        if values is None:
+            values = sim.metrics[metric_name][key] = [float("nan")] * (len(sim.times) - 1)
+        values.append(value)
+
+
+    def sample(self, curr_time:float) -> MemorySample:
+        """Sample tracemalloc and object counts now"""
+        rval = MemorySample(curr_time)
+        if self.trace:
+            import tracemalloc      # pylint: disable=import-outside-toplevel
+        if self.trace and tracemalloc.is_tracing():
+            rval.current, rval.peak = tracemalloc.get_traced_memory()
+            rval.subsystems["total"] = rval.current
+            for stat in tracemalloc.take_snapshot().statistics("filename"):
+                filename = stat.traceback[0].filename
+                if os.path.dirname(os.path.abspath(filename)) == PACKAGE_DIR:
+                    key = os.path.splitext(os.path.basename(filename))[0]
+                else:
+                    key = "other"
+                rval.subsystems[key] = rval.subsystems.get(key, 0) + stat.size
+        if self.objects:
+            for obj in gc.get_objects():
+                cls = type(obj)
+                module = cls.__module__     # a descriptor for some builtin types
+                if isinstance(module, str) and module.startswith("malcolm_sim"):
+                    rval.objects[cls.__qualname__] = rval.objects.get(cls.__qualname__, 0) + 1
+        self.logger.debug("Memory at %g ms: %d bytes traced", curr_time, rval.current)
+        return rval
+
+
+    def summary(self) -> Dict[str, any]:
+        """
+        Traced bytes and live objects of the first and last sample with their
+        growth, largest first, and the peak of traced memory
+        """
+        if not self.samples:
+            return {"samples": 0}
+        first, last = self.samples[0], self.samples[-1]
+        def growth(start:Dict[str, int], end:Dict[str, int]) -> Dict[str, Dict[str, int]]:
+            return {
+                key: {"first": start.get(key, 0), "last": value, "growth": value - start.get(key, 0)}
+                for key,value in sorted(end.items(), key=lambda item: -item[1])
+            }
+        return {
+            "samples": len(self.samples),
+            "interval": self.interval,
+            "peak": max(sample.peak for sample in self.samples),
+            "subsystems": growth(first.subsystems, last.subsystems),
+            "objects": growth(first.objects, last.objects),
+        }
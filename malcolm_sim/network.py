@@ -3,11 +3,16 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Iterable, List, Tuple
+from typing import Dict, Iterable, List, Tuple
 
 
 class Network:
-    """Network subsystem to limit outgoing bandwidth"""
+    """
+    Network subsystem to limit outgoing bandwidth. With a batch_size above 1,
+    packets to the same destination are coalesced into "Batch" packets (whose
+    data is the list of coalesced packets) of up to batch_size packets, each
+    paying the header overhead once
+    """
 
     @dataclass
     class Packet:
@@ -19,28 +24,93 @@ class Network:
         type:str
         attrs:dict
 
-    def __init__(self, bandwidth:int) -> None:
-        """Bandwidth is measured in bits/s"""
+    def __init__(self, bandwidth:int, header:int=0, batch_size:int=1) -> None:
+        """Bandwidth is measured in bits/s, header in bytes per sent packet"""
+        if batch_size < 1:
+            raise ValueError("Network requires batch_size >= 1")
         self.bandwidth = bandwidth
-        self.utilization:float = 0
+        self.header:int = header
+        self.batch_size:int = batch_size
+        self.utilization:float = 0      # bits/s sent in the last time slice
+        self.credit:float = 0           # bytes that may still be sent
 
     def sim_time_slice(self, time_slice:float, packets:Iterable[Packet]) \
         -> Tuple[List[Packet], List[Packet]]:
         """
-        Limit outgoing bandwidth. First return element is sent packets, second
-        are throttled packets (NOT thread-safe)
+        Limit outgoing bandwidth. Packets are sent in order while the bytes of
+        this time slice (plus bytes left over while packets were waiting, so
+        packets larger than a slice eventually go) last. First return element
+        is sent packets (batches if coalescing), second are throttled packets,
+        never batched (NOT thread-safe)
         """
-        send = []
-        throttle = []
-        limit = int((self.bandwidth/8)*time_slice*1000)
+        packets = list(packets)
+        self.credit += self.bandwidth / 8 * time_slice / 1000
+        rest:List[Network.Packet] = []
+        if self.batch_size > 1:
+            # Only coalesce what fits this time slice, the rest cannot be sent
+            # anyway. Every batch_size-th packet to a destination starts a
+            # batch and pays the header
+            window = 0
+            total = 0
+            counts:Dict[str, int] = {}
+            for packet in packets:
+                count = counts.get(packet.dest, 0)
+                total += packet.size + (self.header if count % self.batch_size == 0 else 0)
+                if total > self.credit:
+                    break
+                counts[packet.dest] = count + 1
+                window += 1
+            packets, rest = self.coalesce(packets[:window]), packets[window:]
+        sent = 0
         count = 0
-        self.utilization = 8*sum([packet.size for packet in packets])
         for packet in packets:
-            if count+packet.size <= limit:
-                send.append(packet)
+            size = packet.size + self.header
+            if sent + size > self.credit:
+                break
+            sent += size
+            count += 1
+        self.credit -= sent
+        if count == len(packets) and not rest:
+            # Idle links do not save up bandwidth
+            self.credit = 0
+        self.utilization = 8 * sent / (time_slice / 1000) if time_slice > 0 else 0
+        if self.batch_size > 1:
+            return (packets[:count], self.unpack(packets[count:]) + rest)
+        return (packets[:count], packets[count:])
+
+
+    def coalesce(self, packets:List[Packet]) -> List[Packet]:
+        """
+        Merge packets into batches of up to batch_size packets per destination,
+        in order of the first packet to each destination. Single packets are
+        not wrapped
+        """
+        groups:Dict[str, List[Network.Packet]] = {}
+        for packet in packets:
+            groups.setdefault(packet.dest, []).append(packet)
+        rval = []
+        for dest,group in groups.items():
+            for start in range(0, len(group), self.batch_size):
+                batch = group[start:start+self.batch_size]
+                if len(batch) == 1:
+                    rval.append(batch[0])
+                else:
+                    rval.append(Network.Packet(
+                        batch, sum(x.size for x in batch), batch[0].src, dest, "Batch", None
+                    ))
+        return rval
+
+
+    @staticmethod
+    def unpack(packets:Iterable[Packet]) -> List[Packet]:
+        """The packets of batches, other packets as they are"""
+        rval = []
+        for packet in packets:
+            if packet.type == "Batch":
+                rval.extend(packet.data)
             else:
-                throttle.append(packet)
-        return (send, throttle)
+                rval.append(packet)
+        return rval
 
     def availability(self) -> int:
         """Returns the unutilized bandwidth of the interface in bits/s (NOT thread-safe)"""
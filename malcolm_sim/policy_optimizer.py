@@ -3,20 +3,62 @@
 from __future__ import annotations
 
 import logging
-import numpy as np
+import math
+from typing import Dict
 
+from malcolm_sim.heartbeat import Heartbeat
 from malcolm_sim.load_manager import LoadManager
 
 # from .malcolm_node import MalcolmNode
 
 
 class PolicyOptimizer:
-    """Tracks heartbeats from other Nodes sends adjustments to the Load Manager"""
-
-    def __init__(self, name:(str|int), node) -> None:
+    """
+    Tracks heartbeats from other Nodes sends adjustments to the Load Manager.
+    By default the policy is adjusted every time slice from the latest loads.
+
+    epoch: ms between decisions
+    imbalance_threshold: also decide when the imbalance of this node crosses
+        above the threshold
+    heartbeat_delta: also decide when the load of any node moved by more than
+        delta since the last decision
+    smoothing: EWMA weight of the newest load observation (1 is no smoothing)
+    """
+
+    def __init__(self, name:(str|int), node,
+                 epoch:float=None,
+                 imbalance_threshold:float=None,
+                 heartbeat_delta:float=None,
+                 smoothing:float=1.0) -> None:
+        if epoch is not None and epoch <= 0:
+            raise ValueError("PolicyOptimizer requires epoch > 0")
+        if not 0 < smoothing <= 1:
+            raise ValueError("PolicyOptimizer requires 0 < smoothing <= 1")
         self.name = str(name)
         self.node = node
         self.logger = logging.getLogger(f"malcolm_sim.MalcolmNode.PolicyOptimizer:{self.name}")
+        self.epoch:float = epoch
+        self.imbalance_threshold:float = imbalance_threshold
+        self.heartbeat_delta:float = heartbeat_delta
+        self.smoothing:float = smoothing
+        self.elapsed:float = 0.0                    # ms since the last decision
+        self.heartbeats:Dict[str, Heartbeat] = {}   # latest heartbeats of live peers
+        self.loads:Dict[str, float] = {}            # (smoothed) loads of this node and its peers
+        self.decision_loads:Dict[str, float] = {}   # loads at the last decision
+        self.imbalanced:bool = False                # imbalance above imbalance_threshold
+        self.cost:int = 0                           # loads evaluated so far
+        self.decisions:int = 0
+        self.changes:int = 0                        # decisions that changed the policy
+
+    @classmethod
+    def from_config(cls, name:(str|int), node, config:dict) -> PolicyOptimizer:
+        """Create a PolicyOptimizer from config dict. Assumes schema is validated"""
+        return cls(name, node, **config)
+
+    @property
+    def triggered(self) -> bool:
+        """True if decisions are taken on triggers"""
+        return self.imbalance_threshold is not None or self.heartbeat_delta is not None
 
     def utility(self, current_load, other_loads):
         """Compute the reward as the negative of the load imbalance."""
@@ -30,10 +72,66 @@ class PolicyOptimizer:
         imbalance = (current_load - avg_load)
         return -imbalance
 
-    def sim_time_slice(self, time_slice:float, load_manager:LoadManager) -> None:
+    def observe(self) -> Dict[str, float]:
+        """
+        Update the (smoothed) loads of this node and its peers from their
+        heartbeats. Infinite loads are stored as they are
+        """
+        observed = {self.node.name: _load(len(self.node.schedular.queue), self.node.schedular.expected_performance())}
+        for key, value in self.heartbeats.items():
+            observed[key] = _load(value.queue_size, value.expected_performance)
+        self.cost += len(observed)
+        if self.smoothing < 1:
+            for key, value in observed.items():
+                # Infinite loads (no working units) are not averaged, the
+                # average restarts at the first finite load after them
+                previous = self.loads.get(key)
+                if previous is not None and math.isfinite(previous) and math.isfinite(value):
+                    observed[key] = self.smoothing * value + (1 - self.smoothing) * previous
+        self.loads = observed
+        return observed
+
+    def due(self) -> bool:
+        """True if a decision is due at an epoch boundary or on a trigger"""
+        if self.epoch is None and not self.triggered:
+            return True
+        if self.epoch is not None and self.elapsed >= self.epoch:
+            return True
+        if self.triggered:
+            load = self.loads[self.node.name]
+            previous = self.decision_loads.get(self.node.name)
+            if previous is not None and math.isinf(load) != math.isinf(previous):
+                self.logger.debug("Working units lost or recovered")
+                return True
+        if self.imbalance_threshold is not None:
+            load = self.loads[self.node.name]
+            loads = [load] + [
+                value for key, value in self.loads.items() if key != self.node.name and math.isfinite(value)
+            ]
+            imbalanced = math.isinf(load) or -self.utility(load, loads) > self.imbalance_threshold
+            crossed = imbalanced and not self.imbalanced
+            self.imbalanced = imbalanced
+            if crossed:
+                self.logger.debug("Imbalance trigger")
+                return True
+        if self.heartbeat_delta is not None:
+            for key, value in self.loads.items():
+                previous = self.decision_loads.get(key)
+                if value == previous:   # also two infinite loads
+                    continue
+                # Loads not decided on yet and changes to or from infinite loads also trigger
+                if previous is None or math.isinf(value) or math.isinf(previous) \
+                        or abs(value - previous) > self.heartbeat_delta:
+                    self.logger.debug(f"Heartbeat trigger: {key}")
+                    return True
+        return False
+
+    def sim_time_slice(self, time_slice:float, load_manager:LoadManager, curr_time:float=None) -> None:
         """
         Simulate Policy Optimizer for time_slice milliseconds.
         Makes adjustments to node.load_manager based on heartbeats of other nodes
+        at every decision epoch or trigger (every time slice by default).
+        Heartbeats that are stale at curr_time are ignored
 
         Input: 
         - α: Critic learning rate
@@ -68,32 +166,67 @@ class PolicyOptimizer:
         of cores and effiency would take.
         """
         if 0 < time_slice:
-            if self.node.other_heartbeats:
+            self.heartbeats = self.node.other_heartbeats
+            if curr_time is not None:
+                self.heartbeats = {
+                    key: value for key, value in self.heartbeats.items() if not value.is_stale(curr_time)
+                }
+            if self.heartbeats:
                 load_manager.src = self.node.name
-                load = len(self.node.schedular.queue)/self.node.schedular.expected_performance()
-                self.logger.debug(f"My load: {load}")
-                other_loads = []
-                other_nodes = {}
-                for key, value in self.node.other_heartbeats.items():
-                    other_loads.append(value.queue_size/value.expected_performance)
-                    other_nodes[key] = value.queue_size
-                for key in self.node.other_heartbeats.keys():
-                    load_manager.possible_destinations.append(f"MalcolmNode:{key}")
-                reward = self.utility(load, [load]+other_loads)
-                self.logger.debug(f"Other Nodes: {other_nodes}")
-                self.logger.debug(f"Reward: {reward}")
-                #if utility function changes inequality will need to change (which may be tricky)
-                #will also need to change if we decide we want to steal tasks
-                if reward < 0:
-                    self.logger.debug(f"Increase forward policy: accept {load_manager.accept}, forward: {load_manager.forward}")
-                    load_manager.accept = max(0, load_manager.accept - round(1/(1+len(other_nodes))**2, 2))
-                    load_manager.forward = min(1, load_manager.forward + round(1/(1+len(other_nodes))**2, 2))
-                elif reward > 0:
-                    self.logger.debug(f"Increase accept policy: accept {load_manager.accept}, forward: {load_manager.forward}")
-                    load_manager.accept = min(1, load_manager.accept + round(1/(1+len(other_nodes))**2, 2))
-                    load_manager.forward = max(0, load_manager.forward - round(1/(1+len(other_nodes))**2, 2))
-                else:
-                    self.logger.debug(f"Keep policy: accept {load_manager.accept}, forward: {load_manager.forward}")
-
+                self.elapsed += time_slice
+                # Every time slice, or only at decisions if nothing needs the loads in between
+                if self.smoothing < 1 or self.triggered or self.epoch is None or self.elapsed >= self.epoch:
+                    self.observe()
+                if not self.due():
+                    return
+                self.elapsed = 0.0
+                self.decide(load_manager)
             else:
                 self.logger.debug("no heart beats")
+
+    def decide(self, load_manager:LoadManager) -> None:
+        """Adjust the accept and forward policy of load_manager to the current loads"""
+        loads = self.loads
+        load = loads[self.node.name]
+        self.logger.debug(f"My load: {load}")
+        other_loads = []
+        other_nodes = {}
+        for key, value in self.heartbeats.items():
+            # Peers without working units take no share of the load
+            if math.isfinite(loads[key]):
+                other_loads.append(loads[key])
+            other_nodes[key] = value.queue_size
+        for key in self.heartbeats.keys():
+            dest = f"MalcolmNode:{key}"
+            if dest not in load_manager.possible_destinations:
+                load_manager.possible_destinations.append(dest)
+        reward = self.utility(load, [load]+other_loads) if math.isfinite(load) else None
+        self.logger.debug(f"Other Nodes: {other_nodes}")
+        self.logger.debug(f"Reward: {reward}")
+        policy = (load_manager.accept, load_manager.forward)
+        #if utility function changes inequality will need to change (which may be tricky)
+        #will also need to change if we decide we want to steal tasks
+        if math.isinf(load):
+            # No working units, forward everything until they recover
+            self.logger.debug("No working units, forward all tasks")
+            load_manager.accept = 0
+            load_manager.forward = 1
+        elif reward < 0:
+            self.logger.debug(f"Increase forward policy: accept {load_manager.accept}, forward: {load_manager.forward}")
+            load_manager.accept = max(0, load_manager.accept - round(1/(1+len(other_nodes))**2, 2))
+            load_manager.forward = min(1, load_manager.forward + round(1/(1+len(other_nodes))**2, 2))
+        elif reward > 0:
+            self.logger.debug(f"Increase accept policy: accept {load_manager.accept}, forward: {load_manager.forward}")
+            load_manager.accept = min(1, load_manager.accept + round(1/(1+len(other_nodes))**2, 2))
+            load_manager.forward = max(0, load_manager.forward - round(1/(1+len(other_nodes))**2, 2))
+        else:
+            self.logger.debug(f"Keep policy: accept {load_manager.accept}, forward: {load_manager.forward}")
+        self.decisions += 1
+        if (load_manager.accept, load_manager.forward) != policy:
+            self.changes += 1
+        self.decision_loads = dict(loads)
+
+
+def _load(queue_size:int, expected_performance:float) -> float:
+    """Queue length over performance, infinite for a node without working units"""
+    return queue_size / expected_performance if expected_performance > 0 else float("inf")
@@ -0,0 +1,127 @@
+"""Contains malcolm_sim.Profiler for per-subsystem wall-clock profiling"""
+
+from __future__ import annotations
+
+import time
+from typing import Dict, List, Tuple
+
+
+class _Section:
+    """Context manager adding the elapsed time of its body to a Profiler counter"""
+
+    __slots__ = ("counter", "start")
+
+    def __init__(self, counter:List[int]) -> None:
+        self.counter = counter
+        self.start = 0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *_) -> None:
+        self.counter[0] += time.perf_counter_ns() - self.start
+        self.counter[1] += 1
+
+
+class _NullSection:
+    """Context manager that does nothing, used while profiling is disabled"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *_) -> None:
+        pass
+
+
+class Profiler:
+    """
+    Monotonic-clock counters of wall time and call count per subsystem and
+    scope (a Malcolm Node name or "MalcolmSim"). Disabled by default, in which
+    case sections cost a single attribute lookup and an empty context manager
+    """
+
+    enabled:bool = False
+
+    # (scope, subsystem) -> [total ns, calls]
+    counters:Dict[Tuple[str,str], List[int]] = {}
+
+    _null_section = _NullSection()
+
+
+    @classmethod
+    def enable(cls) -> None:
+        """Start collecting timings"""
+        cls.enabled = True
+
+
+    @classmethod
+    def disable(cls) -> None:
+        """Stop collecting timings. Collected timings are kept"""
+        cls.enabled = False
+
+
+    @classmethod
+    def reset(cls) -> None:
+        """Clear all collected timings"""
+        cls.counters = {}
+
+
+    @classmethod
+    def section(cls, scope:str, subsystem:str) -> (_Section|_NullSection):
+        """Context manager timing its body as subsystem of scope"""
+        if not cls.enabled:
+            return cls._null_section
+        key = (scope, subsystem)
+        if (counter := cls.counters.get(key)) is None:
+            counter = cls.counters[key] = [0, 0]
+        return _Section(counter)
+
+
+    @classmethod
+    def stats(cls) -> List[Dict[str, any]]:
+        """Collected timings with one entry per scope and subsystem"""
+        return [
+            {
+                "scope": scope,
+                "subsystem": subsystem,
+                "seconds": ns / 1e9,
+                "calls": calls,
+            }
+            for (scope, subsystem),(ns, calls) in cls.counters.items()
+        ]
+
+
+    @classmethod
+    def totals(cls) -> Dict[str, Dict[str, float]]:
+        """Collected timings summed over all scopes, per subsystem"""
+        rval = {}
+        for (_, subsystem),(ns, calls) in cls.counters.items():
+            total = rval.setdefault(subsystem, {"seconds": 0.0, "calls": 0})
+            total["seconds"] += ns / 1e9
+            total["calls"] += calls
+        return rval
+
+
+    @classmethod
+    def summary(cls, per_scope:bool=False) -> str:
+        """
+        Table of the collected timings per subsystem, slowest first. If
+        per_scope is True, each node and the MalcolmSim loop get their own rows
+        """
+        if per_scope:
+            totals = {
+                f"{scope}:{subsystem}": {"seconds": ns / 1e9, "calls": calls}
+                for (scope, subsystem),(ns, calls) in cls.counters.items()
+            }
+        else:
+            totals = cls.totals()
+        grand_total = sum(x["seconds"] for x in totals.values()) or 1
+        width = max([24] + [len(x) for x in totals])
+        rval = f"{'Subsystem':<{width}} {'Total (s)':>10} {'Calls':>10} {'us/call':>10} {'%':>6}"
+        for subsystem,x in sorted(totals.items(), key=lambda x: -x[1]["seconds"]):
+            per_call = 1e6 * x["seconds"] / x["calls"] if x["calls"] else 0
+            rval += f"\n{subsystem:<{width}} {x['seconds']:>10.4f} {x['calls']:>10d}" \
+                + f" {per_call:>10.2f} {100*x['seconds']/grand_total:>6.1f}"
+        return rval
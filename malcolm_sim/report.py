@@ -0,0 +1,127 @@
+"""
+Fast reporting of the metrics collected by MalcolmSim: vectorized statistics,
+min/max envelope decimation of long series and figures rendered in parallel
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+MAX_POINTS = 4000      # samples per plotted series before decimation
+
+logger = logging.getLogger("malcolm_sim.report")
+
+
+def safe_name(name:str) -> str:
+    """Replace whitespace for use in filenames and stats keys"""
+    return re.sub(r"\s+", "_", name)
+
+
+def compute_stats(metrics:Dict[str, Dict[str, List[float]]]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Min, max and average of every metric of every node"""
+    rval = {}
+    for metric_name,metric in metrics.items():
+        names = list(metric.keys())
+        values = np.asarray([metric[name] for name in names], dtype=float)
+        if values.ndim != 2 or values.shape[1] == 0:
+            continue
+        mins = values.min(axis=1)
+        maxs = values.max(axis=1)
+        avgs = values.mean(axis=1)
+        rval[metric_name] = {
+            name: {"min": float(mins[i]), "max": float(maxs[i]), "avg": float(avgs[i])}
+            for i,name in enumerate(names)
+        }
+    return rval
+
+
+def format_stats(stats:Dict[str, Dict[str, Dict[str, float]]]) -> str:
+    """Format statistics as 'metric:node:stat = value' lines"""
+    lines = []
+    for metric_name,metric in stats.items():
+        for node_name,values in metric.items():
+            name = f"{safe_name(metric_name)}:{safe_name(node_name)}"
+            for stat in ("min", "max", "avg"):
+                lines.append(f"{name}:{stat} = {values[stat]:.3f}")
+    return "\n".join(lines) + "\n"
+
+
+def decimate(values:np.ndarray, max_points:int=MAX_POINTS) \
+    -> Tuple[np.ndarray, np.ndarray, (np.ndarray|None), (np.ndarray|None)]:
+    """
+    Reduce a series to at most max_points buckets. Returns the x position,
+    mean, min and max of every bucket. Short series are returned unchanged
+    with None for min and max
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n), values, None, None
+    size = -(-n // max_points)      # ceil
+    buckets = n // size
+    body = values[:buckets*size].reshape(buckets, size)
+    x = np.arange(buckets) * size + (size-1) / 2
+    mean, lo, hi = body.mean(axis=1), body.min(axis=1), body.max(axis=1)
+    if n > buckets*size:            # partial last bucket
+        tail = values[buckets*size:]
+        x = np.append(x, buckets*size + (len(tail)-1) / 2)
+        mean = np.append(mean, tail.mean())
+        lo = np.append(lo, tail.min())
+        hi = np.append(hi, tail.max())
+    return x, mean, lo, hi
+
+
+def render_figure(title:str, series:Dict[str, Tuple[np.ndarray, ...]], filename:str) -> str:
+    """Render one metric figure. Runs in worker processes"""
+    import matplotlib                   # pylint: disable=import-outside-toplevel
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt     # pylint: disable=import-outside-toplevel
+    plt.figure(figsize=(10, 5))
+    for node_name,(x, mean, lo, hi) in series.items():
+        line, = plt.plot(x, mean, label=node_name)
+        if lo is not None:
+            plt.fill_between(x, lo, hi, color=line.get_color(), alpha=0.25, linewidth=0)
+    plt.title(title)
+    plt.xlabel("Time")
+    plt.ylabel(title)
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(filename)
+    plt.close()
+    return filename
+
+
+def write_report(metrics:Dict[str, Dict[str, List[float]]], file_prefix:str="",
+                 jobs:int=None, max_points:int=MAX_POINTS) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Write one figure per metric plus {file_prefix}stats.txt and
+    {file_prefix}stats.json. Figures are rendered by a pool of jobs processes
+    (defaults to the CPU count, 1 renders in this process). Returns the stats
+    """
+    stats = compute_stats(metrics)
+    with open(f"{file_prefix}stats.txt", "w", encoding="utf-8") as f:
+        f.write(format_stats(stats))
+    with open(f"{file_prefix}stats.json", "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=2)
+    figures = []
+    for metric_name,metric in metrics.items():
+        series = {
+            node_name: decimate(values, max_points)
+            for node_name,values in metric.items()
+        }
+        figures.append((metric_name, series, f"{file_prefix}{safe_name(metric_name)}.png"))
+    if jobs == 1 or len(figures) <= 1:
+        for args in figures:
+            render_figure(*args)
+    else:
+        from concurrent.futures import ProcessPoolExecutor     # pylint: disable=import-outside-toplevel
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for filename in pool.map(render_figure, *zip(*figures)):
+                logger.debug("Wrote %s", filename)
+    return stats
@@ -0,0 +1,290 @@
+"""
+Contains malcolm_sim.ResultStore, an SQLite store of simulation runs to
+compare sweeps without re-simulating
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import sqlite3
+
+
+CHUNK_SIZE = 4096       # samples per stored series chunk
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created REAL,
+    config_hash TEXT,
+    seed TEXT,              -- 128 bit entropy does not fit INTEGER
+    engine TEXT,
+    time_slice REAL,
+    sim_time REAL,
+    wall_time REAL,
+    generated INTEGER,
+    config TEXT,
+    summary TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_config_hash ON runs (config_hash);
+CREATE TABLE IF NOT EXISTS params (
+    run_id INTEGER REFERENCES runs (id) ON DELETE CASCADE,
+    key TEXT,
+    value TEXT,
+    num REAL
+);
+CREATE INDEX IF NOT EXISTS params_key_value ON params (key, value);
+CREATE INDEX IF NOT EXISTS params_key_num ON params (key, num);
+CREATE INDEX IF NOT EXISTS params_run ON params (run_id);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER REFERENCES runs (id) ON DELETE CASCADE,
+    key TEXT,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS metrics_key ON metrics (key, value);
+CREATE INDEX IF NOT EXISTS metrics_run ON metrics (run_id);
+CREATE TABLE IF NOT EXISTS times (
+    run_id INTEGER REFERENCES runs (id) ON DELETE CASCADE,
+    chunk INTEGER,
+    data BLOB,
+    PRIMARY KEY (run_id, chunk)
+);
+CREATE TABLE IF NOT EXISTS series (
+    run_id INTEGER REFERENCES runs (id) ON DELETE CASCADE,
+    metric TEXT,
+    node TEXT,
+    chunk INTEGER,
+    data BLOB,
+    PRIMARY KEY (run_id, metric, node, chunk)
+);
+"""
+
+
+def flatten(data:any, prefix:str="") -> Dict[str, any]:
+    """Flatten nested dicts and lists into dotted keys, with list indices as parts"""
+    if isinstance(data, dict):
+        items = data.items()
+    elif isinstance(data, (list, tuple)):
+        items = enumerate(data)
+    else:
+        return {prefix: data}
+    rval = {}
+    for key,value in items:
+        rval.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    return rval
+
+
+def config_hash(config:dict) -> str:
+    """Stable hash of a config dict"""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResultStore:
+    """
+    SQLite store of simulation runs. Every run keeps its config (flattened
+    into indexed dotted params such as "MalcolmNodes.0.core_count"), seed,
+    engine, wall time, summary (flattened into indexed numeric metrics such as
+    "latency.p99" or "stats.CPU Util.Node0.avg") and optionally its per-slice
+    series, stored as float64 chunks of CHUNK_SIZE samples. Several processes
+    may write to the same file
+    """
+
+    logger = logging.getLogger("malcolm_sim.ResultStore")
+
+    def __init__(self, filename:str) -> None:
+        # sqlite3 is only loaded when a store is opened
+        import sqlite3      # pylint: disable=import-outside-toplevel,redefined-outer-name
+        self.filename:str = filename
+        self.conn:sqlite3.Connection = sqlite3.connect(filename, timeout=60)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SCHEMA)
+
+
+    def close(self) -> None:
+        """Close the database"""
+        self.conn.close()
+
+
+    def __enter__(self) -> ResultStore:
+        return self
+
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+    def add_run(self,
+                config:dict,
+                summary:Dict[str, any],
+                metrics:Dict[str, Dict[str, List[float]]]=None,
+                times:List[float]=None
+    ) -> int:
+        """
+        Store a run from its config and the summary of malcolm_sim.cli.simulate,
+        with the per-slice metrics sampled at times (e.g. MalcolmSim.metrics
+        and MalcolmSim.times) if given. Returns the id of the run
+        """
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (created, config_hash, seed, engine, time_slice, sim_time, wall_time,"
+                " generated, config, summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(), config_hash(config), _text(summary.get("seed", config.get("seed"))),
+                    summary.get("engine"), summary.get("time_slice"), summary.get("sim_time"),
+                    summary.get("wall_time"), summary.get("generated"),
+                    json.dumps(config, default=str), json.dumps(summary, default=str),
+                )
+            )
+            run_id = cursor.lastrowid
+            self.conn.executemany(
+                "INSERT INTO params (run_id, key, value, num) VALUES (?, ?, ?, ?)",
+                [
+                    (run_id, key, json.dumps(value, default=str), _number(value))
+                    for key,value in flatten(config).items()
+                ]
+            )
+            self.conn.executemany(
+                "INSERT INTO metrics (run_id, key, value) VALUES (?, ?, ?)",
+                [
+                    (run_id, key, _number(value)) for key,value in flatten(summary).items()
+                    if _number(value) is not None
+                ]
+            )
+            if metrics is not None and times is not None:
+                self._add_series(run_id, metrics, times)
+        self.logger.info("Stored run %d in %s", run_id, self.filename)
+        return run_id
+
+
+    def _add_series(self, run_id:int, metrics:Dict[str, Dict[str, List[float]]], times:List[float]) -> None:
+        """Store per-slice series in chunks"""
+        times = np.asarray(times, dtype="<f8")
+        self.conn.executemany(
+            "INSERT INTO times (run_id, chunk, data) VALUES (?, ?, ?)",
+            [
+                (run_id, i, times[start:start+CHUNK_SIZE].tobytes())
+                for i,start in enumerate(range(0, len(times), CHUNK_SIZE))
+            ]
+        )
+        rows = []
+        for metric_name,metric in metrics.items():
+            for node_name,values in metric.items():
+                values = np.asarray(values, dtype="<f8")
+                for i,start in enumerate(range(0, len(values), CHUNK_SIZE)):
+                    rows.append((run_id, metric_name, node_name, i, values[start:start+CHUNK_SIZE].tobytes()))
+        self.conn.executemany(
+            "INSERT INTO series (run_id, metric, node, chunk, data) VALUES (?, ?, ?, ?, ?)", rows
+        )
+
+
+    def run_ids(self, where:Dict[str, any]=None) -> List[int]:
+        """
+        Ids of the runs whose config params equal all values of where (dotted
+        keys, e.g. {"Tasks.rate.center": 0.002}). Numbers compare numerically
+        """
+        query = "SELECT id FROM runs"
+        args = []
+        for key,value in (where or {}).items():
+            query += " INTERSECT SELECT run_id FROM params WHERE key = ? AND "
+            if _number(value) is not None:
+                query += "num = ?"
+                args += [key, _number(value)]
+            else:
+                query += "value = ?"
+                args += [key, json.dumps(value, default=str)]
+        return [row[0] for row in self.conn.execute(query + " ORDER BY 1", args)]
+
+
+    def run(self, run_id:int) -> Dict[str, any]:
+        """The stored record of a run, with its config and summary"""
+        row = self.conn.execute(
+            "SELECT id, created, config_hash, seed, engine, time_slice, sim_time, wall_time,"
+            " generated, config, summary FROM runs WHERE id = ?", (run_id,)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"Run {run_id} does not exist in {self.filename}")
+        keys = ("id", "created", "config_hash", "seed", "engine", "time_slice", "sim_time",
+                "wall_time", "generated", "config", "summary")
+        rval = dict(zip(keys, row))
+        rval["seed"] = _int(rval["seed"])
+        rval["config"] = json.loads(rval["config"])
+        rval["summary"] = json.loads(rval["summary"])
+        return rval
+
+
+    def compare(self,
+                metrics:Iterable[str],
+                params:Iterable[str]=(),
+                where:Dict[str, any]=None
+    ) -> List[Dict[str, any]]:
+        """
+        Comparison table with one row per run matching where: the run id,
+        seed, engine and wall time, then the given config params and summary
+        metrics by dotted key (None if a run does not have them)
+        """
+        metrics, params = list(metrics), list(params)
+        rows = []
+        for run_id in self.run_ids(where):
+            seed, engine, wall_time = self.conn.execute(
+                "SELECT seed, engine, wall_time FROM runs WHERE id = ?", (run_id,)
+            ).fetchone()
+            row = {"id": run_id, "seed": _int(seed), "engine": engine, "wall_time": wall_time}
+            for key in params:
+                value = self.conn.execute(
+                    "SELECT value FROM params WHERE run_id = ? AND key = ?", (run_id, key)
+                ).fetchone()
+                row[key] = json.loads(value[0]) if value else None
+            for key in metrics:
+                value = self.conn.execute(
+                    "SELECT value FROM metrics WHERE run_id = ? AND key = ?", (run_id, key)
+                ).fetchone()
+                row[key] = value[0] if value else None
+            rows.append(row)
+        return rows
+
+
+    def series(self, run_id:int, metric:str, nodes:Iterable[str]=None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Sample times and per-node values of a stored metric series of a run"""
+        times = np.concatenate([
+            np.frombuffer(data, dtype="<f8") for (data,) in self.conn.execute(
+                "SELECT data FROM times WHERE run_id = ? ORDER BY chunk", (run_id,)
+            )
+        ] or [np.empty(0)])
+        chunks:Dict[str, List[np.ndarray]] = {}
+        for node,data in self.conn.execute(
+            "SELECT node, data FROM series WHERE run_id = ? AND metric = ? ORDER BY node, chunk",
+            (run_id, metric)
+        ):
+            if nodes is None or node in nodes:
+                chunks.setdefault(node, []).append(np.frombuffer(data, dtype="<f8"))
+        return times, {node: np.concatenate(values) for node,values in chunks.items()}
+
+
+    def delete(self, run_id:int) -> None:
+        """Remove a run and everything stored with it"""
+        with self.conn:
+            self.conn.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+
+
+def _number(value:any) -> (float|None):
+    """value as a float if it is a number (not a bool), else None"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, np.integer, np.floating)):
+        return None
+    return float(value)
+
+
+def _text(value:any) -> (str|None):
+    """value as a str, None stays None"""
+    return None if value is None else str(value)
+
+
+def _int(value:(str|None)) -> (int|None):
+    """Inverse of _text for ints"""
+    return None if value is None else int(value)
@@ -0,0 +1,31 @@
+"""Contains malcolm_sim.RandomStreams, reproducible per-component random number streams"""
+
+from __future__ import annotations
+
+import zlib
+from typing import Tuple
+
+from numpy.random import Generator, PCG64, SeedSequence
+
+
+def stream_key(*names:str) -> Tuple[int, ...]:
+    """Stable spawn key of a stream name (crc32 of each part)"""
+    return tuple(zlib.crc32(str(name).encode()) for name in names)
+
+
+class RandomStreams:
+    """
+    Independent numpy Generators derived from one SeedSequence. Each stream is
+    keyed by the name of its component (e.g. "MalcolmNode", "Node0",
+    "LoadManager") rather than by creation order, so a stream only depends on
+    the seed and its name, whatever the node order or thread/process layout
+    """
+
+    def __init__(self, seed:int=None) -> None:
+        """seed: root seed, fresh OS entropy if None (see the entropy attribute)"""
+        self.entropy:int = SeedSequence(seed).entropy
+
+
+    def generator(self, *names:str) -> Generator:
+        """A new Generator for the stream of the given name"""
+        return Generator(PCG64(SeedSequence(self.entropy, spawn_key=stream_key(*names))))
@@ -3,8 +3,11 @@
 from __future__ import annotations
 
 import logging
-from typing import Iterable, List
+import math
+from typing import Dict, Iterable, List
 
+from . import log   # pylint: disable=unused-import  # registers logging.TRACE
+from .slowdown import Slowdown
 from .task import Task
 from .thread_safe_list import ThreadSafeList
 
@@ -18,8 +21,15 @@ class Schedular:
     class ExecUnit:
         """Models a CPU core or IO thread"""
 
-        def __init__(self) -> None:
+        def __init__(self, perf:float=1) -> None:
             self.task:Task = None
+            self.perf:float = perf      # nominal performance multiplier
+            self.slowdown:float = 1     # current product of active Slowdown factors
+            self.failed:bool = False    # failed units take no tasks
+
+        def speed(self) -> float:
+            """Returns the current execution speed multiplier of this ExecUnit"""
+            return self.perf * self.slowdown
 
         def is_busy(self) -> bool:
             """Returns true if the ExecUnit is currently executing a task"""
@@ -33,19 +43,35 @@ class Schedular:
     def __init__(self,
                  name:(str|int),
                  core_count:int,
-                 core_perf:float,
+                 core_perf:(float|List[float]),
                  io_count:int,
-                 io_perf:float,
-                 overhead:float
+                 io_perf:(float|List[float]),
+                 overhead:float,
+                 slowdowns:Iterable[Slowdown]=None
     ) -> None:
+        """
+        core_perf and io_perf are either a single performance multiplier for
+        all units or a list with one multiplier per unit (e.g. big.LITTLE)
+        """
         self.name = str(name)
+        self.logger = logging.getLogger(f"malcolm_sim.MalcolmNode.Schedular:{self.name}")
+        core_perfs = self._unit_perfs("core_perf", core_perf, core_count)
+        io_perfs = self._unit_perfs("io_perf", io_perf, io_count)
         self.core_count:int = core_count
-        self.core_perf:float = core_perf
+        self.core_perf:float = sum(core_perfs) / core_count     # mean core performance
         self.io_count:int = io_count
-        self.io_perf:float = io_perf
+        self.io_perf:float = sum(io_perfs) / io_count           # mean IO performance
         self.overhead:float = overhead
+        self.slowdowns:List[Slowdown] = list(slowdowns) if slowdowns else []
         self.completed:int = 0
-        self.logger = logging.getLogger(f"malcolm_sim.MalcolmNode.Schedular:{self.name}")
+        # Absolute simulation time at the start of the next time slice
+        self.time:float = 0
+        # Per-stage accounting of finished stages, indexed by stage number
+        self.stage_count:List[int] = []
+        self.stage_wait:List[float] = []
+        self.stage_service:List[float] = []
+        # Set once a task with a priority arrives, queues are then served by priority
+        self.prioritized:bool = False
 
         # Queue to hold tasks pending CPU execution
         self.queue:ThreadSafeList[Task] = ThreadSafeList()
@@ -53,10 +79,10 @@ class Schedular:
         self.io_queue:List[Task] = []
         # List of tasks each core is working on
         self.cores:List[Schedular.ExecUnit] \
-            = [Schedular.ExecUnit() for _ in range(self.core_count)]
+            = [Schedular.ExecUnit(perf) for perf in core_perfs]
         # List of tasks each IO is working on
         self.ios:List[Schedular.ExecUnit] \
-            = [Schedular.ExecUnit() for _ in range(self.io_count)]
+            = [Schedular.ExecUnit(perf) for perf in io_perfs]
         # Track per core utilization (0-1)
         self.core_utilization:float = 0
         # Track per IO utilization (0-1)
@@ -78,23 +104,124 @@ class Schedular:
     def availability(self) -> float:
         """Return the system availability as the min of CPU and IO availability (thread-safe)"""
         return min(self.core_availability(), self.io_availability())
-    
+
     def expected_performance(self) -> float:
-        """Return the expected performance based on the core performance/count and io performance/count"""
-        return min(self.core_count * self.core_perf, self.io_count * self.io_perf)
+        """
+        Return the expected performance based on the current speed of all cores
+        and IOs, including active slowdowns
+        """
+        return min(
+            sum(core.speed() for core in self.cores if not core.failed),
+            sum(io.speed() for io in self.ios if not io.failed)
+        )
 
     def add_tasks(self, tasks:Iterable) -> None:
-        """Add tasks to this scheduler's queue (thread-safe)"""
-        self.queue.extend(tasks)
+        """
+        Add tasks to this scheduler's CPU queue, or IO queue for tasks whose
+        current stage is IO (thread-safe)
+        """
+        cpu_tasks = []
+        for task in tasks:
+            task.enqueue(self.time)
+            if task.priority:
+                self.prioritized = True
+            if task.stage_kind() == Task.IO:
+                self.io_queue.append(task)
+                if task.trace is not None:
+                    task.trace.append(("io_wait", self.time))
+            else:
+                cpu_tasks.append(task)
+                if task.trace is not None:
+                    task.trace.append(("cpu_wait", self.time))
+        self.queue.extend(cpu_tasks)
+
+
+    def queued(self) -> int:
+        """Return the number of tasks waiting in the CPU and IO queues (thread-safe)"""
+        return len(self.queue) + len(self.io_queue)
+
+
+    def drop_oldest(self, num:int) -> List[Task]:
+        """
+        Remove up to num tasks that waited longest, from the front of the CPU
+        queue first and then of the IO queue. Returns the removed tasks
+        (NOT thread-safe)
+        """
+        rval = []
+        while len(rval) < num and self.queue:
+            rval.append(self.queue.pop())
+        if len(rval) < num and self.io_queue:
+            count = min(num - len(rval), len(self.io_queue))
+            rval.extend(self.io_queue[:count])
+            del self.io_queue[:count]
+        return rval
+
+
+    def set_failed(self, unit:str, units:Iterable[int]=None) -> None:
+        """
+        Fail the given cpu or io units (all if None) and restore all others.
+        Tasks running on newly failed units lose the progress of their
+        current stage and go back to the front of their queue (NOT thread-safe)
+        """
+        exec_units = self.cores if unit == "cpu" else self.ios
+        failed = set(range(len(exec_units)) if units is None else units)
+        for i,exec_unit in enumerate(exec_units):
+            exec_unit.failed = i in failed
+            if exec_unit.failed and exec_unit.is_busy():
+                task = exec_unit.task
+                if task.get_attr("overhead"):
+                    task = task.get_attr("main_task")
+                exec_unit.task = None
+                task.restart_stage(self.time)
+                if unit == "cpu":
+                    self.queue.push(task)
+                else:
+                    self.io_queue.append(task)     # IO units take from the back
+
+
+    def evict(self) -> List[Task]:
+        """
+        Remove all queued and running tasks (e.g. the node crashed). Running
+        tasks lose the progress of their current stage (NOT thread-safe)
+        """
+        rval = self.queue.as_list() + self.io_queue
+        self.queue.clear()
+        self.io_queue = []
+        for exec_unit in self.cores + self.ios:
+            if exec_unit.is_busy():
+                task = exec_unit.task
+                if task.get_attr("overhead"):
+                    task = task.get_attr("main_task")
+                exec_unit.task = None
+                task.restart_stage(self.time)
+                rval.append(task)
+        return rval
+
 
+    def stage_stats(self) -> List[Dict[str,float]]:
+        """Return the mean queueing and service time of each stage number (thread-safe)"""
+        return [
+            {
+                "stage": i,
+                "count": count,
+                "wait": self.stage_wait[i] / count if count else 0,
+                "service": self.stage_service[i] / count if count else 0
+            }
+            for i,count in enumerate(self.stage_count)
+        ]
 
-    def sim_time_slice(self, time_slice:float) -> List[Task]:
+
+    def sim_time_slice(self, time_slice:float, curr_time:float=None) -> List[Task]:
         """
-        Simulate execution for time_slice milliseconds.
+        Simulate execution for time_slice milliseconds starting at curr_time.
         Returns a list of tasks that have completed execution
         (NOT thread-safe)
         """
-        curr_time:float = 0    # current time in this time slice
+        if curr_time is None:
+            curr_time = self.time
+        if self.slowdowns:
+            self.apply_slowdowns(curr_time)
+        slice_time:float = 0    # current time in this time slice
         completed:List[Task] = []
         core_busy_time:List[float] = [0]*self.core_count
         io_busy_time:List[float] = [0]*self.io_count
@@ -105,13 +232,16 @@ class Schedular:
             for task in self.queue.as_list():
                 print("    "+str(task))
         # Simulation loop within time slice, each iteration is a single event
-        while curr_time < time_slice:
-            self.logger.debug("curr_time = +%g", curr_time)
+        while slice_time < time_slice:
+            self.logger.debug("slice_time = +%g", slice_time)
             delta_t:float = -1  # time until next event
             # Assign new tasks to idle cores
             for i,core in enumerate(self.cores):
-                if core.is_idle() and self.queue:
-                    task = self.queue.pop()
+                if core.is_idle() and self.queue and not core.failed:
+                    task = self.queue.pop_max(_priority) if self.prioritized else self.queue.pop()
+                    task.start_stage(curr_time + slice_time)
+                    if task.trace is not None:
+                        task.trace.append(("overhead" if self.overhead > 0 else "cpu", curr_time + slice_time))
                     # Add overhead before running task
                     core.task = self._overhead_task(task)
                     self.logger.debug(
@@ -120,7 +250,7 @@ class Schedular:
                     )
                 # idle state may have changed, check again
                 if core.is_busy():
-                    this_delta_t = core.task.cpu_remaining()
+                    this_delta_t = _time_to_finish(core.task.cpu_remaining(), self._unit_speed(core))
                     self.logger.trace(
                         "Task %s on core %d has %g ms CPU time remaining",
                         core.task.name, i, this_delta_t
@@ -138,13 +268,16 @@ class Schedular:
                     self.logger.trace("Core %d is IDLE", i)
             # Assign new tasks to idle IOs
             for i,io in enumerate(self.ios):
-                if io.is_idle() and self.io_queue:
+                if io.is_idle() and self.io_queue and not io.failed:
                     # No overhead for IO
-                    io.task = self.io_queue.pop()
+                    io.task = self._pop_io()
+                    io.task.start_stage(curr_time + slice_time)
+                    if io.task.trace is not None:
+                        io.task.trace.append(("io", curr_time + slice_time))
                     self.logger.debug("Scheduling task %s on IO %d",io.task.name, i)
                 # idle state may have changed
                 if io.is_busy():
-                    this_delta_t = io.task.io_remaining()
+                    this_delta_t = _time_to_finish(io.task.io_remaining(), io.speed())
                     self.logger.trace(
                         "Task %s on IO %d has %g ms IO time remaining",
                         io.task.name, i, this_delta_t
@@ -171,15 +304,17 @@ class Schedular:
                 )
                 raise RuntimeError(f"Schedular:{self.name} : Caught in infinite loop!")
             # bound delta t within time_slice
-            delta_t = min(delta_t, time_slice-curr_time)
+            delta_t = min(delta_t, time_slice-slice_time)
             self.logger.debug("delta_t = %g", delta_t)
+            finished = False    # zero-length stages finish in zero time
             # Simulate delta t milliseconds for each core
             for i,core in enumerate(self.cores):
                 busy = core.is_busy()
                 if busy:
                     core_busy_time[i] += delta_t
-                if busy and core.task.sim_cpu(delta_t):
+                if busy and core.task.sim_cpu(delta_t, self._unit_speed(core)):
                     # Task finished CPU portion
+                    finished = True
                     if core.task.get_attr("overhead"):
                         # finished overhead, schedular main_task
                         self.logger.trace(
@@ -187,8 +322,11 @@ class Schedular:
                             self.name, core.task.name, i
                         )
                         core.task = core.task.get_attr("main_task")
+                        if core.task.trace is not None:
+                            core.task.trace.append(("cpu", curr_time + slice_time + delta_t))
                     else:
-                        if core.task.io_time > 0:
+                        next_stage = self._finish_stage(core.task, curr_time + slice_time + delta_t)
+                        if next_stage == Task.IO:
                             # Schedule IO
                             self.io_queue.append(core.task)
                             self.logger.debug(
@@ -196,6 +334,14 @@ class Schedular:
                                 +"; adding to IO queue",
                                 self.name, core.task.name, i
                             )
+                        elif next_stage == Task.CPU:
+                            # Another CPU stage, back of the CPU queue
+                            self.queue.append(core.task)
+                            self.logger.debug(
+                                "Schedular:%s : CPU stage completed for task %s on core %d" \
+                                +"; adding to CPU queue",
+                                self.name, core.task.name, i
+                            )
                         else:
                             # task complete
                             completed.append(core.task)
@@ -209,18 +355,31 @@ class Schedular:
                 busy = io.is_busy()
                 if busy:
                     io_busy_time[i] += delta_t
-                if busy and io.task.sim_io(delta_t):
-                    # Task complete
-                    completed.append(io.task)
-                    self.logger.debug(
-                        "Schedular:%s : Completed task %s on IO %d",
-                        self.name, io.task.name, i
-                    )
+                if busy and io.task.sim_io(delta_t, io.speed()):
+                    finished = True
+                    next_stage = self._finish_stage(io.task, curr_time + slice_time + delta_t)
+                    if next_stage == Task.CPU:
+                        self.queue.append(io.task)
+                        self.logger.debug(
+                            "Schedular:%s : IO stage completed for task %s on IO %d" \
+                            +"; adding to CPU queue",
+                            self.name, io.task.name, i
+                        )
+                    elif next_stage == Task.IO:
+                        self.io_queue.append(io.task)
+                    else:
+                        # Task complete
+                        completed.append(io.task)
+                        self.logger.debug(
+                            "Schedular:%s : Completed task %s on IO %d",
+                            self.name, io.task.name, i
+                        )
                     io.task = None
             # Increment current time
-            curr_time += delta_t
-            prev_delta_t = delta_t
+            slice_time += delta_t
+            prev_delta_t = -1 if finished else delta_t
         self.logger.info("Time slice simulation complete")
+        self.time = curr_time + time_slice
         self.completed += len(completed)
         if completed:
             task_str = ""
@@ -241,6 +400,65 @@ class Schedular:
         return completed
 
 
+    def _finish_stage(self, task:Task, curr_time:float) -> (int|None):
+        """Finish the current stage of task and add it to the per-stage accounting"""
+        stage = task.stage
+        next_stage = task.finish_stage(curr_time)
+        if task.trace is not None:
+            task.trace.append((
+                "done" if next_stage is None else "io_wait" if next_stage == Task.IO else "cpu_wait",
+                curr_time
+            ))
+        while len(self.stage_count) <= stage:
+            self.stage_count.append(0)
+            self.stage_wait.append(0)
+            self.stage_service.append(0)
+        self.stage_count[stage] += 1
+        self.stage_wait[stage] += task.stage_wait[stage]
+        self.stage_service[stage] += task.stage_service[stage]
+        return next_stage
+
+
+    def apply_slowdowns(self, curr_time:float) -> None:
+        """Update the speed of all cores and IOs from the slowdowns active at curr_time"""
+        for unit_type,units in (("cpu", self.cores), ("io", self.ios)):
+            for i,unit in enumerate(units):
+                unit.slowdown = 1
+                for slowdown in self.slowdowns:
+                    if slowdown.unit == unit_type and slowdown.applies_to(i) \
+                            and slowdown.is_active(curr_time):
+                        unit.slowdown *= slowdown.factor
+
+
+    @staticmethod
+    def _unit_perfs(key:str, perf:(float|List[float]), count:int) -> List[float]:
+        """Expand a performance multiplier into a list with one multiplier per unit"""
+        if isinstance(perf, (list, tuple)):
+            if len(perf) != count:
+                raise ValueError(
+                    f"{key} has {len(perf)} entries, but there are {count} units"
+                )
+            return [float(x) for x in perf]
+        return [float(perf)] * count
+
+
+    @staticmethod
+    def _unit_speed(core:ExecUnit) -> float:
+        """Speed of a core for its current task. Schedular overhead is not scaled"""
+        if core.task.get_attr("overhead"):
+            return 1
+        return core.speed()
+
+
+    def _pop_io(self) -> Task:
+        """Take the next task of the IO queue, the last one of the highest priority"""
+        if not self.prioritized:
+            return self.io_queue.pop()
+        queue = self.io_queue
+        index = max(range(len(queue)-1, -1, -1), key=lambda i: queue[i].priority)
+        return queue.pop(index)
+
+
     def _overhead_task(self, main_task:Task) -> Task:
         """Create a schedular overhead wrapper task (thread-safe)"""
         if self.overhead <= 0:
@@ -249,24 +467,35 @@ class Schedular:
             "overhead": True,
             "main_task": main_task,
         }
-        return Task(f"overhead.{main_task.name}", self.overhead, 0, -1, attrs=attrs)
+        task = Task(f"overhead.{main_task.name}", self.overhead, 0, -1, attrs=attrs)
+        task.priority = main_task.priority
+        return task
 
 
     def __str__(self) -> str:
         """String summary of this Schedular (thread-safe)"""
         rval =  f"Schedular '{self.name}':\n"
-        rval += f"    cores:     {self.core_count}"
-        if self.core_perf != 1:
-            rval += f"  (x{self.core_perf:g})"
-        rval += f"\n    ios:       {self.io_count}"
-        if self.io_perf != 1:
-            rval += f"  (x{self.io_perf:g})"
+        rval += f"    cores:     {self.core_count}{self._perf_str(self.cores)}"
+        rval += f"\n    ios:       {self.io_count}{self._perf_str(self.ios)}"
         rval += f"\n    overhead:  {self.overhead} ms\n"
         rval += f"    CPU tasks: {len(self.queue)}\n"
         rval += f"    IO tasks:  {len(self.io_queue)}"
         return rval
 
 
+    @staticmethod
+    def _perf_str(units:List[ExecUnit]) -> str:
+        """Performance multiplier(s) of a list of units for __str__"""
+        perfs = sorted({unit.perf for unit in units}, reverse=True)
+        if perfs == [1]:
+            return ""
+        return "  (" + ", ".join(
+            f"{sum(1 for unit in units if unit.perf == perf)}x{perf:g}" if len(perfs) > 1
+            else f"x{perf:g}"
+            for perf in perfs
+        ) + ")"
+
+
     def state_str(self) -> str:
         """Details about the current state of each core and IO (thread-safe)"""
         rval = f"Schedular:{self.name}\n"
@@ -300,3 +529,15 @@ class Schedular:
                     rval += s
                     prev = "busy"
         return rval
+
+
+def _priority(task:Task) -> int:
+    """Sort key of queued tasks"""
+    return task.priority
+
+
+def _time_to_finish(remaining:float, speed:float) -> float:
+    """ms until remaining work is done at speed, infinite for a stalled unit"""
+    if speed > 0:
+        return remaining / speed
+    return 0.0 if remaining <= 0 else math.inf
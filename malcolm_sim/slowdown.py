@@ -0,0 +1,38 @@
+"""Contains malcolm_sim.Slowdown dataclass"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import List
+
+
+@dataclass
+class Slowdown:
+    """
+    Time-varying speed multiplier for CPU cores or IO units of a Schedular
+    (e.g. thermal throttling). Active from start (inclusive) to end (exclusive)
+    in milliseconds. If period is set, the window repeats every period ms.
+    """
+    factor:float
+    start:float = 0
+    end:float = None
+    period:float = None
+    unit:str = "cpu"
+    units:List[int] = None
+
+    @classmethod
+    def from_config(cls, config:dict) -> Slowdown:
+        """Create a Slowdown from config dict. Assumes schema is validated"""
+        return cls(**config)
+
+    def is_active(self, curr_time:float) -> bool:
+        """Returns True if this slowdown applies at curr_time"""
+        if curr_time < self.start:
+            return False
+        if self.period:
+            curr_time = self.start + (curr_time - self.start) % self.period
+        return self.end is None or curr_time < self.end
+
+    def applies_to(self, index:int) -> bool:
+        """Returns True if this slowdown applies to the unit at index"""
+        return self.units is None or index in self.units
@@ -3,13 +3,34 @@
 from __future__ import annotations
 
 import inspect
-from typing import Dict
+from array import array
+from typing import Dict, List, Sequence, Tuple
 
 from .network import Network
 
 
 class Task:
-    """Modules a task to be executed in a Malcolm Cluster"""
+    """
+    Modules a task to be executed in a Malcolm Cluster. A task is a sequence of
+    CPU and IO stages. Tasks created with only a runtime and io_time have a
+    single CPU stage followed by a single IO stage.
+    """
+
+    # Stage kinds
+    CPU:int = 0
+    IO:int = 1
+
+    @classmethod
+    def from_stages(cls,
+                    name:(str|int),
+                    stages:Sequence[Tuple[int,float]],
+                    payload:int,
+                    attrs:Dict[str,any]=None
+    ) -> Task:
+        """Create a task from a sequence of (kind, duration) stages"""
+        runtime = sum(t for kind,t in stages if kind == cls.CPU)
+        io_time = sum(t for kind,t in stages if kind == cls.IO)
+        return cls(name, runtime, io_time, payload, attrs, stages)
 
     def __init__(self,
                  name:(str|int),
@@ -17,6 +38,7 @@ class Task:
                  io_time:float,
                  payload:int,
                  attrs:Dict[str,any]=None,
+                 stages:Sequence[Tuple[int,float]]=None
     ) -> None:
         self.name = str(name)
         self.runtime:float = runtime        # total CPU runtime of
@@ -27,14 +49,43 @@ class Task:
         if attrs is None:
             attrs = {}
         self.attrs:Dict[str,dict] = attrs   # dictionary of attributes
+        if stages is None:
+            stages = ((self.CPU, runtime), (self.IO, io_time))
+        self.stage_kinds:bytes = bytes(kind for kind,_ in stages)
+        self.stage_times:array = array("d", (t for _,t in stages))
+        self.stage:int = 0                  # index of the current stage
+        self.stage_progress:float = 0       # executed time of the current stage
+        # Per-stage accounting in ms, filled in by the Schedular
+        self.stage_wait:array = array("d", bytes(8*len(self.stage_kinds)))
+        self.stage_service:array = array("d", bytes(8*len(self.stage_kinds)))
+        self.enqueue_time:float = 0         # time the current stage was queued
+        self.start_time:float = 0           # time the current stage was started
+        # Lifecycle transitions [(state, start time), ...] if sampled by the TaskTracer
+        self.trace:List[Tuple[str,float]] = None
+        # Higher priorities are scheduled first (see the task classes of TaskGen)
+        self.priority:int = 0
+
+    def stage_kind(self) -> (int|None):
+        """Returns the kind of the current stage, or None if the task is done"""
+        if self.stage < len(self.stage_kinds):
+            return self.stage_kinds[self.stage]
+        return None
+
+    def stage_remaining(self) -> float:
+        """Returns the remaining time of the current stage"""
+        return self.stage_times[self.stage] - self.stage_progress
 
     def cpu_remaining(self) -> float:
-        """Returns the remaining amount of CPU runtime"""
-        return self.runtime - self.progress
+        """Returns the remaining amount of CPU runtime of the current stage"""
+        if self.stage_kind() == self.CPU:
+            return self.stage_remaining()
+        return 0
 
     def io_remaining(self) -> float:
-        """Returns the remaining amount of IO time"""
-        return self.io_time - self.io_progress
+        """Returns the remaining amount of IO time of the current stage"""
+        if self.stage_kind() == self.IO:
+            return self.stage_remaining()
+        return 0
 
     def is_cpu_done(self) -> bool:
         """Returns True if the CPU portion of this task is complete"""
@@ -46,36 +97,77 @@ class Task:
 
     def is_done(self) -> bool:
         """Returns true if the task has finished execution"""
-        return self.is_cpu_done() and self.is_io_done()
+        return self.stage >= len(self.stage_kinds)
 
     def get_attr(self, key:str) -> any:
         """Get an attribute from this task, returns None of not found"""
         return self.attrs[key] if key in self.attrs else None
 
-    def sim_cpu(self, delta_t:float) -> bool:
+    def sim_cpu(self, delta_t:float, perf:float=1) -> bool:
         """
-        Simulate delta_t milliseconds of CPU time.
-        Returns True if the CPU portion of this task completes
+        Simulate delta_t milliseconds of CPU time on a core running at perf
+        times nominal speed (no progress at 0). Returns True if the current
+        CPU stage completes
         """
-        if delta_t < self.cpu_remaining():
-            self.progress += delta_t
+        remaining = self.cpu_remaining()
+        if remaining > 0 and (perf <= 0 or delta_t < remaining / perf):
+            self.progress += delta_t * perf
+            self.stage_progress += delta_t * perf
             return False
         else:
-            self.progress = self.runtime
+            self.progress += remaining
+            self.stage_progress += remaining
             return True
 
-    def sim_io(self, delta_t:float) -> bool:
+    def sim_io(self, delta_t:float, perf:float=1) -> bool:
         """
-        Simulate delta_t milliseconds of IO time.
-        Returns True if the IO portion of this task completes
+        Simulate delta_t milliseconds of IO time on an IO unit running at perf
+        times nominal speed (no progress at 0). Returns True if the current
+        IO stage completes
         """
-        if delta_t < self.io_remaining():
-            self.io_progress += delta_t
+        remaining = self.io_remaining()
+        if remaining > 0 and (perf <= 0 or delta_t < remaining / perf):
+            self.io_progress += delta_t * perf
+            self.stage_progress += delta_t * perf
             return False
         else:
-            self.progress = self.io_time
+            self.io_progress += remaining
+            self.stage_progress += remaining
             return True
 
+    def enqueue(self, curr_time:float) -> None:
+        """Mark the current stage as queued at curr_time"""
+        self.enqueue_time = curr_time
+
+    def start_stage(self, curr_time:float) -> None:
+        """Mark the current stage as started at curr_time and record its queueing time"""
+        self.stage_wait[self.stage] += curr_time - self.enqueue_time
+        self.start_time = curr_time
+
+    def restart_stage(self, curr_time:float) -> None:
+        """Discard the progress of the current stage (e.g. its unit failed) and queue it at curr_time"""
+        if self.stage_kind() == self.CPU:
+            self.progress -= self.stage_progress
+        else:
+            self.io_progress -= self.stage_progress
+        self.stage_progress = 0
+        self.enqueue_time = curr_time
+        if self.trace is not None:
+            self.trace.append(("cpu_wait" if self.stage_kind() == self.CPU else "io_wait", curr_time))
+
+    def finish_stage(self, curr_time:float) -> (int|None):
+        """
+        Record the service time of the current stage and advance to the next
+        non-empty stage. Returns the kind of the next stage or None if done
+        """
+        self.stage_service[self.stage] = curr_time - self.start_time
+        self.stage += 1
+        self.stage_progress = 0
+        while self.stage < len(self.stage_times) and self.stage_times[self.stage] <= 0:
+            self.stage += 1
+        self.enqueue_time = curr_time
+        return self.stage_kind()
+
     def make_packet(self, src:str, dest:str) -> Network.Packet:
         """Wrap a task in a network packet"""
         return Network.Packet(self, self.payload, src, dest, "Task", None)
@@ -85,6 +177,8 @@ class Task:
         rval =  f"Task '{self.name}':\n"
         rval += f"    CPU time: {self.progress:g}/{self.runtime:g} ms\n"
         rval += f"    IO time:  {self.io_progress:g}/{self.io_time:g} ms\n"
+        if len(self.stage_kinds) > 2:
+            rval += f"    Stage:    {self.stage}/{len(self.stage_kinds)}\n"
         rval += f"    Payload:  {self.payload} bytes"
         if self.attrs:
             rval += "\n    Attrs:"
@@ -1,18 +1,69 @@
-"""This file contains malcolm_sim.TaskGen and related dataclasses"""
+"""This file contains malcolm_sim.TaskGen, malcolm_sim.TaskMix and related dataclasses"""
 # pylint: disable=attribute-defined-outside-init
 
 from __future__ import annotations
 
 import logging
 from dataclasses import dataclass
-from typing import Dict, List
+from typing import Dict, List, Tuple, Union
 
-from numpy import random
+from numpy.random import Generator
 
+from .arrival import ArrivalProcess
+from .rng import RandomStreams
 from .task import Task
 from .function_call import FunctionCall
 
 
+def constant(value:float, size:int=1) -> List[float]:
+    """Constant distribution with the same signature as numpy Generator methods"""
+    return [value]*size
+
+
+def pareto(rng:Generator, shape:float, scale:float, size:int=1) -> List[float]:
+    """Pareto distribution with minimum scale (Generator.pareto is shifted to 0)"""
+    return (rng.pareto(shape, size) + 1) * scale
+
+
+def empirical(rng:Generator, values:List[float], weights:List[float]=None, size:int=1) -> List[float]:
+    """Sample the given values, with probabilities proportional to weights"""
+    p = None
+    if weights is not None:
+        total = sum(weights)
+        if len(weights) != len(values) or total <= 0:
+            raise ValueError("empirical requires one weight per value and a positive total weight")
+        p = [x / total for x in weights]
+    return rng.choice(values, size=size, p=p)
+
+
+# Defaults of the Tasks config replaced by a key of a task class
+ALTERNATIVES = {
+    "rate": ("arrival",), "arrival": ("rate",),
+    "stages": ("runtime", "io_time"), "runtime": ("stages",), "io_time": ("stages",),
+}
+
+
+def class_configs(config:dict) -> List[dict]:
+    """
+    Tasks config of every task class of the Tasks config dict, or [config]
+    without classes. The keys of the Tasks config are defaults of the
+    classes; a class setting rate replaces the default arrival and vice
+    versa, one setting stages replaces runtime and io_time and vice versa
+    """
+    if "classes" not in config:
+        return [config]
+    defaults = {key: value for key,value in config.items() if key != "classes"}
+    rval = []
+    for class_config in config["classes"]:
+        merged = dict(defaults)
+        for key in class_config:
+            for alternative in ALTERNATIVES.get(key, ()):
+                merged.pop(alternative, None)
+        merged.update(class_config)
+        rval.append(merged)
+    return rval
+
+
 @dataclass
 class GaussianParams: # pylint: disable=missing-class-docstring
     center:float
@@ -29,41 +80,97 @@ class TaskGen:
 
 
     @classmethod
-    def from_config(cls, config:dict) -> TaskGen:
-        """Create a Task Generator from config dict. Assumes schema is validated"""
+    def from_config(cls, config:dict, streams:RandomStreams=None) -> Union[TaskGen, TaskMix]:
+        """
+        Create a Task Generator from config dict. Assumes schema is validated.
+        Every distribution draws from its own stream of streams. With task
+        classes, returns a TaskMix of one Task Generator per class
+        """
+        if streams is None:
+            streams = RandomStreams()
+        if "classes" in config:
+            return TaskMix([
+                cls._from_class_config(x, streams, x["name"]) for x in class_configs(config)
+            ])
+        return cls._from_class_config(config, streams)
+
+
+    @classmethod
+    def _from_class_config(cls, config:dict, streams:RandomStreams, name:str=None) -> TaskGen:
+        """Create the Task Generator of one task class, named name (None without classes)"""
+        prefix = ("TaskGen",) if name is None else ("TaskGen", name)
+        error = "Tasks" if name is None else f"Task class '{name}'"
         kwargs = {
             "rate_func": None,
             "runtime_func": None,
             "io_time_func": None,
-            "payload_func": None
+            "payload_func": None,
+            "task_class": name
         }
         for key,params in config.items():
-            kw = f"{key}_func"
-            _type = params.pop("type")
-            if _type in ["const", "constant"]:
-                kwargs[kw] = FunctionCall(lambda x,size=1: [x]*size, params["value"])
-            elif _type in ["gaussian", "normal"]:
-                # rename kwargs for random.normal
-                _params = {"loc": params["center"], "scale":params["scale"]}
-                kwargs[kw] = FunctionCall(random.normal, **_params)
+            if key in ("name", "priority", "slo"):
+                kwargs[key if key != "name" else "task_class"] = params
+            elif "arrival" == key:
+                kwargs["arrival"] = ArrivalProcess.from_config(
+                    params, streams.generator(*prefix, "arrival")
+                )
+            elif "stages" == key:
+                kwargs["stage_funcs"] = [
+                    (
+                        Task.IO if "io" == stage["kind"] else Task.CPU,
+                        cls._func_from_config(stage["time"], streams.generator(*prefix, "stages", i))
+                    )
+                    for i,stage in enumerate(params)
+                ]
             else:
-                raise ValueError(f"Task parameter type '{_type}' is invalid")
+                kwargs[f"{key}_func"] = cls._func_from_config(params, streams.generator(*prefix, key))
+        if "stage_funcs" not in kwargs \
+                and (kwargs["runtime_func"] is None or kwargs["io_time_func"] is None):
+            raise ValueError(f"{error} require either 'runtime' and 'io_time' or 'stages'")
+        if "arrival" not in kwargs and kwargs["rate_func"] is None:
+            raise ValueError(f"{error} require either 'rate' or 'arrival'")
+        if kwargs["payload_func"] is None:
+            raise ValueError(f"{error} require 'payload'")
         return cls(**kwargs)
 
 
+    @staticmethod
+    def _func_from_config(params:dict, rng:Generator) -> FunctionCall:
+        """Create a random distribution function drawing from rng from config dict"""
+        params = dict(params)
+        _type = params.pop("type")
+        if _type in ["const", "constant"]:
+            return FunctionCall(constant, params["value"])
+        elif _type in ["gaussian", "normal"]:
+            # rename kwargs for Generator.normal
+            _params = {"loc": params["center"], "scale":params["scale"]}
+            return FunctionCall(rng.normal, **_params)
+        elif _type == "lognormal":
+            return FunctionCall(rng.lognormal, mean=params["mu"], sigma=params["sigma"])
+        elif _type == "pareto":
+            return FunctionCall(pareto, rng, params["shape"], params["scale"])
+        elif _type == "empirical":
+            return FunctionCall(empirical, rng, params["values"], params.get("weights"))
+        else:
+            raise ValueError(f"Task parameter type '{_type}' is invalid")
+
+
     @classmethod
     def new_gaussian(cls,
         rate_params:GaussianParams,
         runtime_params:GaussianParams,
         io_time_params:GaussianParams,
-        payload_params:GaussianParams
+        payload_params:GaussianParams,
+        streams:RandomStreams=None
     ) -> TaskGen:
         """Create a Task Generator from gaussian parameters"""
+        if streams is None:
+            streams = RandomStreams()
         return cls(
-            FunctionCall(random.normal, **rate_params.as_kwargs()),
-            FunctionCall(random.normal, **runtime_params.as_kwargs()),
-            FunctionCall(random.normal, **io_time_params.as_kwargs()),
-            FunctionCall(random.normal, **payload_params.as_kwargs())
+            FunctionCall(streams.generator("TaskGen", "rate").normal, **rate_params.as_kwargs()),
+            FunctionCall(streams.generator("TaskGen", "runtime").normal, **runtime_params.as_kwargs()),
+            FunctionCall(streams.generator("TaskGen", "io_time").normal, **io_time_params.as_kwargs()),
+            FunctionCall(streams.generator("TaskGen", "payload").normal, **payload_params.as_kwargs())
         )
 
 
@@ -72,20 +179,56 @@ class TaskGen:
         runtime_func:FunctionCall,
         io_time_func:FunctionCall,
         payload_func:FunctionCall,
+        stage_funcs:List[Tuple[int,FunctionCall]]=None,
+        arrival:ArrivalProcess=None,
+        task_class:str=None,
+        priority:int=0,
+        slo:float=None
     ) -> None:
+        """
+        If stage_funcs is given, tasks are made of one stage per (kind, func)
+        and runtime_func and io_time_func are not used. If arrival is given,
+        the number of tasks per time slice comes from the arrival process and
+        rate_func is not used. Tasks of a task_class carry its name and
+        latency slo (ms) in their attrs, and its priority
+        """
         self.id_count = 0
+        self.carry:float = 0
         self.rate_func = rate_func
         self.runtime_func = runtime_func
         self.io_time_func = io_time_func
         self.payload_func = payload_func
+        self.stage_funcs = stage_funcs
+        self.arrival = arrival
+        self.task_class:str = task_class
+        self.priority:int = priority
+        self.slo:float = slo
+
+
+    def reset(self) -> None:
+        """Restart task generation at time 0"""
+        self.carry = 0
+        if self.arrival is not None:
+            self.arrival.reset()
 
 
     def gen_time_slice(self, time_slice:float, curr_time:float) -> List[Task]:
         """Generate all tasks for a time slice"""
-        rate = self.rate_func(size=1)[0]
-        num_tasks = int(rate*time_slice*1000)
-        if num_tasks < 0: # zeroize negative numbers
-            num_tasks = 0
+        if self.arrival is not None:
+            num_tasks = self.arrival.count(curr_time + time_slice)
+        else:
+            rate = self.rate_func(size=1)[0]
+            # carry the fractional task over to the next slice so short slices
+            # still generate tasks at the configured rate
+            expected = rate*time_slice*1000 + self.carry
+            num_tasks = int(expected)
+            if num_tasks < 0: # zeroize negative numbers
+                num_tasks = 0
+                self.carry = 0
+            else:
+                self.carry = expected - num_tasks
+        if self.stage_funcs:
+            return self._gen_staged_tasks(num_tasks, curr_time)
         task_args:List[List[(float|int)]] = (
             self.runtime_func(size=num_tasks),
             self.io_time_func(size=num_tasks),
@@ -94,7 +237,67 @@ class TaskGen:
         tasks = []
         for args in zip(*task_args):
             _args = [x if x>0 else 0 for x in args]
-            attrs = {"gen_time": curr_time}     # must be inside loop
-            tasks.append(Task(f"#{self.id_count}", *_args, attrs=attrs))
+            tasks.append(self._classify(Task(f"#{self.id_count}", *_args, attrs=self._attrs(curr_time))))
+            self.id_count += 1
+        return tasks
+
+
+    def _gen_staged_tasks(self, num_tasks:int, curr_time:float) -> List[Task]:
+        """Generate num_tasks multi-stage tasks"""
+        kinds = [kind for kind,_ in self.stage_funcs]
+        stage_times = [func(size=num_tasks) for _,func in self.stage_funcs]
+        payloads = self.payload_func(size=num_tasks)
+        tasks = []
+        for payload,*times in zip(payloads, *stage_times):
+            stages = [(kind, t if t>0 else 0) for kind,t in zip(kinds, times)]
+            tasks.append(self._classify(Task.from_stages(
+                f"#{self.id_count}", stages, payload if payload>0 else 0, attrs=self._attrs(curr_time)
+            )))
             self.id_count += 1
         return tasks
+
+
+    def _attrs(self, curr_time:float) -> dict:
+        """New attrs of a task generated at curr_time (one dict per task)"""
+        if self.task_class is None:
+            return {"gen_time": curr_time}
+        return {"gen_time": curr_time, "class": self.task_class, "slo": self.slo}
+
+
+    def _classify(self, task:Task) -> Task:
+        """Set the priority of the task class"""
+        task.priority = self.priority
+        return task
+
+
+class TaskMix:
+    """
+    Generates the tasks of several task classes, one TaskGen per class, in
+    order of the classes every time slice. Task names are numbered across
+    classes
+    """
+
+    def __init__(self, classes:List[TaskGen]) -> None:
+        if not classes:
+            raise ValueError("TaskMix requires at least one task class")
+        names = [task_gen.task_class for task_gen in classes]
+        if None in names or len(set(names)) != len(names):
+            raise ValueError("Task classes require unique names")
+        self.classes:List[TaskGen] = classes
+        self.id_count = 0
+
+
+    def reset(self) -> None:
+        """Restart task generation at time 0"""
+        for task_gen in self.classes:
+            task_gen.reset()
+
+
+    def gen_time_slice(self, time_slice:float, curr_time:float) -> List[Task]:
+        """Generate all tasks of all classes for a time slice"""
+        tasks = []
+        for task_gen in self.classes:
+            task_gen.id_count = self.id_count
+            tasks.extend(task_gen.gen_time_slice(time_slice, curr_time))
+            self.id_count = task_gen.id_count
+        return tasks
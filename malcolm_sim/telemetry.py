@@ -0,0 +1,194 @@
+"""
+Contains malcolm_sim.TelemetryServer, a Prometheus text endpoint publishing
+live metrics of a running simulation
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+from .histogram import Histogram
+from .malcolm_node import MalcolmNode
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+    from .malcolm_sim import MalcolmSim
+
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+@dataclass
+class Snapshot:
+    """Metrics of a simulation at one point in time. Never modified once published"""
+    wall_time:float
+    curr_time:float                     # simulated ms
+    generated:int
+    speed:float                         # simulated ms per wall second
+    nodes:Dict[str, Dict[str, float]] = field(default_factory=dict)
+    latency:Histogram = None
+
+
+class TelemetryServer:
+    """
+    Serves the latest Snapshot of a simulation in the Prometheus text format
+    at http://host:port/metrics from a daemon thread. The simulation loop only
+    builds a snapshot every interval wall seconds and swaps a reference, so it
+    never waits for the server or its clients
+    """
+
+    logger = logging.getLogger("malcolm_sim.TelemetryServer")
+
+
+    def __init__(self, port:int=9464, host:str="127.0.0.1", interval:float=1.0) -> None:
+        """port 0 picks a free port (see the port attribute after start)"""
+        self.host:str = host
+        self.port:int = port
+        self.interval:float = interval
+        self.snapshot:Snapshot = None
+        self.last:Tuple[float, float, Dict[str, int]] = None   # wall time, sim time, completed
+        self.server:ThreadingHTTPServer = None
+        self.thread:threading.Thread = None
+
+
+    def start(self) -> TelemetryServer:
+        """Start serving in a daemon thread"""
+        # http.server is slow to import, only load it when serving
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer   # pylint: disable=import-outside-toplevel
+        telemetry = self
+        class Handler(BaseHTTPRequestHandler):
+            """Serves /metrics"""
+            def do_GET(self) -> None:   # pylint: disable=invalid-name
+                """Render the current snapshot"""
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args) -> None:   # pylint: disable=redefined-builtin
+                telemetry.logger.debug(format, *args)
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="Thread-TelemetryServer", daemon=True
+        )
+        self.thread.start()
+        self.logger.info("Serving metrics at http://%s:%d/metrics", self.host, self.port)
+        return self
+
+
+    def stop(self) -> None:
+        """Stop serving"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+            self.thread = None
+
+
+    def __enter__(self) -> TelemetryServer:
+        return self.start()
+
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+
+
+    def update(self, sim:MalcolmSim, force:bool=False) -> None:
+        """
+        Publish a snapshot of sim if interval wall seconds have passed since
+        the last one (NOT thread-safe, called by the simulation loop)
+        """
+        now = time.monotonic()
+        if not force and self.last is not None and now - self.last[0] < self.interval:
+            return
+        completed = {name: node.schedular.completed for name,node in MalcolmNode.all_nodes.items()}
+        speed = 0.0
+        nodes = {}
+        for name,node in MalcolmNode.all_nodes.items():
+            nodes[name] = {
+                "cpu_utilization": node.schedular.core_utilization,
+                "io_utilization": node.schedular.io_utilization,
+                "cpu_queue": len(node.schedular.queue),
+                "io_queue": len(node.schedular.io_queue),
+                "completed": completed[name],
+                "throughput": 0.0,
+                "rejected": node.rejected,
+                "dropped": node.dropped,
+                "redirected": node.redirected,
+            }
+        if self.last is not None and now > self.last[0]:
+            wall, sim_time, prev = self.last
+            speed = (sim.curr_time - sim_time) / (now - wall)
+            if sim.curr_time > sim_time:
+                for name,values in nodes.items():
+                    values["throughput"] = (completed[name] - prev.get(name, 0)) / (sim.curr_time - sim_time)
+        self.last = (now, sim.curr_time, completed)
+        # Reference swap, the server thread only ever reads complete snapshots
+        self.snapshot = Snapshot(
+            wall_time=time.time(),
+            curr_time=sim.curr_time,
+            generated=sim.generated,
+            speed=speed,
+            nodes=nodes,
+            latency=sim.latency_histogram(),
+        )
+
+
+    def reset(self) -> None:
+        """Forget the previous snapshot, e.g. before a new run"""
+        self.last = None
+        self.snapshot = None
+
+
+    def render(self) -> str:
+        """The current snapshot in the Prometheus text format (thread-safe)"""
+        snapshot = self.snapshot
+        lines:List[str] = []
+        def metric(name:str, kind:str, doc:str, samples:List[Tuple[str, float]]) -> None:
+            lines.append(f"# HELP malcolm_sim_{name} {doc}")
+            lines.append(f"# TYPE malcolm_sim_{name} {kind}")
+            for labels,value in samples:
+                lines.append(f"malcolm_sim_{name}{labels} {value:.17g}")
+        metric("up", "gauge", "1 once the simulation has published metrics",
+               [("", 0 if snapshot is None else 1)])
+        if snapshot is None:
+            return "\n".join(lines) + "\n"
+        metric("simulated_ms", "gauge", "Simulated time in ms", [("", snapshot.curr_time)])
+        metric("speed", "gauge", "Simulated ms per wall second", [("", snapshot.speed)])
+        metric("generated_total", "counter", "Tasks generated", [("", snapshot.generated)])
+        node_metrics = (
+            ("cpu_utilization", "gauge", "CPU utilization (0-1)"),
+            ("io_utilization", "gauge", "IO utilization (0-1)"),
+            ("cpu_queue", "gauge", "Tasks in the CPU queue"),
+            ("io_queue", "gauge", "Tasks in the IO queue"),
+            ("completed", "counter", "Tasks completed"),
+            ("throughput", "gauge", "Tasks completed per simulated ms since the last snapshot"),
+            ("rejected", "counter", "Tasks rejected by admission control"),
+            ("dropped", "counter", "Tasks dropped by admission control"),
+            ("redirected", "counter", "Tasks redirected by admission control"),
+        )
+        for key,kind,doc in node_metrics:
+            name = key + "_total" if kind == "counter" else key
+            metric(name, kind, doc, [
+                (f'{{node="{node}"}}', values[key]) for node,values in snapshot.nodes.items()
+            ])
+        hist = snapshot.latency
+        lines.append("# HELP malcolm_sim_latency_ms Latency of completed tasks in ms")
+        lines.append("# TYPE malcolm_sim_latency_ms summary")
+        if len(hist):
+            for q in QUANTILES:
+                lines.append(f'malcolm_sim_latency_ms{{quantile="{q:g}"}} {hist.quantile(q):.17g}')
+        lines.append(f"malcolm_sim_latency_ms_sum {hist.total:.17g}")
+        lines.append(f"malcolm_sim_latency_ms_count {len(hist)}")
+        return "\n".join(lines) + "\n"
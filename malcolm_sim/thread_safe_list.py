@@ -2,7 +2,7 @@
 
 import copy
 from threading import Lock, Condition
-from typing import Generic, Iterable, List, SupportsIndex, TypeVar
+from typing import Callable, Generic, Iterable, List, SupportsIndex, TypeVar
 
 TIMEOUT = 10
 TIMEOUT_MSG = "Dead-lock detected"
@@ -81,6 +81,16 @@ class ThreadSafeList(Generic[T]):
             self.condition.notify_all()
             return rval
 
+    def pop_max(self, key:Callable[[T], any]):
+        """Remove and return the first object with the highest key"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.list), TIMEOUT):
+                raise TimeoutError(TIMEOUT_MSG)
+            index = max(range(len(self.list)), key=lambda i: key(self.list[i]))
+            rval:T = self.list.pop(index)
+            self.condition.notify_all()
+            return rval
+
     def clear(self) -> None:
         """Clear all items from the list making it empty"""
         with self.condition:
@@ -106,3 +116,12 @@ class ThreadSafeList(Generic[T]):
     def __repr__(self):
         with self.lock:
             return repr(self.list)
+
+    def __getstate__(self):
+        with self.lock:
+            return {"list": copy.copy(self.list)}
+
+    def __setstate__(self, state):
+        self.list = state["list"]
+        self.lock = Lock()
+        self.condition = Condition(self.lock)
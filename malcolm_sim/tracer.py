@@ -0,0 +1,122 @@
+"""Contains malcolm_sim.TaskTracer for sampled per-task latency breakdowns"""
+
+from __future__ import annotations
+
+from typing import Dict, List
+
+from .histogram import Histogram
+from .task import Task
+
+
+# States of a task between lifecycle transitions, in lifecycle order
+COMPONENTS = (
+    "balancer",     # generated, until received by the first node
+    "inbox",        # received, until the Load Manager accepts or forwards it
+    "tx_queue",     # forwarded, until the Network sends it (bandwidth throttling)
+    "network",      # sent, until received by the next node
+    "cpu_wait",     # in the CPU queue of the Schedular
+    "io_wait",      # in the IO queue of the Schedular
+    "overhead",     # Schedular overhead before a CPU stage
+    "cpu",
+    "io",
+)
+
+
+class TaskTracer:
+    """
+    Timestamps every lifecycle transition of 1 in sample_every generated
+    tasks (Task.trace, a list of (state, start time) ending with "done") and
+    aggregates the time spent in each of the COMPONENTS into histograms when
+    the task completes. Disabled by default, in which case untraced tasks
+    only cost a None check per transition
+    """
+
+    enabled:bool = False
+    sample_every:int = 100
+
+    generated:int = 0       # tasks seen by sample()
+    traced:int = 0          # completed traced tasks
+    histograms:Dict[str, Histogram] = {}
+    totals:Dict[str, float] = {}
+    hops:Dict[int, int] = {}
+
+
+    @classmethod
+    def enable(cls, sample_every:int=100) -> None:
+        """Trace 1 in sample_every tasks from now on"""
+        if sample_every < 1:
+            raise ValueError("TaskTracer requires sample_every >= 1")
+        cls.sample_every = sample_every
+        cls.enabled = True
+
+
+    @classmethod
+    def disable(cls) -> None:
+        """Stop tracing new tasks. Collected histograms are kept"""
+        cls.enabled = False
+
+
+    @classmethod
+    def reset(cls) -> None:
+        """Clear all collected histograms"""
+        cls.generated = 0
+        cls.traced = 0
+        cls.histograms = {}
+        cls.totals = {}
+        cls.hops = {}
+
+
+    @classmethod
+    def sample(cls, tasks:List[Task], curr_time:float) -> None:
+        """Start the trace of every sample_every-th task of the generated tasks"""
+        for i in range((-cls.generated) % cls.sample_every, len(tasks), cls.sample_every):
+            tasks[i].trace = [("balancer", curr_time)]
+        cls.generated += len(tasks)
+
+
+    @classmethod
+    def record(cls, tasks:List[Task]) -> None:
+        """Add the breakdown of the traced tasks among completed tasks"""
+        batch:Dict[str, List[float]] = {}
+        for task in tasks:
+            trace = task.trace
+            if trace is None:
+                continue
+            durations = dict.fromkeys(COMPONENTS, 0.0)
+            for (state, start),(_, end) in zip(trace, trace[1:]):
+                # Times of one event computed along different paths may differ by rounding
+                durations[state] += max(end - start, 0.0)
+            durations["total"] = trace[-1][1] - trace[0][1]
+            for key,value in durations.items():
+                batch.setdefault(key, []).append(value)
+            hops = sum(1 for state,_ in trace if state == "tx_queue")
+            cls.hops[hops] = cls.hops.get(hops, 0) + 1
+            cls.traced += 1
+        for key,values in batch.items():
+            if key not in cls.histograms:
+                cls.histograms[key] = Histogram()
+                cls.totals[key] = 0.0
+            cls.histograms[key].add(values)
+            cls.totals[key] += sum(values)
+
+
+    @classmethod
+    def summary(cls) -> Dict[str, any]:
+        """
+        Histogram summary of every component and the end-to-end total in ms,
+        the share of each component in the total time of the traced tasks and
+        the number of tasks by forwarding hops
+        """
+        total = cls.totals.get("total", 0.0)
+        return {
+            "sample_every": cls.sample_every,
+            "traced": cls.traced,
+            "components": {
+                key: {
+                    **cls.histograms[key].summary(),
+                    "share": cls.totals[key] / total if total and key != "total" else None,
+                }
+                for key in COMPONENTS + ("total",) if key in cls.histograms
+            },
+            "hops": {str(k): v for k,v in sorted(cls.hops.items())},
+        }
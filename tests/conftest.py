@@ -0,0 +1,13 @@
+"""Fixtures shared by the tests"""
+
+import pytest
+
+from malcolm_sim import MalcolmSim
+
+
+@pytest.fixture(autouse=True)
+def reset_nodes():
+    """Malcolm Nodes are registered globally, start and end every test without any"""
+    MalcolmSim.reset()
+    yield
+    MalcolmSim.reset()
@@ -0,0 +1,75 @@
+"""Admission policies of Malcolm Nodes with a bounded queue"""
+
+from malcolm_sim import MalcolmNode, Task
+from malcolm_sim.heartbeat import Heartbeat
+
+
+def make_node(name:str, admission:str, queue_capacity:int=2) -> MalcolmNode:
+    return MalcolmNode(name, 1, 1, 1, 1, 0, 10**9, queue_capacity=queue_capacity, admission=admission)
+
+
+def make_tasks(*names:str):
+    return [Task(name, 1, 1, 1) for name in names]
+
+
+def test_reject_refuses_new_tasks():
+    node = make_node("A", "reject")
+    node.schedular.add_tasks(make_tasks("#0"))
+    admitted, packets = node.admit(make_tasks("#1", "#2", "#3"))
+    assert [task.name for task in admitted] == ["#1"]
+    assert packets == []
+    assert node.rejected == 2 and node.dropped == 0
+
+
+def test_drop_oldest_discards_queued_tasks_first():
+    node = make_node("A", "drop-oldest")
+    node.schedular.add_tasks(make_tasks("#0", "#1"))
+    admitted, _ = node.admit(make_tasks("#2"))
+    assert [task.name for task in admitted] == ["#2"]
+    assert [task.name for task in node.schedular.queue.as_list()] == ["#1"]
+    assert node.dropped == 1 and node.rejected == 0
+
+
+def test_drop_oldest_with_more_new_tasks_than_capacity():
+    node = make_node("A", "drop-oldest")
+    node.schedular.add_tasks(make_tasks("#0"))
+    admitted, _ = node.admit(make_tasks("#1", "#2", "#3"))
+    assert [task.name for task in admitted] == ["#2", "#3"]
+    assert not node.schedular.queued()
+    assert node.dropped == 2
+
+
+def test_redirect_sends_overflow_to_least_loaded_peer():
+    node = make_node("A", "redirect")
+    make_node("B", "redirect")
+    make_node("C", "redirect")
+    node.other_heartbeats = {"B": Heartbeat(1, 5), "C": Heartbeat(1, 0)}
+    node.schedular.add_tasks(make_tasks("#0", "#1"))
+    admitted, packets = node.admit(make_tasks("#2", "#3"))
+    assert admitted == []
+    assert [packet.dest for packet in packets] == ["MalcolmNode:C", "MalcolmNode:C"]
+    assert all(packet.data.attrs["redirects"] == 1 for packet in packets)
+    assert node.redirected == 2 and node.rejected == 0
+
+
+def test_redirect_skips_peers_under_backpressure_or_without_units():
+    node = make_node("A", "redirect")
+    make_node("B", "redirect")
+    make_node("C", "redirect")
+    node.other_heartbeats = {"B": Heartbeat(1, 0, backpressure=True), "C": Heartbeat(0, 0)}
+    node.schedular.add_tasks(make_tasks("#0", "#1"))
+    admitted, packets = node.admit(make_tasks("#2"))
+    assert admitted == [] and packets == []
+    assert node.rejected == 1 and node.redirected == 0
+
+
+def test_redirect_stops_after_every_peer_redirected():
+    node = make_node("A", "redirect")
+    make_node("B", "redirect")
+    node.other_heartbeats = {"B": Heartbeat(1, 0)}
+    node.schedular.add_tasks(make_tasks("#0", "#1"))
+    task = make_tasks("#2")[0]
+    task.attrs["redirects"] = 1
+    _, packets = node.admit([task])
+    assert packets == []
+    assert node.rejected == 1
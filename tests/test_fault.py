@@ -0,0 +1,67 @@
+"""Fault injection: crash accounting and slowdown faults"""
+
+import pytest
+
+from malcolm_sim import MalcolmNode, MalcolmSim, Task
+from malcolm_sim.golden import ReplayTaskGen
+
+
+TASKS = 200
+
+CONFIG = {
+    "seed": 0,
+    "MalcolmNodes": [
+        {"name": "Node0", "core_count": 4, "core_perf": 1, "io_count": 4, "io_perf": 1, "overhead": 0, "bandwidth": "1G"},
+        {"name": "Node1", "core_count": 4, "core_perf": 1, "io_count": 4, "io_perf": 1, "overhead": 0, "bandwidth": "1G"},
+    ],
+    "Tasks": {
+        "rate": {"type": "constant", "value": 0.001},
+        "runtime": {"type": "constant", "value": 1},
+        "io_time": {"type": "constant", "value": 1},
+        "payload": {"type": "constant", "value": 128},
+    },
+}
+
+
+def make_sim(faults) -> MalcolmSim:
+    """Two nodes with a fixed workload of TASKS tasks in the first 40 ms"""
+    sim = MalcolmSim.from_config({**CONFIG, "Faults": faults})
+    sim.task_gen = ReplayTaskGen([
+        (i * 40 / TASKS, f"#{i}", [(Task.CPU, 2), (Task.IO, 1)], 128, 0, {}) for i in range(TASKS)
+    ])
+    return sim
+
+
+def completed() -> int:
+    return sum(node.schedular.completed for node in MalcolmNode.all_nodes.values())
+
+
+@pytest.mark.parametrize("policy", ["lose", "requeue"])
+def test_crash_accounts_for_every_task(policy):
+    sim = make_sim([{"type": "crash", "node": "Node0", "start": 10, "end": 60, "tasks": policy}])
+    sim.run(1, 500)
+    node = MalcolmNode.all_nodes["Node0"]
+    if policy == "lose":
+        assert node.lost > 0 and node.requeued == 0
+        assert completed() + node.lost == TASKS
+    else:
+        assert node.requeued > 0 and node.lost == 0
+        assert completed() == TASKS
+    report, = sim.faults.report(sim)
+    assert report["lost"] == node.lost and report["requeued"] == node.requeued
+
+
+def test_slowdown_fault_is_removed_when_it_ends():
+    sim = make_sim([{"type": "slowdown", "node": "Node0", "start": 10, "end": 20, "factor": 0.5}])
+    schedular = MalcolmNode.all_nodes["Node0"].schedular
+    sim.run(1, 15)
+    assert len(schedular.slowdowns) == 1
+    assert all(core.slowdown == 0.5 for core in schedular.cores)
+    sim.run(1, 25, resume=True)
+    assert schedular.slowdowns == []
+    assert all(core.slowdown == 1 for core in schedular.cores)
+    # Runs from time 0 do not stack the slowdowns of earlier runs
+    sim.run(1, 15)
+    assert len(schedular.slowdowns) == 1
+    sim.faults.reset()
+    assert schedular.slowdowns == []
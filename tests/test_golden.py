@@ -0,0 +1,37 @@
+"""Recording and replaying golden traces"""
+
+from malcolm_sim.golden import GoldenTrace, diff
+
+
+CONFIG = {
+    "MalcolmNodes": [
+        {"name": "Node0", "core_count": 2, "core_perf": 1, "io_count": 2, "io_perf": 1, "overhead": 0, "bandwidth": "1G"},
+        {"name": "Node1", "core_count": 1, "core_perf": 1, "io_count": 1, "io_perf": 1, "overhead": 0, "bandwidth": "1G"},
+    ],
+    "Tasks": {
+        "payload": {"type": "constant", "value": 128},
+        "runtime": {"type": "constant", "value": 3},
+        "io_time": {"type": "constant", "value": 1},
+        "classes": [
+            {"name": "interactive", "priority": 1, "slo": 5, "rate": {"type": "constant", "value": 0.0002}},
+            {"name": "batch", "slo": 100, "rate": {"type": "constant", "value": 0.0006}},
+        ],
+    },
+}
+
+
+def test_replay_matches_recording(tmp_path):
+    reference = GoldenTrace.record(CONFIG, 1, 300)
+    reference.save(tmp_path / "trace.json.gz")
+    loaded = GoldenTrace.load(tmp_path / "trace.json.gz")
+    assert loaded.workload == reference.workload
+    assert diff(loaded, loaded.replay("reference"))["passed"]
+
+
+def test_replay_keeps_priority_and_class():
+    reference = GoldenTrace.record(CONFIG, 1, 300)
+    classes = {attrs["class"]: (priority, attrs["slo"]) for *_,priority,attrs in reference.workload}
+    assert classes == {"interactive": (1, 5), "batch": (0, 100)}
+    replay = reference.replay("reference")
+    assert replay.metrics["SLO Violations"] == reference.metrics["SLO Violations"]
+    assert diff(reference, replay)["passed"]
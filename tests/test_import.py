@@ -0,0 +1,40 @@
+"""Import time of malcolm_sim and its lazily imported dependencies"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+from malcolm_sim.benchmark import IMPORT_BUDGET, LAZY_MODULES
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# numpy is preloaded, as in Benchmark.bench_import
+CODE = "import sys, time, numpy, numpy.random\n" \
+    + "start = time.perf_counter()\n" \
+    + "import malcolm_sim\n" \
+    + "print(time.perf_counter() - start)\n" \
+    + f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+
+
+def _import(repeat:int=5):
+    """Median import time and eagerly loaded lazy modules of fresh interpreters"""
+    times = []
+    loaded = set()
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", CODE], capture_output=True, text=True, check=True, cwd=ROOT)
+        elapsed, modules = (proc.stdout.splitlines() + [""])[:2]
+        times.append(float(elapsed))
+        loaded.update(m for m in modules.split(",") if m)
+    return statistics.median(times), loaded
+
+
+def test_import_budget():
+    elapsed, _ = _import()
+    assert elapsed <= IMPORT_BUDGET, f"import malcolm_sim took {elapsed:.3f} s"
+
+
+def test_lazy_modules():
+    _, loaded = _import(repeat=1)
+    assert not loaded, f"eagerly loaded: {sorted(loaded)}"
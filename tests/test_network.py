@@ -0,0 +1,44 @@
+"""Bandwidth, header and batching accounting of the Network subsystem"""
+
+from malcolm_sim.network import Network
+
+
+def make_packets(count:int, dests=("B", "C"), size:int=100):
+    return [Network.Packet(i, size, "A", dests[i % len(dests)], "Task", None) for i in range(count)]
+
+
+def test_header_is_paid_per_packet():
+    network = Network(8 * 1000 * 1000, header=25)    # 1000 bytes per ms
+    sent, throttled = network.sim_time_slice(1, make_packets(10))
+    assert len(sent) == 8 and len(throttled) == 2
+    assert network.credit == 0
+    # The throttled packets go first in the next time slice
+    sent, throttled = network.sim_time_slice(1, throttled + make_packets(1))
+    assert [packet.data for packet in sent] == [8, 9, 0]
+
+
+def test_batches_pay_the_header_once():
+    network = Network(8 * 1000 * 1000, header=40, batch_size=4)
+    sent, throttled = network.sim_time_slice(1, make_packets(8))
+    assert [(packet.type, packet.dest, packet.size) for packet in sent] \
+        == [("Batch", "B", 400), ("Batch", "C", 400)]
+    assert [x.data for x in sent[0].data] == [0, 2, 4, 6]
+    assert throttled == []
+
+
+def test_coalesced_batches_fit_with_their_headers():
+    network = Network(8 * 1000 * 1000, header=40, batch_size=4)
+    sent, throttled = network.sim_time_slice(1, make_packets(12))
+    # Two full batches (880 bytes), a third batch would need 140 more bytes
+    assert sum(packet.size + network.header for packet in sent) == 880
+    assert all(packet.type == "Batch" for packet in sent)
+    assert [packet.data for packet in throttled] == list(range(8, 12))
+    assert network.credit == 120
+
+
+def test_idle_link_does_not_save_bandwidth():
+    network = Network(8 * 1000 * 1000, batch_size=2)
+    network.sim_time_slice(1, make_packets(2))
+    assert network.credit == 0
+    sent, throttled = network.sim_time_slice(1, make_packets(12))
+    assert len(Network.unpack(sent)) == 10 and len(throttled) == 2
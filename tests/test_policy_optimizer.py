@@ -0,0 +1,64 @@
+"""Policy Optimizer decisions, also for nodes without working units"""
+
+import math
+
+from malcolm_sim import MalcolmNode, PolicyOptimizer, Task
+from malcolm_sim.heartbeat import Heartbeat
+
+
+def make_node(name:str) -> MalcolmNode:
+    return MalcolmNode(name, 2, 1, 2, 1, 0, 10**9)
+
+
+def make_tasks(count:int):
+    return [Task(f"#{i}", 1, 1, 1) for i in range(count)]
+
+
+def decide(node:MalcolmNode, **heartbeats:Heartbeat) -> None:
+    node.other_heartbeats = heartbeats
+    node.policy_optimizer.sim_time_slice(1, node.load_manager, 0)
+
+
+def test_overloaded_node_forwards_more():
+    node = make_node("A")
+    make_node("B")
+    node.schedular.add_tasks(make_tasks(10))
+    decide(node, B=Heartbeat(2, 0))
+    assert node.load_manager.accept < 1 and node.load_manager.forward > 0
+
+
+def test_node_without_working_units_forwards_everything():
+    node = make_node("A")
+    make_node("B")
+    node.schedular.set_failed("cpu")
+    decide(node, B=Heartbeat(2, 3))
+    assert (node.load_manager.accept, node.load_manager.forward) == (0, 1)
+
+
+def test_peers_without_working_units_are_left_out():
+    node = make_node("A")
+    make_node("B")
+    make_node("C")
+    node.schedular.add_tasks(make_tasks(4))
+    decide(node, B=Heartbeat(0, 3), C=Heartbeat(2, 4))
+    # Load 2 against C at 2: balanced, B does not turn the reward into NaN
+    assert (node.load_manager.accept, node.load_manager.forward) == (1, 0)
+    assert not any(math.isnan(x) for x in (node.load_manager.accept, node.load_manager.forward))
+
+
+def test_triggers_fire_when_working_units_are_lost_and_recovered():
+    node = make_node("A")
+    make_node("B")
+    for optimizer in (PolicyOptimizer("A", node, heartbeat_delta=1.0),
+                      PolicyOptimizer("A", node, imbalance_threshold=1.0)):
+        node.policy_optimizer = optimizer
+        node.load_manager.accept, node.load_manager.forward = 1, 0
+        decide(node, B=Heartbeat(2, 0))
+        decisions = optimizer.decisions
+        node.schedular.set_failed("cpu")
+        decide(node, B=Heartbeat(2, 0))
+        assert optimizer.decisions == decisions + 1
+        assert (node.load_manager.accept, node.load_manager.forward) == (0, 1)
+        node.schedular.set_failed("cpu", [])
+        decide(node, B=Heartbeat(2, 0))
+        assert optimizer.decisions == decisions + 2
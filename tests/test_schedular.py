@@ -0,0 +1,69 @@
+"""Stage routing of the intra-node Schedular"""
+
+from malcolm_sim import Schedular, Task
+
+
+def run(schedular:Schedular, tasks, sim_time:int=100):
+    """Completion time (end of the 1 ms slice) of every task by name"""
+    schedular.add_tasks(tasks)
+    done = {}
+    for t in range(sim_time):
+        for task in schedular.sim_time_slice(1, t):
+            done[task.name] = t + 1
+    return done
+
+
+def test_stages_alternate_between_cpu_and_io():
+    schedular = Schedular("s", 1, 1, 1, 1, 0)
+    task = Task.from_stages("#0", [(Task.CPU, 2), (Task.IO, 3), (Task.CPU, 1), (Task.CPU, 2)], 1)
+    assert run(schedular, [task]) == {"#0": 8}
+    assert [x["count"] for x in schedular.stage_stats()] == [1, 1, 1, 1]
+    assert [x["service"] for x in schedular.stage_stats()] == [2, 3, 1, 2]
+
+
+def test_io_stages_overlap_with_cpu_stages():
+    schedular = Schedular("s", 1, 1, 1, 1, 0)
+    tasks = [Task.from_stages(f"#{i}", [(Task.CPU, 2), (Task.IO, 2)], 1) for i in range(2)]
+    # The IO stage of #0 runs while #1 is on the core
+    assert run(schedular, tasks) == {"#0": 4, "#1": 6}
+
+
+def test_io_first_task_starts_in_io_queue():
+    schedular = Schedular("s", 1, 1, 1, 1, 0)
+    task = Task.from_stages("#0", [(Task.IO, 2), (Task.CPU, 1)], 1)
+    schedular.add_tasks([task])
+    assert len(schedular.io_queue) == 1 and not schedular.queue
+    assert run(schedular, []) == {"#0": 3}
+
+
+def test_zero_length_stages_complete_without_time():
+    schedular = Schedular("s", 1, 1, 1, 1, 0)
+    tasks = [
+        Task("#0", 0, 0, 1),
+        Task.from_stages("#1", [(Task.CPU, 0), (Task.IO, 0), (Task.CPU, 0)], 1),
+        Task.from_stages("#2", [(Task.CPU, 2), (Task.IO, 0), (Task.CPU, 0)], 1),
+    ]
+    assert run(schedular, tasks) == {"#0": 1, "#1": 1, "#2": 2}
+    # Empty stages after the first are skipped, not queued
+    assert [x["count"] for x in schedular.stage_stats()] == [3]
+    assert not schedular.queue and not schedular.io_queue
+
+
+def prioritized(name:str, priority:int, stages=((Task.CPU, 1),)) -> Task:
+    task = Task.from_stages(name, stages, 1)
+    task.priority = priority
+    return task
+
+
+def test_higher_priorities_run_first():
+    schedular = Schedular("s", 1, 1, 1, 1, 0)
+    tasks = [prioritized("#0", 0), prioritized("#1", 0), prioritized("#2", 1), prioritized("#3", 2)]
+    done = run(schedular, tasks)
+    assert sorted(done, key=done.get) == ["#3", "#2", "#0", "#1"]
+
+
+def test_higher_priorities_run_first_on_io():
+    schedular = Schedular("s", 1, 1, 1, 1, 0)
+    tasks = [prioritized(f"#{i}", i % 2, [(Task.IO, 1)]) for i in range(4)]
+    done = run(schedular, tasks)
+    assert max(done["#1"], done["#3"]) < min(done["#0"], done["#2"])